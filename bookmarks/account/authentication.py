@@ -1,6 +1,80 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import FileField
 
-from account.models import Profile
+from account.models import Profile, normalize_email
+
+# Поля, которые хранятся в кеше пользователей: все, кроме хеша пароля.
+# Для проверки сессии вместо него хранится get_session_auth_hash()
+USER_FIELDS = [field for field in User._meta.concrete_fields
+               if field.attname != 'password']
+PROFILE_FIELDS = list(Profile._meta.concrete_fields)
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def invalidate_user(user_id):
+    # Вызывается при сохранении и удалении пользователя или его профиля.
+    # QuerySet.update() сигналов не отправляет: код, изменяющий
+    # пользователей или профили через update(), вызывает invalidate_user()
+    # сам, иначе изменения будут видны через AUTH_USER_CACHE_TIMEOUT секунд
+    cache.delete(user_cache_key(user_id))
+
+
+def _values(instance, fields):
+    # Значения полей для кеша; у файлов хранится только имя
+    values = []
+    for field in fields:
+        value = getattr(instance, field.attname)
+        if isinstance(field, FileField):
+            value = value.name
+        values.append(value)
+    return values
+
+
+def _build(model, fields, values):
+    return model.from_db(DEFAULT_DB_ALIAS,
+                         [field.attname for field in fields], values)
+
+
+def cached_user(user_id):
+    """
+    Пользователь с профилем для проверки сессии в get_user(). В кеше на
+    AUTH_USER_CACHE_TIMEOUT секунд хранятся значения полей без хеша
+    пароля и хеш сессии. Восстановленный объект загружен без поля
+    password (отложенное поле), поэтому save() записывает только
+    загруженные поля и не затирает пароль.
+    """
+    key = user_cache_key(user_id)
+    data = cache.get(key)
+    if data is None:
+        try:
+            user = User.objects.select_related('profile').get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        profile = getattr(user, 'profile', None)
+        data = {'user': _values(user, USER_FIELDS),
+                'profile': profile and _values(profile, PROFILE_FIELDS),
+                'session_hash': user.get_session_auth_hash()}
+        cache.set(key, data, settings.AUTH_USER_CACHE_TIMEOUT)
+        return user
+    user = _build(User, USER_FIELDS, data['user'])
+
+    def get_session_auth_hash():
+        # Хеш сессии вычисляется из пароля, которого нет в кеше; если
+        # пароль загружен или изменен (смена пароля), хеш вычисляется заново
+        if 'password' in user.__dict__:
+            return User.get_session_auth_hash(user)
+        return data['session_hash']
+    user.get_session_auth_hash = get_session_auth_hash
+    if data['profile'] is not None:
+        user.profile = _build(Profile, PROFILE_FIELDS, data['profile'])
+    return user
 
 
 def create_profile(backend, user, *args, **kwargs):
@@ -34,17 +108,37 @@ class EmailAuthBackend:
     # чтобы сравнить данный пароль с паролем, хранящимся в базе
     # данных. Отлавливаются два разных исключения, относящихся к набору
     # запросов QuerySet: DoesNotExist и MultipleObjectsReturned
+    # Поиск выполняется по индексированной теневой таблице UserEmail
+    # (account.models), адрес приводится к нижнему регистру
     def authenticate(self, request, username=None, password=None):
-        try:
-            user = User.objects.get(email=username)
-            if user.check_password(password):
-                return user
+        if username is None or password is None:
             return None
-        except (User.DoesNotExist, User.MultipleObjectsReturned):
+        users = list(User.objects
+                     .filter(email_key__email=normalize_email(username))[:2])
+        if len(users) != 1:
             return None
+        user = users[0]
+        if user.check_password(password):
+            return user
+        return None
 
+    # get_user() вызывается при каждом запросе аутентифицированного
+    # пользователя. Пользователь вместе с профилем кешируется на
+    # AUTH_USER_CACHE_TIMEOUT секунд (см. cached_user()), поэтому запрос
+    # обычно не обращается к базе данных ни за пользователем, ни за
+    # request.user.profile
     def get_user(self, user_id):
-        try:
-            return User.objects.get(pk=user_id)
-        except User.DoesNotExist:
-            return None
+        return cached_user(user_id)
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend (вход по имени пользователя) с тем же кешем
+    пользователей, что и EmailAuthBackend. Сессия запоминает бэкенд, через
+    который выполнен вход, и get_user() вызывается у него, поэтому без
+    этого класса сессии входа по имени кеш не использовали бы.
+    """
+
+    def get_user(self, user_id):
+        user = cached_user(user_id)
+        return user if self.user_can_authenticate(user) else None
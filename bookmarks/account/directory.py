@@ -0,0 +1,84 @@
+"""
+Каталог людей: постраничная разбивка по курсору (по имени пользователя),
+поиск без учета регистра по префиксу имени пользователя или имени
+и фамилии и кеш
+прорисованных страниц. Все страницы кеша помечены номером версии, который
+увеличивается при изменении любого профиля или пользователя, поэтому
+устаревшие страницы просто перестают читаться и вытесняются по сроку.
+"""
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Q
+from django.template.loader import render_to_string
+from images.pagination import cursor_paginate
+from .models import Profile
+
+USERS_PER_PAGE = 24
+VERSION_KEY = 'people:version'
+PAGE_TIMEOUT = 60 * 15
+
+
+def search_name(user):
+    return user.get_full_name().lower()
+
+
+def search_username(user):
+    return user.username.lower()
+
+
+def normalize_query(query):
+    # Поисковый запрос в том виде, в котором он сравнивается с полями
+    # Profile.search_name и Profile.search_username и входит в ключ кеша
+    return query.strip().lower()
+
+
+def _prefix(field, prefix):
+    # Условие "начинается с prefix" диапазоном [prefix, prefix + U+FFFF):
+    # в отличие от LIKE (startswith) сравнения используют индекс поля
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + '\uffff'})
+
+
+def version():
+    return cache.get_or_set(VERSION_KEY, 1, timeout=None)
+
+
+def invalidate():
+    # Сделать недействительными все закешированные страницы каталога
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, timeout=None)
+
+
+def users_page(cursor=None, query=''):
+    # query уже нормализован функцией normalize_query()
+    users = User.objects.filter(is_active=True).select_related('profile')
+    if query:
+        # Каждое условие - отдельный подзапрос по диапазону индекса
+        # Profile.search_username или Profile.search_name; их объединение
+        # сравнивается с первичным ключом пользователя. Условие OR по
+        # полям присоединенной таблицы индексы не использовало бы
+        profiles = Profile.objects.values('user_id')
+        users = users.filter(
+            Q(id__in=profiles.filter(_prefix('search_username', query))) |
+            Q(id__in=profiles.filter(_prefix('search_name', query))))
+    return cursor_paginate(users, cursor, USERS_PER_PAGE,
+                           ordering=('username',))
+
+
+def render_page(cursor=None, query=''):
+    """
+    Вернуть пару (HTML списка людей, курсор следующей страницы),
+    используя кеш прорисованных фрагментов.
+    """
+    query = normalize_query(query)
+    key = f'people:{version()}:{cursor or ""}:{query}'
+    page = cache.get(key)
+    if page is None:
+        users = users_page(cursor, query)
+        html = render_to_string('account/user/list_users.html',
+                                {'users': users})
+        page = (html, users.next_cursor)
+        cache.set(key, page, PAGE_TIMEOUT)
+    return page
@@ -0,0 +1,81 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from account.authentication import EmailAuthBackend, invalidate_user
+from account.models import UserEmail, normalize_email
+
+
+class Command(BaseCommand):
+    """
+    Измерить скорость входа по адресу электронной почты и число запросов
+    на один аутентифицированный запрос. Во временной транзакции создаются
+    --users пользователей, затем сравнивается прежний поиск по
+    auth_user.email с поиском по индексу UserEmail, измеряется полный вход
+    (с проверкой пароля) и число запросов get_user() без кеша и с кешем.
+    Транзакция откатывается, база данных не изменяется.
+    """
+    help = 'Benchmark email login and per-request user lookup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--lookups', type=int, default=1000)
+        parser.add_argument('--logins', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            emails = self.create_users(options['users'])
+            self.run(emails, options['lookups'], options['logins'])
+            transaction.set_rollback(True)
+
+    def create_users(self, count):
+        password = make_password('bench-password')
+        users = [User(username=f'bench-{i}',
+                      email=f'Bench.User{i}@Example.com',
+                      password=password)
+                 for i in range(count)]
+        users = User.objects.bulk_create(users, batch_size=1000)
+        ids = User.objects.filter(username__startswith='bench-')\
+            .values_list('id', 'email')
+        UserEmail.objects.bulk_create(
+            [UserEmail(user_id=user_id, email=normalize_email(email))
+             for user_id, email in ids],
+            batch_size=1000)
+        return [user.email for user in users]
+
+    def timed(self, label, count, func):
+        started = time.perf_counter()
+        for _ in range(count):
+            func()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{label}: {count / elapsed:.0f}/s, '
+                          f'{elapsed / count * 1000:.3f} ms each')
+
+    def run(self, emails, lookups, logins):
+        backend = EmailAuthBackend()
+        self.stdout.write('Query plan (auth_user.email):')
+        self.stdout.write(User.objects.filter(email=emails[0]).explain())
+        self.stdout.write('Query plan (UserEmail index):')
+        self.stdout.write(User.objects.filter(
+            email_key__email=normalize_email(emails[0])).explain())
+
+        self.timed('legacy lookup', lookups, lambda: list(
+            User.objects.filter(email=random.choice(emails))[:2]))
+        self.timed('indexed lookup', lookups, lambda: list(
+            User.objects.filter(
+                email_key__email=normalize_email(
+                    random.choice(emails).upper()))[:2]))
+        self.timed('full login', logins, lambda: backend.authenticate(
+            None, random.choice(emails).upper(), 'bench-password'))
+
+        user_id = User.objects.get(email=emails[0]).id
+        invalidate_user(user_id)
+        for label in ('get_user (cold)', 'get_user (cached)'):
+            with CaptureQueriesContext(connection) as queries:
+                # обращение к профилю, как в шаблонах страниц
+                hasattr(backend.get_user(user_id), 'profile')
+            self.stdout.write(f'{label}: {len(queries)} queries')
+        invalidate_user(user_id)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from account.directory import invalidate, search_name, search_username
+from account.models import Profile
+
+
+class Command(BaseCommand):
+    """
+    Заполнить поля поиска каталога людей Profile.search_name
+    и Profile.search_username для всех профилей. Нужна один раз после
+    развертывания (до нее поиск не находит существующих пользователей),
+    а также если имена менялись в обход сигналов (например, через
+    update() или bulk_update()).
+    """
+    help = 'Fill the people directory search columns of all profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        profiles = Profile.objects.select_related('user').order_by('id')\
+            .only('id', 'search_name', 'search_username',
+                  'user__username', 'user__first_name', 'user__last_name')
+        total = 0
+        with transaction.atomic():
+            batch = []
+            for profile in profiles.iterator(chunk_size=batch_size):
+                profile.search_name = search_name(profile.user)
+                profile.search_username = search_username(profile.user)
+                batch.append(profile)
+                if len(batch) >= batch_size:
+                    Profile.objects.bulk_update(
+                        batch, ['search_name', 'search_username'])
+                    total += len(batch)
+                    batch = []
+            Profile.objects.bulk_update(batch,
+                                        ['search_name', 'search_username'])
+            total += len(batch)
+        invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Synced {total} profile(s)'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import transaction
+from account.models import UserEmail, normalize_email
+
+
+class Command(BaseCommand):
+    """
+    Заполнить теневую таблицу UserEmail для всех пользователей.
+    Нужна один раз после развертывания, а также если адреса менялись
+    в обход сигналов (например, через update() или bulk_update()).
+    """
+    help = 'Rebuild the lower-cased email lookup table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        rows = User.objects.order_by('id').values_list('id', 'email')
+        total = 0
+        with transaction.atomic():
+            UserEmail.objects.all().delete()
+            batch = []
+            for user_id, email in rows.iterator(chunk_size=batch_size):
+                batch.append(UserEmail(user_id=user_id,
+                                       email=normalize_email(email)))
+                if len(batch) >= batch_size:
+                    UserEmail.objects.bulk_create(batch)
+                    total += len(batch)
+                    batch = []
+            UserEmail.objects.bulk_create(batch)
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Synced {total} email(s)'))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0002_contact'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='search_name',
+            field=models.CharField(blank=True, db_index=True, max_length=301),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='search_username',
+            field=models.CharField(blank=True, db_index=True, max_length=150),
+        ),
+    ]
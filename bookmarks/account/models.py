@@ -13,6 +13,21 @@ class Profile(models.Model):
     date_of_birth = models.DateField(blank=True, null=True)
     photo = models.ImageField(upload_to='users/%Y/%m/%d/',
                               blank=True)
+    # Имя и фамилия в нижнем регистре для поиска по префиксу в каталоге
+    # людей; обновляется при сохранении пользователя (см. account/signal.py),
+    # для существующих профилей заполняется командой sync_profile_search
+    search_name = models.CharField(max_length=301,
+                                   blank=True,
+                                   db_index=True)
+    # Имя пользователя в нижнем регистре для того же поиска
+    search_username = models.CharField(max_length=150,
+                                       blank=True,
+                                       db_index=True)
+
+    def save(self, *args, **kwargs):
+        self.search_name = self.user.get_full_name().lower()
+        self.search_username = self.user.username.lower()
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f'Profile of {self.user.username}'
@@ -51,6 +66,28 @@ class Contact(models.Model):
         return f'{self.user_form} follows {self.user_to}'
 
 
+def normalize_email(email):
+    # Адреса сравниваются без учета регистра и пробелов по краям
+    return (email or '').strip().lower()
+
+
+class UserEmail(models.Model):
+    """
+    Теневая таблица адресов электронной почты в нижнем регистре.
+    Столбец auth_user.email не индексирован, а модель User нельзя изменить,
+    поэтому вход по адресу (см. EmailAuthBackend) выполняется по индексу
+    этой таблицы. Запись обновляется при сохранении пользователя
+    (см. account/signal.py) и заполняется командой sync_user_emails.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL,
+                                related_name='email_key',
+                                on_delete=models.CASCADE)
+    email = models.CharField(max_length=254, db_index=True)
+
+    def __str__(self):
+        return self.email
+
+
 # добавить следующее поле в User динамически
 # Здесь модель User извлекается встроенной в  Django типовой функцией
 # get_user_model(). Метод add_to_class() моделей Django применяется для того,
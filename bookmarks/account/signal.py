@@ -0,0 +1,52 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from images.thumbnails import file_changed, schedule
+from .authentication import invalidate_user
+from .directory import invalidate, search_name, search_username
+from .models import Profile, UserEmail, normalize_email
+
+
+@receiver(pre_save, sender=Profile)
+def profile_saving(sender, instance, **kwargs):
+    # Запомнить, загружен ли новый фотоснимок: после сохранения это уже
+    # не видно
+    instance._photo_changed = file_changed(instance.photo)
+
+
+@receiver(post_save, sender=Profile)
+def profile_saved(sender, instance, **kwargs):
+    # Миниатюры нового фотоснимка создает обработчик очереди
+    # (см. images/thumbnails.py)
+    if instance._photo_changed:
+        schedule(instance.photo)
+    invalidate()
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_delete, sender=Profile)
+def profile_deleted(sender, instance, **kwargs):
+    invalidate()
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    invalidate_user(instance.id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    invalidate_user(instance.id)
+    if update_fields is None or 'email' in update_fields:
+        UserEmail.objects.update_or_create(
+            user=instance,
+            defaults={'email': normalize_email(instance.email)})
+    # Обновление только last_login при входе не влияет на каталог людей
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    if not created:
+        Profile.objects.filter(user=instance)\
+            .update(search_name=search_name(instance),
+                    search_username=search_username(instance))
+    invalidate()
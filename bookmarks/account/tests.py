@@ -1,3 +1,346 @@
-from django.test import TestCase
+from io import StringIO
+from unittest import mock
+from urllib.parse import urlencode
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import AsyncClient, TestCase, override_settings
+from django.urls import reverse
+from actions.feed import PULL_USERS_KEY, get_feed, rebuild_timeline, \
+    timeline_key
+from actions.models import Action
+from actions.utils import create_action, create_actions
+from bookmarks.redis_client import r
+from bookmarks.testing import QueryCountTestCase, TEST_SETTINGS
+from images.models import Image
+from .authentication import CachedModelBackend, EmailAuthBackend, \
+    user_cache_key
+from .directory import normalize_query, render_page, users_page
+from .models import Contact, Profile, UserEmail
 
-# Create your tests here.
+
+class AccountViewQueriesTest(QueryCountTestCase):
+    """
+    Число запросов представлений account.urls не зависит от числа
+    подписчиков, подписок, изображений и действий пользователя.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('subject', email='Subject@Example.com')
+        self.other = self.create_user('other')
+        self.client.force_login(self.user)
+
+    def get(self, name, *args, **params):
+        def request():
+            response = self.client.get(reverse(name, args=args), params)
+            self.assertEqual(response.status_code, 200)
+        return request
+
+    def test_dashboard(self):
+        self.assertConstantQueries(self.get('dashboard'), self.user)
+
+    def test_dashboard_without_following(self):
+        # Пользователь ни на кого не подписан: последние действия всех
+        self.client.force_login(self.other)
+        self.assertConstantQueries(self.get('dashboard'), self.user)
+
+    def test_user_list(self):
+        self.assertConstantQueries(self.get('user_list'), self.user)
+
+    def test_user_list_search(self):
+        self.assertConstantQueries(
+            self.get('user_list', q='ann', users_only=1), self.user)
+
+    def test_user_detail(self):
+        self.assertConstantQueries(self.get('user_detail', 'subject'),
+                                   self.user)
+
+    def test_edit(self):
+        self.assertConstantQueries(self.get('edit'), self.user)
+
+    def test_register_form(self):
+        self.client.logout()
+        self.assertConstantQueries(self.get('register'), self.user)
+
+    def test_login_form(self):
+        self.client.logout()
+        self.assertConstantQueries(self.get('login'), self.user)
+
+    def test_password_change_form(self):
+        self.assertConstantQueries(self.get('password_change'), self.user)
+
+    def test_user_follow(self):
+        targets = iter([self.create_user(f'target-{n}') for n in range(3)])
+
+        def follow():
+            target = next(targets)
+            response = self.client.post(reverse('user_follow'),
+                                        {'id': target.id,
+                                         'action': 'follow'})
+            self.assertEqual(response.json()['status'], 'ok')
+        self.assertConstantQueries(follow, self.user)
+        self.assertTrue(Contact.objects.filter(
+            user_form=self.user, user_to__username='target-0').exists())
+
+    def test_user_unfollow(self):
+        def unfollow():
+            target = self.user.following.first()
+            response = self.client.post(reverse('user_follow'),
+                                        {'id': target.id,
+                                         'action': 'unfollow'})
+            self.assertEqual(response.json()['status'], 'ok')
+            self.assertFalse(self.user.following.filter(id=target.id)
+                             .exists())
+        self.assertConstantQueries(unfollow, self.user)
+
+
+@override_settings(**TEST_SETTINGS)
+class AccountSignalsTest(TestCase):
+
+    def setUp(self):
+        r.flushdb()
+        self.user = User.objects.create_user('ann', 'Ann@Example.com',
+                                             'password',
+                                             first_name='Ann',
+                                             last_name='Lee')
+        Profile.objects.create(user=self.user)
+
+    def test_email_key_follows_user_email(self):
+        self.assertEqual(self.user.email_key.email, 'ann@example.com')
+        self.user.email = ' New@Example.com '
+        self.user.save(update_fields=['email'])
+        self.assertEqual(UserEmail.objects.get(user=self.user).email,
+                         'new@example.com')
+
+    def test_login_does_not_touch_email_key(self):
+        UserEmail.objects.filter(user=self.user).update(email='stale')
+        self.user.save(update_fields=['last_login'])
+        self.assertEqual(UserEmail.objects.get(user=self.user).email,
+                         'stale')
+
+    def test_email_login(self):
+        backend = EmailAuthBackend()
+        self.assertEqual(backend.authenticate(None, 'ANN@example.com',
+                                              'password'), self.user)
+        self.assertIsNone(backend.authenticate(None, 'ann@example.com',
+                                               'wrong'))
+
+    def test_search_name_follows_user_name(self):
+        self.user.first_name = 'Anna'
+        self.user.save()
+        self.assertEqual(Profile.objects.get(user=self.user).search_name,
+                         'anna lee')
+
+    def test_directory_search(self):
+        other = User.objects.create_user('Leon', first_name='Bob',
+                                         last_name='Stone')
+        Profile.objects.create(user=other)
+
+        def found(query):
+            return [user.username for user in
+                    users_page(query=normalize_query(query))]
+        # префикс имени пользователя или имени без учета регистра
+        self.assertEqual(found(' LE '), ['Leon'])
+        self.assertEqual(found('bob s'), ['Leon'])
+        self.assertEqual(found('An'), ['ann'])
+        self.assertEqual(found('x'), [])
+        # запросы, отличающиеся пробелами и регистром, - одна запись кеша
+        self.assertEqual(render_page(query=' ANN'), render_page(query='ann'))
+
+    def test_sync_profile_search(self):
+        # Профили, созданные до появления полей поиска
+        Profile.objects.update(search_name='', search_username='')
+        self.assertEqual(list(users_page(query='ann')), [])
+        call_command('sync_profile_search', stdout=StringIO())
+        self.assertEqual([user.username for user in
+                          users_page(query='ann l')], ['ann'])
+        self.assertEqual([user.username for user in
+                          users_page(query='ann')], ['ann'])
+
+    def test_cached_user_invalidated(self):
+        backend = EmailAuthBackend()
+        backend.get_user(self.user.id)
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.id)))
+        self.user.profile.save()
+        self.assertIsNone(cache.get(user_cache_key(self.user.id)))
+        backend.get_user(self.user.id)
+        self.user.save()
+        self.assertIsNone(cache.get(user_cache_key(self.user.id)))
+        backend.get_user(self.user.id)
+        self.user.delete()
+        self.assertIsNone(cache.get(user_cache_key(self.user.id)))
+
+    def test_cached_user_without_password(self):
+        # Вход по имени пользователя тоже использует кеш
+        self.client.login(username='ann', password='password')
+        self.assertEqual(self.client.get(reverse('edit')).status_code, 200)
+        data = cache.get(user_cache_key(self.user.id))
+        self.assertNotIn(self.user.password, str(data))
+        with self.assertNumQueries(0):
+            user = CachedModelBackend().get_user(self.user.id)
+            self.assertEqual(user.profile.search_name, 'ann lee')
+            self.assertEqual(user.get_session_auth_hash(),
+                             self.user.get_session_auth_hash())
+        # сохранение пользователя из кеша не затирает пароль
+        user.first_name = 'Anna'
+        user.save()
+        self.assertTrue(User.objects.get(id=self.user.id)
+                        .check_password('password'))
+        self.assertEqual(self.client.get(reverse('edit')).status_code, 200)
+
+    def test_password_change_keeps_session(self):
+        self.client.login(username='ann', password='password')
+        self.client.get(reverse('edit'))
+        response = self.client.post(reverse('password_change'),
+                                    {'old_password': 'password',
+                                     'new_password1': 'n3w-Passw0rd',
+                                     'new_password2': 'n3w-Passw0rd'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.client.get(reverse('edit')).status_code, 200)
+
+
+@override_settings(**TEST_SETTINGS)
+class DashboardTimelineTest(TestCase):
+
+    def setUp(self):
+        r.flushdb()
+        self.user = User.objects.create_user('ann')
+        Profile.objects.create(user=self.user)
+        other = User.objects.create_user('bob')
+        Contact.objects.create(user_form=self.user, user_to=other)
+        self.client.force_login(self.user)
+
+    def test_empty_timeline_rebuilt_once(self):
+        # Подписки есть, действий нет: пустая лента строится один раз
+        with mock.patch('account.views.rebuild_timeline',
+                        wraps=rebuild_timeline) as rebuild:
+            for _ in range(3):
+                self.client.get(reverse('dashboard'))
+            self.assertEqual(rebuild.call_count, 1)
+            # после очистки Redis лента строится заново
+            r.flushdb()
+            self.client.get(reverse('dashboard'))
+            self.assertEqual(rebuild.call_count, 2)
+
+
+@override_settings(**TEST_SETTINGS)
+class UserFollowAsyncTest(TestCase):
+    # user_follow через обработчик ASGI; тело запроса в кодировке
+    # application/x-www-form-urlencoded (см. ImageAsyncViewsTest)
+
+    def setUp(self):
+        r.flushdb()
+        self.user = User.objects.create_user('ann', password='password')
+        self.other = User.objects.create_user('bob')
+        self.client.force_login(self.user)
+        self.async_client = AsyncClient()
+        self.async_client.cookies = self.client.cookies
+
+    async def follow(self, action, user_id):
+        response = await self.async_client.post(
+            reverse('user_follow'),
+            urlencode({'id': user_id, 'action': action}),
+            content_type='application/x-www-form-urlencoded')
+        return response.json()['status']
+
+    async def test_follow_and_unfollow(self):
+        action = await Action.objects.acreate(user=self.other,
+                                              verb='likes')
+        # действие другого автора, уже находящееся в ленте
+        r.zadd(timeline_key(self.user.id), {'999': 1})
+        self.assertEqual(await self.follow('follow', self.other.id), 'ok')
+        self.assertTrue(await Contact.objects.filter(
+            user_form=self.user, user_to=self.other).aexists())
+        # в ленту добавлены действия нового автора, лента не перестроена
+        self.assertEqual([int(action_id) for action_id in
+                          r.zrange(timeline_key(self.user.id), 0, -1)],
+                         [999, action.id])
+        self.assertEqual(await self.follow('unfollow', self.other.id), 'ok')
+        self.assertFalse(await Contact.objects.filter(
+            user_form=self.user).aexists())
+        self.assertEqual(r.zrange(timeline_key(self.user.id), 0, -1),
+                         [b'999'])
+        self.assertEqual(await self.follow('follow', 0), 'error')
+
+
+class CreateActionTest(QueryCountTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('author')
+        self.follower = self.create_user('follower')
+        Contact.objects.create(user_form=self.follower, user_to=self.user)
+        self.image = Image.objects.create(user=self.user, title='Sea',
+                                          url='https://example.com/sea.png',
+                                          status=Image.Status.READY)
+
+    def test_action_reaches_followers(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertTrue(create_action(self.user, 'bookmarked image',
+                                          self.image))
+        # до фиксации транзакции действие в ленты не рассылается
+        self.assertEqual(r.zrange(timeline_key(self.follower.id), 0, -1),
+                         [])
+        for callback in callbacks:
+            callback()
+        action = Action.objects.get(user=self.user)
+        self.assertEqual(action.target, self.image)
+        self.assertEqual([int(action_id) for action_id
+                          in r.zrange(timeline_key(self.follower.id), 0, -1)],
+                         [action.id])
+        feed = get_feed(self.follower)
+        self.assertEqual(len(feed), 1)
+
+    def test_repeated_action_skipped(self):
+        self.assertTrue(create_action(self.user, 'likes', self.image))
+        self.assertFalse(create_action(self.user, 'likes', self.image))
+        self.assertTrue(create_action(self.user, 'has created an account'))
+        self.assertEqual(Action.objects.filter(user=self.user).count(), 2)
+
+    def test_failed_save_releases_dedup_key(self):
+        with mock.patch.object(Action, 'save', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                create_action(self.user, 'likes', self.image)
+        with mock.patch.object(Action.objects, 'bulk_create',
+                               side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                create_actions([(self.follower, 'likes', self.image)])
+        # повтор после ошибки не считается повторным действием
+        self.assertTrue(create_action(self.user, 'likes', self.image))
+        self.assertEqual(len(create_actions(
+            [(self.follower, 'likes', self.image)])), 1)
+
+    def test_create_actions_skips_repeats(self):
+        create_action(self.user, 'likes', self.image)
+        actions = create_actions([(self.user, 'likes', self.image),
+                                  (self.follower, 'likes', self.image)])
+        self.assertEqual([action.user for action in actions],
+                         [self.follower])
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=1)
+    def test_history_merged_when_author_leaves_pull_mode(self):
+        other = self.create_user('other')
+        contact = Contact.objects.create(user_form=other, user_to=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_action(self.user, 'likes', self.image)
+        # подписчиков больше лимита - действие подмешивается при чтении
+        self.assertTrue(r.sismember(PULL_USERS_KEY, self.user.id))
+        self.assertEqual(r.zrange(timeline_key(self.follower.id), 0, -1),
+                         [])
+        contact.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            create_actions([(self.user, 'has created an account', None)])
+        self.assertFalse(r.sismember(PULL_USERS_KEY, self.user.id))
+        # в ленту попали и действия, созданные в pull-режиме
+        self.assertEqual(len(r.zrange(timeline_key(self.follower.id),
+                                      0, -1)), 2)
+
+    def test_create_action_queries(self):
+        # Рассылка в ленты не выполняет запрос на каждого подписчика
+        verbs = iter(range(100))
+        self.assertConstantQueries(
+            lambda: create_action(self.user, f'verb {next(verbs)}',
+                                  self.image),
+            self.user)
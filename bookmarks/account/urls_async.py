@@ -0,0 +1,12 @@
+"""
+Маршруты приложения account под ASGI: подписка обслуживается асинхронным
+вариантом представления, остальные маршруты совпадают с account/urls.py.
+"""
+
+from django.urls import path
+from . import views
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('users/follow/', views.auser_follow, name='user_follow'),
+] + sync_urlpatterns
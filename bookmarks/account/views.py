@@ -8,8 +8,15 @@ from .models import Profile, Contact
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
 from django.views.decorators.http import require_POST
-from actions.utils import create_action
+from actions.utils import acreate_action, create_action
 from actions.models import Action
+from actions.feed import aadd_author, add_author, aremove_author, get_feed, \
+    rebuild_timeline, remove_author, timeline_built
+from actions.hydration import hydrate_feed
+from .directory import render_page
+from images.http_cache import render_cards
+from bookmarks.async_views import aget_user, async_login_required, \
+    async_require_POST
 
 
 @login_required
@@ -79,33 +86,31 @@ def register(request):
 # представление; если пользователь не аутентифицирован, то оно перенаправляет
 # пользователя на URL-адрес входа с изначально запрошенным URL-адресом в качестве GET-параметра с именем next.
 def dashboard(request):
-    # По умолчанию показать все действия
-    actions = Action.objects.exclude(user=request.user)
-    following_ids = request.user.following.values_list('id',
-                                                       flat=True)
-    if following_ids:
-        # Если пользователь подписан на других,
-        # то извлечь только их действия
-        actions = actions.select_related('user', 'user__profile')[:10]\
-                      .prefetch_related('target')[:10]
-        # Аргумент user__profile используется для того, чтобы выполнять операцию
-        # соединения на таблице Profile в одном SQL-запросе. Если вызвать select_related()
-        # без передачи каких-либо аргументов, то он будет извлекать объекты
-        # из всех взаимосвязей с внешними ключами ForeignKey.
-        # Следует всегда ограничивать метод select_related() взаимосвязями, которые будут доступны
-        # позже.
-
-    actions = actions[:10]
+    if request.user.following.exists():
+        # Если пользователь подписан на других, то извлечь их действия
+        # из персональной ленты в Redis: одна команда ZREVRANGE и один
+        # запрос к базе данных для загрузки действий пачкой.
+        actions = get_feed(request.user)
+        if not actions and not timeline_built(request.user):
+            # Лента еще не построена (например, после очистки Redis);
+            # построенная пустая лента не перестраивается на каждом
+            # запросе, пока не истечет отметка FEED_BUILT_TIMEOUT
+            rebuild_timeline(request.user)
+            actions = get_feed(request.user)
+    else:
+        # По умолчанию показать последние действия всех пользователей.
+        # Авторы, их профили и цели действий загружаются пачкой:
+        # по одному запросу на тип объектов, а не на каждое действие.
+        action_ids = Action.objects.exclude(user=request.user)\
+            .values_list('id', flat=True)[:10]
+        actions = hydrate_feed(list(action_ids))
     # Мы также определили переменную section.
     # Эта переменная будет использоваться для подсвечивания текущего раздела в главном меню сайта.
     """
-    В приведенном выше представлении из базы данных извлекаются все 
-    действия, за исключением тех, которые выполняются текущим пользователем.
-     По умолчанию извлекаются последние действия, выполненные всеми 
-    пользователями на платформе. Если пользователь подписан на других пользователей,
-     то запрос ограничивается, чтобы получать только те действия, 
-    которые выполняются пользователями, на которых он подписан. Наконец, 
-    результат ограничивается первыми 10 возвращаемыми действиями. Метод 
+    Если пользователь подписан на других пользователей, то действия берутся
+    из его ленты: каждое новое действие рассылается в ленты подписчиков
+    функцией create_action() (см. actions/feed.py). Иначе извлекаются
+    последние 10 действий всех пользователей, кроме текущего. Метод
     order_by() в наборе запросов QuerySet не используется,
      потому что вы опираетесь на заранее заданный порядок сортировки, указанный в Meta-опциях 
     модели Action. Недавние действия будут первыми, поскольку в модели Action
@@ -145,15 +150,23 @@ def user_login(request):
 # Модель User содержит флаг is_active, который маркирует, считается учетная
 # запись пользователя активной или нет. Запрос фильтруется по параметру
 # is_active=True, чтобы возвращать только активных пользователей.
-# Это представление возвращает все результаты, но его можно улучшить,
-# добавив постраничную разбивку так же, как это делалось для представления image_list.
 @login_required
 def user_list(request):
-    users = User.objects.filter(is_active=True)
+    # Каталог разбит на страницы по курсору; профили загружаются тем же
+    # запросом (select_related), а прорисованные страницы кешируются
+    # до первого изменения профиля (см. account/directory.py)
+    query = request.GET.get('q', '')
+    html, next_cursor = render_page(request.GET.get('cursor'), query)
+    if request.GET.get('users_only'):
+        response = HttpResponse(html)
+        response['X-Next-Cursor'] = next_cursor or ''
+        return response
     return render(request,
                   'account/user/list.html',
                   {'section': 'people',
-                   'users': users})
+                   'users_html': html,
+                   'next_cursor': next_cursor,
+                   'query': query})
 
 
 # В представлении user_detail используется функция сокращенного доступа
@@ -165,10 +178,13 @@ def user_detail(request, username):
     user = get_object_or_404(User,
                              username=username,
                              is_active=True)
+    # Карточки изображений берутся из кеша, как в списке изображений
+    # (см. images/http_cache.py)
     return render(request,
                   'account/user/detail.html',
                   {'section': 'people',
-                   'user': user})
+                   'user': user,
+                   'cards': render_cards(user.images_created.all())})
 
 
 @require_POST
@@ -184,9 +200,41 @@ def user_follow(request):
                     user_form=request.user,
                     user_to=user)
                 create_action(request.user, 'is following', user)
+                # добавить в ленту последние действия нового автора
+                add_author(request.user, user)
             else:
                 Contact.objects.filter(user_form=request.user,
                                        user_to=user).delete()
+                remove_author(request.user, user)
+            return JsonResponse({'status': 'ok'})
+        except User.DoesNotExist:
+            return JsonResponse({'status': 'error'})
+    return JsonResponse({'status': 'error'})
+
+
+@async_require_POST
+@async_login_required
+async def auser_follow(request):
+    # Вариант user_follow для ASGI (см. account/urls_async.py): подписка,
+    # действие и обновление ленты выполняются асинхронным интерфейсом ORM
+    # и клиентом redis.asyncio
+    user_id = request.POST.get('id')
+    action = request.POST.get('action')
+    if user_id and action:
+        try:
+            user = await User.objects.aget(id=user_id)
+            follower = await aget_user(request)
+            if action == 'follow':
+                await Contact.objects.aget_or_create(
+                    user_form=follower,
+                    user_to=user)
+                await acreate_action(follower, 'is following', user)
+                # добавить в ленту последние действия нового автора
+                await aadd_author(follower, user)
+            else:
+                await Contact.objects.filter(user_form=follower,
+                                             user_to=user).adelete()
+                await aremove_author(follower, user)
             return JsonResponse({'status': 'ok'})
         except User.DoesNotExist:
             return JsonResponse({'status': 'error'})
@@ -0,0 +1,288 @@
+from collections import defaultdict
+from django.conf import settings
+from django.db.models import Count
+from django.contrib.auth.models import User
+from account.models import Contact
+from bookmarks.redis_client import ar, async_pipeline, r, pipeline
+from .models import Action
+from .hydration import hydrate_feed
+
+# Множество пользователей, действия которых не рассылаются подписчикам,
+# а подтягиваются при чтении ленты (pull-режим)
+PULL_USERS_KEY = 'timeline:pull_users'
+
+
+def timeline_key(user_id):
+    # Лента каждого пользователя хранится в отдельном сортированном множестве,
+    # где элементом является id действия, а баллом - время его создания.
+    return f'user:{user_id}:timeline'
+
+
+def built_key(user_id):
+    # Отметка о том, что лента построена: пустое множество в Redis не
+    # хранится, и без отметки пустую ленту нельзя отличить от
+    # непостроенной (например, после очистки Redis)
+    return f'user:{user_id}:timeline:built'
+
+
+def timeline_built(user):
+    return bool(r.exists(built_key(user.id)))
+
+
+def _score(action_created):
+    return action_created.timestamp()
+
+
+def _trim(pipe, key):
+    # Оставить в ленте только последние FEED_TIMELINE_SIZE действий
+    pipe.zremrangebyrank(key, 0, -settings.FEED_TIMELINE_SIZE - 1)
+
+
+def _recent_actions(author_id):
+    # Последние действия автора, которые могут находиться в ленте
+    return Action.objects.filter(user_id=author_id)\
+        .order_by('-created')\
+        .values_list('id', 'created')[:settings.FEED_TIMELINE_SIZE]
+
+
+def _add(pipe, follower_ids, mapping):
+    for follower_id in follower_ids:
+        key = timeline_key(follower_id)
+        pipe.zadd(key, mapping)
+        _trim(pipe, key)
+
+
+def push_action(action):
+    """
+    Разослать действие в ленты подписчиков его автора (fan-out on write).
+    Если подписчиков больше, чем FEED_FANOUT_MAX_FOLLOWERS, рассылка не
+    выполняется: автор помечается как pull-пользователь, и его действия
+    подмешиваются в ленту при чтении, чтобы не увеличивать время записи.
+    Когда число подписчиков снова укладывается в лимит, вместе с новым
+    действием в ленты добавляются и прошлые действия автора: пока он был
+    pull-пользователем, они не рассылались, а после снятия отметки больше
+    не подмешиваются при чтении.
+    Вызывается после фиксации транзакции (см. actions/utils.py), чтобы
+    в ленты не попадали действия, которых нет в базе данных.
+    """
+    limit = settings.FEED_FANOUT_MAX_FOLLOWERS
+    follower_ids = list(Contact.objects.filter(user_to_id=action.user_id)
+                        .values_list('user_form_id', flat=True)[:limit + 1])
+    if len(follower_ids) > limit:
+        r.sadd(PULL_USERS_KEY, action.user_id)
+        return 0
+    mapping = {action.id: _score(action.created)}
+    if r.sismember(PULL_USERS_KEY, action.user_id):
+        mapping.update((action_id, _score(created)) for action_id, created
+                       in _recent_actions(action.user_id))
+    # отметка снимается в том же конвейере, что и добавление в ленты,
+    # поэтому читатели не остаются без действий автора
+    with pipeline() as pipe:
+        _add(pipe, follower_ids, mapping)
+        pipe.srem(PULL_USERS_KEY, action.user_id)
+    return len(follower_ids)
+
+
+async def apush_action(action):
+    # Вариант push_action() для асинхронных представлений
+    limit = settings.FEED_FANOUT_MAX_FOLLOWERS
+    follower_ids = [follower_id async for follower_id in
+                    Contact.objects.filter(user_to_id=action.user_id)
+                    .values_list('user_form_id', flat=True)[:limit + 1]]
+    if len(follower_ids) > limit:
+        await ar.sadd(PULL_USERS_KEY, action.user_id)
+        return 0
+    mapping = {action.id: _score(action.created)}
+    if await ar.sismember(PULL_USERS_KEY, action.user_id):
+        mapping.update([(action_id, _score(created)) async for
+                        action_id, created in
+                        _recent_actions(action.user_id)])
+    async with async_pipeline() as pipe:
+        _add(pipe, follower_ids, mapping)
+        pipe.srem(PULL_USERS_KEY, action.user_id)
+    return len(follower_ids)
+
+
+def push_actions(actions):
+    """
+    Пакетный вариант push_action(): подписчики всех авторов извлекаются
+    двумя запросами, а все ленты обновляются одним конвейером Redis.
+    Прошлые действия авторов, вышедших из pull-режима, добавляются
+    в ленты, как в push_action().
+    """
+    if not actions:
+        return 0
+    limit = settings.FEED_FANOUT_MAX_FOLLOWERS
+    author_ids = {action.user_id for action in actions}
+    counts = Contact.objects.filter(user_to_id__in=author_ids)\
+        .values('user_to_id')\
+        .annotate(total=Count('id'))
+    pull_ids = {row['user_to_id'] for row in counts if row['total'] > limit}
+    push_ids = sorted(author_ids - pull_ids)
+    followers = defaultdict(list)
+    rows = Contact.objects.filter(user_to_id__in=push_ids)\
+        .values_list('user_to_id', 'user_form_id')
+    for author_id, follower_id in rows:
+        followers[author_id].append(follower_id)
+    history = defaultdict(dict)
+    with pipeline() as pipe:
+        for author_id in push_ids:
+            pipe.sismember(PULL_USERS_KEY, author_id)
+    for author_id, was_pull in zip(push_ids, pipe.results):
+        if was_pull:
+            history[author_id] = {action_id: _score(created)
+                                  for action_id, created
+                                  in _recent_actions(author_id)}
+    timelines = defaultdict(dict)
+    for action in actions:
+        for follower_id in followers.get(action.user_id, []):
+            timelines[follower_id][action.id] = _score(action.created)
+    for author_id, mapping in history.items():
+        for follower_id in followers.get(author_id, []):
+            timelines[follower_id].update(mapping)
+    with pipeline() as pipe:
+        for follower_id, mapping in timelines.items():
+            key = timeline_key(follower_id)
+            pipe.zadd(key, mapping)
+            _trim(pipe, key)
+        if pull_ids:
+            pipe.sadd(PULL_USERS_KEY, *pull_ids)
+        if push_ids:
+            pipe.srem(PULL_USERS_KEY, *push_ids)
+    return len(timelines)
+
+
+def rebuild_timeline(user):
+    """
+    Перестроить ленту пользователя по текущему списку подписок и
+    отметить ее построенной (см. built_key()). Вызывается при открытии
+    непостроенной ленты и из команды rebuild_timelines; после подписки
+    и отписки лента обновляется add_author() и remove_author().
+    """
+    following_ids = user.following.values_list('id', flat=True)
+    actions = Action.objects.filter(user_id__in=following_ids)\
+        .order_by('-created')\
+        .values_list('id', 'created')[:settings.FEED_TIMELINE_SIZE]
+    key = timeline_key(user.id)
+    mapping = {action_id: _score(created) for action_id, created in actions}
+    with pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        if mapping:
+            pipe.zadd(key, mapping)
+        pipe.set(built_key(user.id), 1, ex=settings.FEED_BUILT_TIMEOUT)
+    return len(mapping)
+
+
+async def arebuild_timeline(user):
+    # Вариант rebuild_timeline() для асинхронных представлений
+    following_ids = user.following.values_list('id', flat=True)
+    actions = Action.objects.filter(user_id__in=following_ids)\
+        .order_by('-created')\
+        .values_list('id', 'created')[:settings.FEED_TIMELINE_SIZE]
+    key = timeline_key(user.id)
+    mapping = {action_id: _score(created)
+               async for action_id, created in actions}
+    async with async_pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        if mapping:
+            pipe.zadd(key, mapping)
+        pipe.set(built_key(user.id), 1, ex=settings.FEED_BUILT_TIMEOUT)
+    return len(mapping)
+
+
+def add_author(user, author):
+    """
+    Добавить в ленту user последние действия author после подписки:
+    обновляется одна лента на FEED_TIMELINE_SIZE элементов, без запроса
+    действий всех подписок, как в rebuild_timeline().
+    """
+    mapping = {action_id: _score(created)
+               for action_id, created in _recent_actions(author.id)}
+    if not mapping:
+        return 0
+    key = timeline_key(user.id)
+    with pipeline() as pipe:
+        pipe.zadd(key, mapping)
+        _trim(pipe, key)
+    return len(mapping)
+
+
+async def aadd_author(user, author):
+    # Вариант add_author() для асинхронных представлений
+    mapping = {action_id: _score(created) async for action_id, created
+               in _recent_actions(author.id)}
+    if not mapping:
+        return 0
+    key = timeline_key(user.id)
+    async with async_pipeline() as pipe:
+        pipe.zadd(key, mapping)
+        _trim(pipe, key)
+    return len(mapping)
+
+
+def remove_author(user, author):
+    """
+    Убрать из ленты user действия author после отписки. В ленте не
+    больше FEED_TIMELINE_SIZE элементов, поэтому действия автора в ней -
+    только из его последних FEED_TIMELINE_SIZE действий. Освободившиеся
+    места заполняются новыми действиями или командой rebuild_timelines.
+    """
+    action_ids = [action_id for action_id, created
+                  in _recent_actions(author.id)]
+    if not action_ids:
+        return 0
+    return r.zrem(timeline_key(user.id), *action_ids)
+
+
+async def aremove_author(user, author):
+    # Вариант remove_author() для асинхронных представлений
+    action_ids = [action_id async for action_id, created
+                  in _recent_actions(author.id)]
+    if not action_ids:
+        return 0
+    return await ar.zrem(timeline_key(user.id), *action_ids)
+
+
+def _pull_entries(user, count):
+    # Действия pull-пользователей, на которых подписан user,
+    # выбираются напрямую из базы данных при чтении ленты
+    pull_ids = {int(user_id) for user_id in r.smembers(PULL_USERS_KEY)}
+    if not pull_ids:
+        return []
+    followed = list(user.following.filter(id__in=pull_ids)
+                    .values_list('id', flat=True))
+    if not followed:
+        return []
+    actions = Action.objects.filter(user_id__in=followed)\
+        .order_by('-created')\
+        .values_list('id', 'created')[:count]
+    return [(action_id, _score(created)) for action_id, created in actions]
+
+
+def get_feed(user, start=0, count=None):
+    """
+    Вернуть страницу ленты пользователя. Идентификаторы действий читаются
+    одной командой ZREVRANGE, после чего действия, их авторы и цели
+    загружаются пачкой (см. actions/hydration.py) в порядке ленты.
+    """
+    count = count or settings.FEED_PAGE_SIZE
+    entries = r.zrevrange(timeline_key(user.id), 0, start + count - 1,
+                          withscores=True)
+    entries = [(int(action_id), score) for action_id, score in entries]
+    pulled = _pull_entries(user, start + count)
+    if pulled:
+        entries = sorted(set(entries + pulled),
+                         key=lambda entry: entry[1], reverse=True)
+    ids = [action_id for action_id, score in entries[start:start + count]]
+    return hydrate_feed(ids)
+
+
+def rebuild_all(users=None):
+    # Перестроить ленты для всех активных пользователей (или переданных)
+    if users is None:
+        users = User.objects.filter(is_active=True).iterator()
+    total = 0
+    for user in users:
+        rebuild_timeline(user)
+        total += 1
+    return total
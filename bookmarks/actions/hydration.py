@@ -0,0 +1,76 @@
+from collections import defaultdict
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from images.thumbnails import alias_url
+from .models import Action
+
+
+def _user_entry(user):
+    profile = getattr(user, 'profile', None)
+    return {'username': user.username,
+            'name': user.first_name,
+            'full_name': user.get_full_name(),
+            'url': user.get_absolute_url(),
+            'photo': alias_url(profile.photo, 'feed') if profile else ''}
+
+
+def _target_entry(obj):
+    image = getattr(obj, 'image', None)
+    return {'title': str(obj),
+            'url': obj.get_absolute_url(),
+            'image': alias_url(image, 'feed') if image else ''}
+
+
+def hydrate_feed(action_ids):
+    """
+    Подготовить действия к выводу в ленте. Вместо ленивой загрузки
+    action.user, action.user.profile и action.target для каждого действия
+    выполняется фиксированное число запросов: один для действий, один для
+    всех пользователей (авторов и целей-пользователей вместе с профилями)
+    и по одному на каждый другой тип целей. URL-адреса миниатюр вычисляются
+    без обращения к хранилищу. Возвращает список словарей в порядке action_ids.
+    """
+    rows = Action.objects.filter(id__in=action_ids)\
+        .values('id', 'verb', 'created', 'user_id',
+                'target_ct_id', 'target_id')
+    rows = {row['id']: row for row in rows}
+    user_ct = ContentType.objects.get_for_model(User)
+    user_ids = set()
+    target_ids = defaultdict(set)
+    for row in rows.values():
+        user_ids.add(row['user_id'])
+        if row['target_ct_id'] == user_ct.id:
+            user_ids.add(row['target_id'])
+        elif row['target_ct_id']:
+            target_ids[row['target_ct_id']].add(row['target_id'])
+
+    users = User.objects.filter(id__in=user_ids).select_related('profile')
+    users = {user.id: _user_entry(user) for user in users}
+    targets = {}
+    for ct_id, ids in target_ids.items():
+        model = ContentType.objects.get_for_id(ct_id).model_class()
+        if model is None:
+            continue
+        for obj in model._default_manager.filter(pk__in=ids):
+            targets[ct_id, obj.pk] = _target_entry(obj)
+
+    feed = []
+    for action_id in action_ids:
+        row = rows.get(action_id)
+        if row is None or row['user_id'] not in users:
+            continue
+        target = None
+        if row['target_ct_id'] == user_ct.id:
+            user = users.get(row['target_id'])
+            if user:
+                target = {'title': user['username'],
+                          'url': user['url'],
+                          'image': ''}
+        elif row['target_ct_id']:
+            target = targets.get((row['target_ct_id'], row['target_id']))
+        feed.append({'id': action_id,
+                     'verb': row['verb'],
+                     'created': row['created'],
+                     'user': users[row['user_id']],
+                     'target': target})
+    return feed
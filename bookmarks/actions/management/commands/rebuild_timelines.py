@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from actions.feed import rebuild_all
+
+
+class Command(BaseCommand):
+    """
+    Перестроить ленты активности пользователей в Redis.
+    Без аргументов перестраиваются ленты всех активных пользователей,
+    например после первичного развертывания или потери данных Redis.
+    Можно передать имена пользователей, чьи подписки изменились.
+    """
+    help = 'Rebuild activity timelines from the follow graph'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help='Rebuild only these users')
+
+    def handle(self, *args, **options):
+        users = None
+        if options['usernames']:
+            users = User.objects.filter(username__in=options['usernames'])
+        total = rebuild_all(users)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {total} timeline(s)'))
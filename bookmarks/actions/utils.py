@@ -1,7 +1,18 @@
-import datetime
-from django.utils import timezone
-from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 from .models import Action
+from bookmarks.redis_client import ar, pipeline, r
+from .feed import apush_action, push_action, push_actions
+
+# Одинаковые действия (пользователь, глагол, цель) не повторяются
+# в течение этого числа секунд
+DEDUP_WINDOW = 60
+
+
+def dedup_key(user, verb, target=None):
+    key = f'action:dedup:{user.id}:{verb}'
+    if target is not None:
+        key += f':{target._meta.label_lower}:{target.pk}'
+    return key
 
 
 def create_action(user, verb, target=None):
@@ -12,20 +23,72 @@ def create_action(user, verb, target=None):
      чтобы добавлять новые действия в поток активности.
     """
     # проверить, не было ли каких-либо аналогичных
-    # действий, совершенных за последнюю минуту
-    now = timezone.now()
-    last_minute = now - datetime.timedelta(seconds=60)
-    simular_actions = Action.objects.filter(user_id=user.id,
-                                            verb=verb,
-                                            created__gte=last_minute)
-    if target:
-        target_ct = ContentType.objects.get_for_model(target)
-        simular_actions = simular_actions.filter(
-            target_ct=target_ct,
-            target_id=target.id)
-    if not simular_actions:
-        # никаких существующих действий не найдено
-        action = Action(user=user, verb=verb, target=target)
+    # действий, совершенных за последнюю минуту: ключ с истекающим сроком
+    # устанавливается атомарно командой SET NX EX, поэтому проверка стоит
+    # одного обращения к Redis и не требует SELECT к таблице действий
+    key = dedup_key(user, verb, target)
+    if not r.set(key, 1, nx=True, ex=DEDUP_WINDOW):
+        return False
+    # никаких существующих действий не найдено
+    action = Action(user=user, verb=verb, target=target)
+    try:
         action.save()
-        return True
-    return False
+    except Exception:
+        # действие не сохранено - не подавлять следующую попытку
+        r.delete(key)
+        raise
+    # разослать действие в ленты подписчиков после фиксации транзакции:
+    # при откате действия в лентах не окажется
+    transaction.on_commit(lambda: push_action(action))
+    return True
+
+
+async def acreate_action(user, verb, target=None):
+    """
+    Вариант create_action() для асинхронных представлений: проверка
+    повтора и рассылка в ленты выполняются клиентом redis.asyncio,
+    действие сохраняется асинхронным интерфейсом ORM.
+    """
+    key = dedup_key(user, verb, target)
+    if not await ar.set(key, 1, nx=True, ex=DEDUP_WINDOW):
+        return False
+    try:
+        action = await Action.objects.acreate(user=user, verb=verb,
+                                              target=target)
+    except Exception:
+        await ar.delete(key)
+        raise
+    # асинхронные представления выполняются вне транзакции (в режиме
+    # автофиксации), поэтому действие уже зафиксировано
+    await apush_action(action)
+    return True
+
+
+def create_actions(items):
+    """
+    Пакетный вариант create_action(): items - последовательность кортежей
+    (user, verb, target). Проверка повторов выполняется одним конвейером
+    Redis, новые действия вставляются одним bulk_create и рассылаются
+    подписчикам пачкой. Возвращает список созданных действий.
+    """
+    items = list(items)
+    if not items:
+        return []
+    keys = [dedup_key(user, verb, target) for user, verb, target in items]
+    with pipeline() as pipe:
+        for key in keys:
+            pipe.set(key, 1, nx=True, ex=DEDUP_WINDOW)
+    fresh = pipe.results
+    actions = [Action(user=user, verb=verb, target=target)
+               for (user, verb, target), is_new in zip(items, fresh)
+               if is_new]
+    try:
+        actions = Action.objects.bulk_create(actions)
+    except Exception:
+        # снять только ключи, установленные этим вызовом
+        taken = [key for key, is_new in zip(keys, fresh) if is_new]
+        if taken:
+            r.delete(*taken)
+        raise
+    transaction.on_commit(lambda: push_actions(actions))
+    return actions
@@ -0,0 +1,300 @@
+"""
+Нагрузочный прогон основных страниц тестовым клиентом Django. Запросы
+проходят через все промежуточные слои и представления, но без сети;
+Redis и кеш Django при redis='memory' заменяются хранилищами в памяти
+процесса (REDIS_BACKEND = 'memory' и LocMemCache), поэтому прогон не
+требует запущенного сервера Redis. Данные для прогона создает команда
+seed_data (см. benchmark/seed.py).
+
+Сценарии (функции из SCENARIOS) выполняются по очереди: каждый делает
+requests запросов от имени случайных пользователей из выборки clients. Для
+каждого сценария считаются перцентили p50/p95/p99 и среднее время
+ответа, число запросов к базе данных на ответ и пропускная способность.
+Результат - словарь, который команда run_benchmark сохраняет в JSON
+и сравнивает с предыдущим прогоном функцией compare().
+"""
+
+import datetime
+import math
+import random
+import statistics
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from account.models import Contact
+from actions.feed import rebuild_timeline
+from actions.models import Action
+from bookmarks.redis_client import pipeline
+from images import ranking
+from images.models import Image
+from .seed import PREFIX
+
+# Число страниц бесконечной прокрутки списка изображений подряд
+SCROLL_PAGES = 5
+# Показатели, по которым compare() сравнивает прогоны
+COMPARED = ('p50_ms', 'p95_ms', 'p99_ms', 'queries_mean', 'throughput')
+
+
+class QueryCounter:
+    # Счетчик запросов ко всем базам данных (execute_wrapper)
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class BenchmarkContext:
+    """
+    Состояние прогона: клиенты вошедших пользователей, выборка
+    изображений и пользователей, позиции прокрутки, поставленные
+    лайки и подписки.
+    """
+
+    def __init__(self, rng, users, images, targets):
+        self.rng = rng
+        self.clients = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            client.user = user
+            self.clients.append(client)
+        self.images = images
+        self.targets = targets
+        self.cursors = {}
+        self.liked = set()
+        self.following = set(Contact.objects.filter(
+            user_form__in=users, user_to_id__in=targets)
+            .values_list('user_form_id', 'user_to_id'))
+
+
+def dashboard(client, context):
+    return client.get(reverse('dashboard'))
+
+
+def image_list(client, context):
+    # Бесконечная прокрутка: первая страница, затем следующие по курсору
+    # из X-Next-Cursor, не более SCROLL_PAGES страниц подряд
+    position = context.cursors.get(client.user.id)
+    if position is None:
+        response = client.get(reverse('images:list'))
+        position = (response.get('X-Next-Cursor'), 1)
+    else:
+        cursor, pages = position
+        response = client.get(reverse('images:list'),
+                              {'images_only': 1, 'cursor': cursor})
+        position = (response.get('X-Next-Cursor'), pages + 1)
+    if not position[0] or position[1] >= SCROLL_PAGES:
+        position = None
+    context.cursors[client.user.id] = position
+    return response
+
+
+def image_detail(client, context):
+    image_id, url = context.rng.choice(context.images)
+    return client.get(url)
+
+
+def image_views(client, context):
+    # Запрос, который страница изображения отправляет при каждом показе
+    image_id, url = context.rng.choice(context.images)
+    return client.post(reverse('images:views', args=[image_id]))
+
+
+def image_like(client, context):
+    image_id, url = context.rng.choice(context.images)
+    key = (client.user.id, image_id)
+    action = 'unlike' if key in context.liked else 'like'
+    context.liked ^= {key}
+    return client.post(reverse('images:like'),
+                       {'id': image_id, 'action': action})
+
+
+def user_follow(client, context):
+    target = context.rng.choice(context.targets)
+    key = (client.user.id, target)
+    action = 'unfollow' if key in context.following else 'follow'
+    context.following ^= {key}
+    return client.post(reverse('user_follow'),
+                       {'id': target, 'action': action})
+
+
+def image_ranking(client, context):
+    period = context.rng.choice(
+        [None] + list(ranking.PERIODS) + [ranking.TRENDING])
+    return client.get(reverse('images:ranking'),
+                      {'period': period} if period else {})
+
+
+SCENARIOS = {'dashboard': dashboard,
+             'image_list': image_list,
+             'image_detail': image_detail,
+             'image_views': image_views,
+             'image_like': image_like,
+             'user_follow': user_follow,
+             'image_ranking': image_ranking}
+
+
+def percentile(values, q):
+    # Перцентиль по ближайшему рангу; values отсортированы
+    if not values:
+        return 0.0
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+
+def summarize(latencies, queries, errors):
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {'requests': len(latencies),
+            'errors': errors,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'mean_ms': round(total / len(latencies) * 1000, 3)
+            if latencies else 0.0,
+            'queries_mean': round(statistics.fmean(queries), 2)
+            if queries else 0.0,
+            'queries_max': max(queries, default=0),
+            'throughput': round(len(latencies) / total, 1)
+            if total else 0.0}
+
+
+def measure(scenario, context, requests, warmup):
+    latencies = []
+    queries = []
+    errors = 0
+    for n in range(warmup + requests):
+        client = context.rng.choice(context.clients)
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            started = time.perf_counter()
+            response = scenario(client, context)
+            latency = time.perf_counter() - started
+        if n < warmup:
+            # первые запросы заполняют кеши и не учитываются
+            continue
+        if response.status_code >= 400:
+            errors += 1
+        latencies.append(latency)
+        queries.append(counter.count)
+    return summarize(latencies, queries, errors)
+
+
+def warm_redis(context):
+    # Хранилище в памяти пусто: построить ленты пользователей выборки
+    # и заполнить рейтинги просмотрами изображений
+    for client in context.clients:
+        rebuild_timeline(client.user)
+    with pipeline() as pipe:
+        for image_id, url in context.images:
+            ranking.add_views(pipe, image_id,
+                              context.rng.randint(1, 100))
+    ranking.update_rankings()
+
+
+def stand_in_settings(redis):
+    overrides = {'DEBUG': False,
+                 'ALLOWED_HOSTS': list(settings.ALLOWED_HOSTS) +
+                 ['testserver']}
+    if redis == 'memory':
+        overrides['REDIS_BACKEND'] = 'memory'
+        overrides['CACHES'] = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            }
+        }
+    return overrides
+
+
+def data_counts():
+    return {'users': User.objects.filter(username__startswith=PREFIX)
+            .count(),
+            'images': Image.objects.count(),
+            'contacts': Contact.objects.count(),
+            'likes': Image.users_like.through.objects.count(),
+            'actions': Action.objects.count()}
+
+
+def sample(rng, clients):
+    """
+    Выборка для прогона: clients пользователей генератора, от имени
+    которых идут запросы, до 1000 изображений (id, адрес страницы) и до
+    1000 пользователей для подписок.
+    """
+    user_ids = list(User.objects.filter(username__startswith=PREFIX)
+                    .values_list('id', flat=True))
+    if not user_ids:
+        raise ValueError('no benchmark users, run seed_data first')
+    users = list(User.objects.filter(
+        id__in=rng.sample(user_ids, min(clients, len(user_ids)))))
+    image_ids = list(Image.objects.filter(status=Image.Status.READY)
+                     .values_list('id', flat=True))
+    images = [(image.id, image.get_absolute_url())
+              for image in Image.objects.filter(
+                  id__in=rng.sample(image_ids, min(1000, len(image_ids))))
+              .only('id', 'slug')]
+    if not images:
+        raise ValueError('no images, run seed_data first')
+    targets = rng.sample(user_ids, min(1000, len(user_ids)))
+    return users, images, targets
+
+
+def run(requests=200, clients=20, scenarios=SCENARIOS, redis='memory',
+        random_seed=0, warmup=10, progress=None):
+    """
+    Выполнить сценарии scenarios по requests запросов (после warmup
+    неучитываемых) от имени clients пользователей генератора. Возвращает
+    словарь с параметрами прогона, объемом данных и показателями
+    сценариев.
+    """
+    rng = random.Random(random_seed)
+    progress = progress or (lambda name, result: None)
+    users, images, targets = sample(rng, clients)
+
+    started = datetime.datetime.now(datetime.timezone.utc)
+    results = {}
+    with override_settings(**stand_in_settings(redis)):
+        context = BenchmarkContext(rng, users, images, targets)
+        if redis == 'memory':
+            warm_redis(context)
+        for name in scenarios:
+            results[name] = measure(SCENARIOS[name], context,
+                                    requests, warmup)
+            progress(name, results[name])
+    return {'started': started.isoformat(),
+            'parameters': {'requests': requests,
+                           'clients': len(users),
+                           'warmup': warmup,
+                           'redis': redis,
+                           'seed': random_seed,
+                           'database': settings.DATABASES['default']
+                           ['ENGINE'],
+                           'replicas': len(settings.DATABASE_REPLICAS)},
+            'data': data_counts(),
+            'scenarios': results}
+
+
+def compare(previous, current):
+    """
+    Изменения показателей сценариев относительно предыдущего прогона:
+    словарь {сценарий: {показатель: (было, стало, изменение в %)}}.
+    """
+    changes = {}
+    for name, result in current['scenarios'].items():
+        before = previous.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        changes[name] = {}
+        for metric in COMPARED:
+            old, new = before.get(metric, 0), result.get(metric, 0)
+            delta = (new - old) / old * 100 if old else 0.0
+            changes[name][metric] = (old, new, round(delta, 1))
+    return changes
@@ -0,0 +1,112 @@
+import datetime
+import json
+from django.core.management.base import BaseCommand, CommandError
+from benchmark import harness, protocols
+
+
+class Command(BaseCommand):
+    """
+    Прогнать сценарии нагрузочного теста (см. benchmark/harness.py) на
+    данных команды seed_data. Результат сохраняется в JSON (--output);
+    с --compare выводится изменение показателей относительно сохраненного
+    ранее прогона. По умолчанию Redis и кеш заменяются хранилищами
+    в памяти процесса; --redis server использует настроенный сервер.
+    С --protocols асинхронные представления прогоняются обработчиками
+    WSGI и ASGI и сравнивается число ответов в секунду на рабочий
+    процесс (см. benchmark/protocols.py).
+    """
+    help = 'Benchmark the main pages and report latency percentiles, ' \
+           'queries per request and throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='measured requests per scenario')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--clients', type=int, default=20,
+                            help='number of logged in users to sample')
+        parser.add_argument('--scenario', action='append',
+                            choices=list(harness.SCENARIOS),
+                            help='run only these scenarios')
+        parser.add_argument('--redis', choices=['memory', 'server'],
+                            default='memory')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output',
+                            help='JSON file for the results, '
+                                 'by default benchmark-<time>.json')
+        parser.add_argument('--compare',
+                            help='JSON file of a previous run')
+        parser.add_argument('--protocols', action='store_true',
+                            help='compare WSGI and ASGI on the async views')
+        parser.add_argument('--concurrency', type=int, default=20,
+                            help='requests in flight in the ASGI run')
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)
+        if options['protocols']:
+            return self.compare_protocols(options)
+        try:
+            results = harness.run(
+                requests=options['requests'],
+                clients=options['clients'],
+                scenarios=options['scenario'] or list(harness.SCENARIOS),
+                redis=options['redis'],
+                random_seed=options['seed'],
+                warmup=options['warmup'],
+                progress=self.progress)
+        except ValueError as e:
+            raise CommandError(e)
+        output = options['output'] or datetime.datetime.now()\
+            .strftime('benchmark-%Y%m%d-%H%M%S.json')
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(f'results saved to {output}')
+        if previous is not None:
+            self.report_changes(harness.compare(previous, results))
+
+    def compare_protocols(self, options):
+        try:
+            results = protocols.run(
+                requests=options['requests'],
+                clients=options['clients'],
+                scenarios=options['scenario'] or
+                protocols.PROTOCOL_SCENARIOS,
+                redis=options['redis'],
+                random_seed=options['seed'],
+                warmup=options['warmup'],
+                concurrency=options['concurrency'],
+                progress=self.protocol_progress)
+        except ValueError as e:
+            raise CommandError(e)
+        output = options['output'] or datetime.datetime.now()\
+            .strftime('protocols-%Y%m%d-%H%M%S.json')
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(f'results saved to {output}')
+        for name, speedup in results['speedup'].items():
+            self.stdout.write(f'{name:14} ASGI/WSGI throughput {speedup:.2f}x')
+
+    def protocol_progress(self, protocol, name, result):
+        self.stdout.write(
+            f'{protocol} {name:14} p50 {result["p50_ms"]:8.2f} ms  '
+            f'p95 {result["p95_ms"]:8.2f} ms  '
+            f'{result["throughput"]:8.1f} req/s  '
+            f'{result["errors"]} errors')
+
+    def progress(self, name, result):
+        self.stdout.write(
+            f'{name:14} p50 {result["p50_ms"]:8.2f} ms  '
+            f'p95 {result["p95_ms"]:8.2f} ms  '
+            f'p99 {result["p99_ms"]:8.2f} ms  '
+            f'{result["queries_mean"]:6.1f} queries  '
+            f'{result["throughput"]:8.1f} req/s  '
+            f'{result["errors"]} errors')
+
+    def report_changes(self, changes):
+        self.stdout.write('change from the previous run:')
+        for name, metrics in changes.items():
+            self.stdout.write(name + ': ' + ', '.join(
+                f'{metric} {old} -> {new} ({delta:+.1f}%)'
+                for metric, (old, new, delta) in metrics.items()))
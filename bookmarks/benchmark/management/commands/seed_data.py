@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from benchmark import seed
+
+
+class Command(BaseCommand):
+    """
+    Заполнить базу данных синтетическими данными для нагрузочных тестов
+    (см. benchmark/seed.py). Команду следует запускать на отдельной базе
+    данных: пользователи генератора входят с общим паролем
+    benchmark.seed.PASSWORD. --clear сначала удаляет данные прошлых
+    запусков. Задания скачивания не создаются: изображения сразу готовы
+    и ссылаются на общий файл-заглушку.
+    """
+    help = 'Seed the database with synthetic users, images, likes ' \
+           'and actions for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--images-per-user', type=int, default=5)
+        parser.add_argument('--follows-per-user', type=int, default=20)
+        parser.add_argument('--likes-per-image', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0,
+                            help='random seed, for reproducible data')
+        parser.add_argument('--clear', action='store_true',
+                            help='delete data of previous runs first')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted, by_model = seed.clear()
+            self.stdout.write(f'deleted {deleted} rows')
+        counts = seed.seed(options['users'],
+                           images_per_user=options['images_per_user'],
+                           follows_per_user=options['follows_per_user'],
+                           likes_per_image=options['likes_per_image'],
+                           random_seed=options['seed'],
+                           progress=self.progress)
+        self.stdout.write(self.style.SUCCESS(
+            'seeded ' + ', '.join(f'{count} {name}'
+                                  for name, count in counts.items())))
+
+    def progress(self, stage, count):
+        self.stdout.write(f'{stage}: {count}')
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    """
+    Скопировать основную базу SQLite в файлы реплик DATABASE_REPLICAS
+    средствами резервного копирования SQLite: копия согласована, даже если
+    в основную базу в это время пишут. Локальные файлы заменяют настоящие
+    реплики при нагрузочных прогонах; запуск по расписанию имитирует
+    отставание реплик.
+    """
+    help = 'Copy the primary SQLite database into the replica files'
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('no replicas, set DATABASE_REPLICAS')
+        primary = connections[DEFAULT_DB_ALIAS]
+        primary.ensure_connection()
+        for alias in settings.DATABASE_REPLICAS:
+            replica = connections[alias]
+            replica.ensure_connection()
+            primary.connection.backup(replica.connection)
+            self.stdout.write(f'{alias}: {replica.settings_dict["NAME"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Synced {len(settings.DATABASE_REPLICAS)} replica(s)'))
@@ -0,0 +1,140 @@
+"""
+Сравнение обработчиков WSGI и ASGI на представлениях с асинхронными
+вариантами (страница изображения, учет просмотра, лайк и подписка). Оба
+прогона идут в одном процессе, то есть соответствуют одному рабочему
+процессу сервера:
+  • WSGI - синхронный обработчик (тестовый клиент Django) и синхронные
+    варианты представлений: запросы выполняются по одному, как
+    в синхронном рабочем процессе gunicorn;
+  • ASGI - асинхронный обработчик (AsyncClient) и асинхронные варианты
+    (ASYNC_ROOT_URLCONF) в одном цикле событий: одновременно
+    обрабатывается до concurrency запросов, как в рабочем процессе
+    uvicorn.
+
+Пропускная способность считается как число ответов в секунду времени
+прогона, поэтому при одновременных запросах она больше, чем 1/среднее
+время ответа. Выигрыш ASGI зависит от доли ожидания ввода-вывода: с
+хранилищем Redis в памяти процесса (--redis memory) ждать нечего, и
+результат показывает накладные расходы асинхронного стека; реальное
+сравнение - с сервером Redis (--redis server).
+"""
+
+import asyncio
+import random
+import time
+from django.test import AsyncClient, override_settings
+from bookmarks.redis_client import ar
+from .harness import SCENARIOS, BenchmarkContext, sample, \
+    stand_in_settings, summarize, warm_redis
+
+# Сценарии асинхронных представлений
+PROTOCOL_SCENARIOS = ('image_detail', 'image_views', 'image_like',
+                      'user_follow')
+
+
+def result(latencies, errors, elapsed):
+    # Показатели summarize() без числа запросов к базе данных (они идут
+    # из разных потоков) и с пропускной способностью по времени прогона
+    data = summarize(latencies, [], errors)
+    del data['queries_mean'], data['queries_max']
+    data['throughput'] = round(len(latencies) / elapsed, 1) \
+        if elapsed else 0.0
+    return data
+
+
+def measure_wsgi(scenario, context, requests, warmup):
+    latencies = []
+    errors = 0
+    for _ in range(warmup):
+        scenario(context.rng.choice(context.clients), context)
+    started = time.perf_counter()
+    for _ in range(requests):
+        client = context.rng.choice(context.clients)
+        request_started = time.perf_counter()
+        response = scenario(client, context)
+        latencies.append(time.perf_counter() - request_started)
+        errors += response.status_code >= 400
+    return result(latencies, errors, time.perf_counter() - started)
+
+
+async def _measure_asgi(scenario, context, requests, concurrency):
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal errors, remaining
+        while remaining > 0:
+            remaining -= 1
+            client = context.rng.choice(context.async_clients)
+            started = time.perf_counter()
+            response = await scenario(client, context)
+            latencies.append(time.perf_counter() - started)
+            errors += response.status_code >= 400
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return result(latencies, errors, time.perf_counter() - started)
+
+
+def measure_asgi(scenario, context, requests, warmup, concurrency):
+    async def run_all():
+        try:
+            await _measure_asgi(scenario, context, warmup, concurrency)
+            return await _measure_asgi(scenario, context, requests,
+                                       concurrency)
+        finally:
+            # соединения redis.asyncio закрываются вместе с циклом
+            await ar.aclose()
+    return asyncio.run(run_all())
+
+
+def async_clients(clients):
+    # Асинхронные клиенты с сессиями вошедших синхронных клиентов
+    copies = []
+    for client in clients:
+        async_client = AsyncClient()
+        async_client.cookies = client.cookies
+        async_client.user = client.user
+        copies.append(async_client)
+    return copies
+
+
+def run(requests=200, clients=20, scenarios=PROTOCOL_SCENARIOS,
+        redis='memory', random_seed=0, warmup=10, concurrency=20,
+        progress=None):
+    """
+    Выполнить сценарии scenarios обработчиками WSGI и ASGI. Возвращает
+    параметры прогона и показатели сценариев для каждого обработчика,
+    а также отношение пропускной способности ASGI к WSGI.
+    """
+    if requests < 1 or concurrency < 1:
+        raise ValueError('requests and concurrency must be at least 1')
+    rng = random.Random(random_seed)
+    progress = progress or (lambda protocol, name, result: None)
+    users, images, targets = sample(rng, clients)
+    results = {'wsgi': {}, 'asgi': {}}
+    with override_settings(**stand_in_settings(redis)):
+        context = BenchmarkContext(rng, users, images, targets)
+        context.async_clients = async_clients(context.clients)
+        if redis == 'memory':
+            warm_redis(context)
+        for name in scenarios:
+            results['wsgi'][name] = measure_wsgi(SCENARIOS[name], context,
+                                                 requests, warmup)
+            progress('wsgi', name, results['wsgi'][name])
+            results['asgi'][name] = measure_asgi(SCENARIOS[name], context,
+                                                 requests, warmup,
+                                                 concurrency)
+            progress('asgi', name, results['asgi'][name])
+    return {'parameters': {'requests': requests,
+                           'clients': len(users),
+                           'warmup': warmup,
+                           'concurrency': concurrency,
+                           'redis': redis,
+                           'seed': random_seed},
+            'scenarios': results,
+            'speedup': {name: round(results['asgi'][name]['throughput'] /
+                                    results['wsgi'][name]['throughput'], 2)
+                        if results['wsgi'][name]['throughput'] else 0.0
+                        for name in scenarios}}
@@ -0,0 +1,233 @@
+"""
+Генератор синтетических данных для нагрузочных тестов. Создает
+пользователей с профилями, граф подписок Contact, изображения, лайки и
+действия Action. Все записи вставляются через bulk_create пачками по
+BATCH_SIZE, поэтому сигналы моделей не отправляются: поисковый индекс
+и счетчики total_likes обновляются отдельно, одним проходом.
+
+Распределения близки к настоящим: число подписок, изображений и лайков
+у пользователей подчиняется степенному закону (немногие очень активны,
+большинство - почти нет), а подписчики и лайки выбираются по
+популярности по закону Ципфа, поэтому у нескольких пользователей и
+изображений их тысячи, а у большинства - единицы.
+
+Имена пользователей начинаются с PREFIX; clear() удаляет их вместе
+со всеми созданными для них данными.
+"""
+
+import itertools
+import random
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Max
+from django.utils.text import slugify
+from account.models import Contact, Profile, UserEmail, normalize_email
+from actions.models import Action
+from images.likes import reconcile
+from images.models import Image
+from images.search import search_backend
+
+PREFIX = 'bench-'
+PASSWORD = 'bench-password'
+# Все изображения ссылаются на один файл: страницы строят адреса
+# миниатюр по имени файла и не читают хранилище
+PLACEHOLDER = 'benchmark/placeholder.png'
+BATCH_SIZE = 1000
+# Показатель закона Ципфа для популярности пользователей и изображений
+ZIPF_EXPONENT = 1.1
+WORDS = ('red', 'blue', 'green', 'sunset', 'mountain', 'city', 'river',
+         'forest', 'street', 'portrait', 'cat', 'dog', 'bridge', 'night',
+         'winter', 'summer', 'sea', 'desert', 'flower', 'market', 'train',
+         'old', 'new', 'quiet', 'bright', 'dark', 'tall', 'small')
+FIRST_NAMES = ('Anna', 'Ivan', 'Maria', 'Oleg', 'Elena', 'Pavel', 'Olga',
+               'Sergey', 'Irina', 'Dmitry', 'Nina', 'Alexey')
+LAST_NAMES = ('Ivanova', 'Petrov', 'Smirnova', 'Volkov', 'Kuznetsova',
+              'Sokolov', 'Popova', 'Lebedev', 'Novikova', 'Morozov')
+
+
+def power_law(rng, mean, maximum):
+    # Распределение Парето с показателем 2: среднее значение равно mean
+    return min(int(rng.paretovariate(2) * mean / 2), maximum)
+
+
+def zipf_weights(count):
+    return [1 / (rank + 1) ** ZIPF_EXPONENT for rank in range(count)]
+
+
+def _batches(iterable, size=BATCH_SIZE):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _bulk_create(model, objects):
+    total = 0
+    for batch in _batches(objects):
+        model.objects.bulk_create(batch)
+        total += len(batch)
+    return total
+
+
+def _phrase(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _max_id(model):
+    return model.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+
+
+def create_users(rng, count):
+    # Хеш пароля вычисляется один раз: он намеренно медленный
+    password = make_password(PASSWORD)
+    start = User.objects.filter(username__startswith=PREFIX).count()
+    last_id = _max_id(User)
+    names = [(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+             for _ in range(count)]
+    _bulk_create(User, (
+        User(username=f'{PREFIX}{start + i}',
+             first_name=first_name,
+             last_name=last_name,
+             email=f'{PREFIX}{start + i}@example.com',
+             password=password)
+        for i, (first_name, last_name) in enumerate(names)))
+    users = list(User.objects.filter(id__gt=last_id,
+                                     username__startswith=PREFIX)
+                 .order_by('id')
+                 .values_list('id', 'username', 'first_name', 'last_name',
+                              'email'))
+    # Profile.save() и сигналы не вызываются: поля, которые они
+    # заполняют, задаются здесь
+    _bulk_create(Profile, (
+        Profile(user_id=user_id,
+                search_name=f'{first_name} {last_name}'.lower(),
+                search_username=username.lower())
+        for user_id, username, first_name, last_name, email in users))
+    _bulk_create(UserEmail, (
+        UserEmail(user_id=user_id, email=normalize_email(email))
+        for user_id, username, first_name, last_name, email in users))
+    return [user_id for user_id, *rest in users]
+
+
+def create_follows(rng, user_ids, follows_per_user):
+    # Подписки выбираются по популярности: пользователи перемешиваются,
+    # и вес каждого убывает по закону Ципфа
+    popular = rng.sample(user_ids, len(user_ids))
+    weights = list(itertools.accumulate(zipf_weights(len(popular))))
+    pairs = []
+    for user_id in user_ids:
+        count = power_law(rng, follows_per_user, len(user_ids) - 1)
+        targets = set(rng.choices(popular, cum_weights=weights, k=count))
+        targets.discard(user_id)
+        pairs.extend((user_id, target) for target in targets)
+    _bulk_create(Contact, (Contact(user_form_id=user_id, user_to_id=target)
+                           for user_id, target in pairs))
+    return pairs
+
+
+def create_images(rng, user_ids, images_per_user):
+    last_id = _max_id(Image)
+    owners = []
+    for user_id in user_ids:
+        count = power_law(rng, images_per_user, images_per_user * 50)
+        owners.extend([user_id] * count)
+    images = []
+    for n, user_id in enumerate(owners):
+        title = _phrase(rng, 3).capitalize()
+        images.append(Image(user_id=user_id,
+                            title=title,
+                            slug=slugify(title),
+                            url=f'https://example.com/{PREFIX}{last_id + n}'
+                                f'.png',
+                            image=PLACEHOLDER,
+                            description=_phrase(rng, 12),
+                            status=Image.Status.READY))
+    _bulk_create(Image, images)
+    rows = list(Image.objects.filter(id__gt=last_id,
+                                     url__startswith='https://example.com/'
+                                                     + PREFIX)
+                .order_by('id')
+                .values_list('id', 'user_id', 'title', 'description'))
+    for batch in _batches(rows):
+        search_backend.index([(image_id, title, description)
+                              for image_id, user_id, title, description
+                              in batch])
+    return [(image_id, user_id) for image_id, user_id, *rest in rows]
+
+
+def create_likes(rng, user_ids, image_ids, likes_per_image):
+    # Лайки распределяются по популярности изображений (закон Ципфа),
+    # лайкающий пользователь выбирается равномерно
+    if not image_ids or not user_ids:
+        return []
+    popular = rng.sample(image_ids, len(image_ids))
+    weights = list(itertools.accumulate(zipf_weights(len(popular))))
+    total = len(image_ids) * likes_per_image
+    pairs = set(zip(rng.choices(popular, cum_weights=weights, k=total),
+                    rng.choices(user_ids, k=total)))
+    through = Image.users_like.through
+    for batch in _batches(pairs):
+        through.objects.bulk_create(
+            [through(image_id=image_id, user_id=user_id)
+             for image_id, user_id in batch],
+            ignore_conflicts=True)
+    # bulk_create не отправляет m2m_changed: счетчики total_likes
+    # пересчитываются одним агрегирующим запросом
+    reconcile(BATCH_SIZE)
+    return list(pairs)
+
+
+def create_actions(follows, images, likes):
+    user_type = ContentType.objects.get_for_model(User)
+    image_type = ContentType.objects.get_for_model(Image)
+    actions = itertools.chain(
+        (Action(user_id=user_id, verb='is following',
+                target_ct=user_type, target_id=target)
+         for user_id, target in follows),
+        (Action(user_id=user_id, verb='bookmarked image',
+                target_ct=image_type, target_id=image_id)
+         for image_id, user_id in images),
+        (Action(user_id=user_id, verb='likes',
+                target_ct=image_type, target_id=image_id)
+         for image_id, user_id in likes))
+    return _bulk_create(Action, actions)
+
+
+def seed(users, images_per_user=5, follows_per_user=20, likes_per_image=3,
+         random_seed=0, progress=None):
+    """
+    Создать users пользователей и связанные с ними данные. Средние
+    значения задаются параметрами *_per_*; random_seed делает данные
+    воспроизводимыми. progress(этап, число) вызывается после каждого
+    этапа. Возвращает число созданных записей по моделям.
+    """
+    rng = random.Random(random_seed)
+    progress = progress or (lambda stage, count: None)
+    with transaction.atomic():
+        user_ids = create_users(rng, users)
+        progress('users', len(user_ids))
+        follows = create_follows(rng, user_ids, follows_per_user)
+        progress('contacts', len(follows))
+        images = create_images(rng, user_ids, images_per_user)
+        progress('images', len(images))
+        likes = create_likes(rng, user_ids,
+                             [image_id for image_id, user_id in images],
+                             likes_per_image)
+        progress('likes', len(likes))
+        actions = create_actions(follows, images, likes)
+        progress('actions', actions)
+    return {'users': len(user_ids),
+            'contacts': len(follows),
+            'images': len(images),
+            'likes': len(likes),
+            'actions': actions}
+
+
+def clear():
+    # Удалить пользователей генератора; их профили, подписки, изображения,
+    # лайки и действия удаляются каскадно
+    return User.objects.filter(username__startswith=PREFIX).delete()
@@ -0,0 +1,89 @@
+"""
+Средства асинхронных представлений для Django 4.1. Декораторы
+login_required и require_POST этой версии оборачивают
+представление синхронной функцией, и Django перестает распознавать
+сопрограмму, поэтому для асинхронных представлений используются их
+варианты из этого модуля.
+
+request.user вычисляется лениво синхронными запросами к сессии и базе
+данных; в асинхронном коде пользователь получается через aget_user(),
+которая выполняет их в потоке один раз за запрос.
+
+Асинхронные представления выгодны только под ASGI. Под WSGI Django
+вызывает их через async_to_sync, то есть с новым циклом событий на каждый
+запрос и лишними переходами между потоками, а соединения redis.asyncio не
+переживают цикл. Поэтому у горячих представлений два варианта с общими
+именами URL: синхронные в ROOT_URLCONF и асинхронные в ASYNC_ROOT_URLCONF,
+а AsyncViewsMiddleware направляет запросы, пришедшие через ASGI, во
+вторую конфигурацию.
+"""
+
+import asyncio
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, HttpResponseNotAllowed
+from django.utils.functional import empty
+from .instrumentation import markcoroutinefunction
+
+
+async def aget_user(request):
+    user = request.user
+    if getattr(user, '_wrapped', None) is empty:
+        await sync_to_async(user._setup)()
+        return user._wrapped
+    return getattr(user, '_wrapped', user)
+
+
+async def aget_object_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f'No {queryset.model._meta.object_name} '
+                      f'matches the given query.')
+
+
+def async_login_required(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path(),
+                                     settings.LOGIN_URL)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def async_require_POST(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+class AsyncViewsMiddleware:
+    """
+    Под ASGI (асинхронная цепочка промежуточных слоев) разрешает адрес
+    запроса по ASYNC_ROOT_URLCONF, под WSGI ничего не меняет.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.urlconf = settings.ASYNC_ROOT_URLCONF
+        return await self.get_response(request)
@@ -0,0 +1,338 @@
+"""
+Инструментирование запросов в рабочем окружении. Промежуточный слой
+InstrumentationMiddleware измеряет для каждого запроса:
+  • время обработки;
+  • число и время запросов к базе данных (обертка execute_wrappers
+    каждого соединения, см. _instrument_connection());
+  • число и время команд Redis (их сообщает bookmarks/redis_client.py);
+  • время прорисовки шаблонов.
+
+Показатели накапливаются по имени представления (view_name из URLconf)
+в metrics текущего процесса и выводятся в текстовом формате Prometheus
+представлением bookmarks.views.metrics. Кроме того, каждый запрос
+может записываться в журнал bookmarks.access одной строкой JSON; журнал
+выключен по умолчанию (см. LOGGING), и тогда запись не формируется.
+
+QUERY_BUDGETS задает для представлений наибольшее допустимое число
+запросов к базе данных. При превышении QUERY_BUDGET_ACTION = 'log' пишет
+предупреждение в журнал, а 'raise' - вызывает QueryBudgetExceeded
+в момент лишнего запроса, чтобы в трассировке было видно, откуда он.
+
+Промежуточный слой работает и в синхронном, и в асинхронном стеке
+(ASGI). Запросы асинхронных представлений к базе данных выполняются
+в потоках sync_to_async со своими соединениями; переменная контекста
+current передается в эти потоки, поэтому обертка, установленная
+в каждое соединение при его открытии, относит запросы к нужному
+HTTP-запросу.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+try:
+    from asgiref.sync import markcoroutinefunction
+except ImportError:  # asgiref < 3.6
+    def markcoroutinefunction(func):
+        func._is_coroutine = asyncio.coroutines._is_coroutine
+        return func
+
+logger = logging.getLogger('bookmarks.requests')
+access_logger = logging.getLogger('bookmarks.access')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+UNRESOLVED = 'unresolved'
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestStats:
+    """
+    Показатели одного запроса. Объект текущего запроса хранится
+    в переменной контекста current, поэтому потоки и асинхронные
+    задачи не смешивают свои показатели.
+    """
+
+    def __init__(self):
+        self.view = UNRESOLVED
+        self.budget = None
+        self.queries = 0
+        self.query_time = 0.0
+        self.redis_commands = 0
+        self.redis_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def as_dict(self):
+        return {'view': self.view,
+                'queries': self.queries,
+                'query_time': round(self.query_time, 6),
+                'redis_commands': self.redis_commands,
+                'redis_time': round(self.redis_time, 6),
+                'template_time': round(self.template_time, 6)}
+
+
+current = contextvars.ContextVar('request_stats', default=None)
+
+
+def observe_redis(commands, latency):
+    # Вызывается клиентом Redis после каждой команды и конвейера
+    stats = current.get()
+    if stats is not None:
+        stats.redis_commands += commands
+        stats.redis_time += latency
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+
+    def samples(self):
+        # Накопленные значения корзин, как требует формат Prometheus
+        total = 0
+        for bucket, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield str(bucket), total
+
+
+def _label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"')\
+        .replace('\n', r'\n')
+
+
+class ViewMetrics:
+    """
+    Показатели представлений в текущем процессе: гистограммы времени
+    обработки и числа запросов к базе данных и суммы времени запросов,
+    команд Redis и прорисовки шаблонов. Каждый процесс обработчика
+    ведет свои показатели, поэтому Prometheus опрашивает процессы
+    по отдельности и суммирует их.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.responses = {}
+
+    def observe(self, stats, method, status, duration):
+        with self.lock:
+            view = self.views.get(stats.view)
+            if view is None:
+                view = self.views[stats.view] = {
+                    'duration': Histogram(DURATION_BUCKETS),
+                    'queries': Histogram(QUERY_BUCKETS),
+                    'query_time': 0.0,
+                    'redis_commands': 0,
+                    'redis_time': 0.0,
+                    'template_time': 0.0,
+                    'budget_exceeded': 0}
+            view['duration'].observe(duration)
+            view['queries'].observe(stats.queries)
+            view['query_time'] += stats.query_time
+            view['redis_commands'] += stats.redis_commands
+            view['redis_time'] += stats.redis_time
+            view['template_time'] += stats.template_time
+            if stats.budget is not None and stats.queries > stats.budget:
+                view['budget_exceeded'] += 1
+            key = (stats.view, method, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def render(self):
+        # Текстовый формат Prometheus (text/plain; version=0.0.4)
+        lines = []
+
+        def header(name, kind, help):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self.lock:
+            views = sorted(self.views.items())
+            header('bookmarks_requests_total', 'counter',
+                   'Responses by view, method and status code.')
+            for (view, method, status), count \
+                    in sorted(self.responses.items()):
+                lines.append(f'bookmarks_requests_total{{view="{_label(view)}"'
+                             f',method="{method}",status="{status}"}} '
+                             f'{count}')
+            for name, key, help in (
+                    ('bookmarks_request_duration_seconds', 'duration',
+                     'Request processing time.'),
+                    ('bookmarks_db_queries', 'queries',
+                     'Database queries per request.')):
+                header(name, 'histogram', help)
+                for view, data in views:
+                    histogram = data[key]
+                    label = f'view="{_label(view)}"'
+                    for bucket, total in histogram.samples():
+                        lines.append(f'{name}_bucket{{{label},le="{bucket}"}}'
+                                     f' {total}')
+                    lines.append(f'{name}_sum{{{label}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{label}}} {total}')
+            for name, key, help in (
+                    ('bookmarks_db_query_seconds_total', 'query_time',
+                     'Time spent in database queries.'),
+                    ('bookmarks_redis_commands_total', 'redis_commands',
+                     'Redis commands sent.'),
+                    ('bookmarks_redis_seconds_total', 'redis_time',
+                     'Time spent in Redis commands.'),
+                    ('bookmarks_template_render_seconds_total',
+                     'template_time',
+                     'Time spent rendering templates.'),
+                    ('bookmarks_query_budget_exceeded_total',
+                     'budget_exceeded',
+                     'Requests over the view query budget.')):
+                header(name, 'counter', help)
+                for view, data in views:
+                    lines.append(f'{name}{{view="{_label(view)}"}} '
+                                 f'{data[key]}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = ViewMetrics()
+
+
+def _instrument_connection(sender=None, connection=None, **kwargs):
+    # Обертка остается в соединении на все время его жизни и ничего
+    # не делает вне HTTP-запросов
+    if InstrumentationMiddleware.execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(InstrumentationMiddleware.execute)
+
+
+def _instrument_connections():
+    # Новые соединения получают обертку при открытии, уже созданные
+    # объекты соединений текущего потока - сразу
+    connection_created.connect(_instrument_connection,
+                               dispatch_uid='bookmarks.instrumentation')
+    for connection in connections.all():
+        _instrument_connection(connection=connection)
+
+
+def _instrument_templates():
+    # Время прорисовки шаблонов: Template.render() движка Django
+    # оборачивается один раз на процесс. Вложенная прорисовка
+    # (render_to_string внутри тега шаблона) не учитывается повторно.
+    from django.template.backends.django import Template
+    if getattr(Template.render, 'instrumented', False):
+        return
+    original = Template.render
+
+    def render(self, context=None, request=None):
+        stats = current.get()
+        if stats is None:
+            return original(self, context, request)
+        stats.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            stats.template_depth -= 1
+            if not stats.template_depth:
+                stats.template_time += time.perf_counter() - started
+
+    render.instrumented = True
+    Template.render = render
+
+
+class InstrumentationMiddleware:
+    """
+    Промежуточный слой, измеряющий каждый запрос. Располагается в начале
+    MIDDLEWARE, чтобы учитывать запросы к базе данных и Redis остальных
+    промежуточных слоев (сессии, аутентификации).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        _instrument_templates()
+        _instrument_connections()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        self.finish(request, response, stats,
+                    time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        self.finish(request, response, stats,
+                    time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def finish(request, response, stats, duration):
+        metrics.observe(stats, request.method, response.status_code,
+                        duration)
+        if access_logger.isEnabledFor(logging.INFO):
+            record = stats.as_dict()
+            record.update(method=request.method,
+                          path=request.path,
+                          status=response.status_code,
+                          duration=round(duration, 6))
+            access_logger.info(json.dumps(record))
+        if stats.budget is not None and stats.queries > stats.budget:
+            logger.warning('%s made %s queries, budget is %s',
+                           stats.view, stats.queries, stats.budget)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = current.get()
+        if stats is not None and request.resolver_match:
+            stats.view = request.resolver_match.view_name
+            stats.budget = settings.QUERY_BUDGETS.get(stats.view)
+
+    @staticmethod
+    def execute(execute, sql, params, many, context):
+        stats = current.get()
+        if stats is None:
+            return execute(sql, params, many, context)
+        stats.queries += 1
+        if stats.budget is not None and stats.queries > stats.budget \
+                and settings.QUERY_BUDGET_ACTION == 'raise':
+            raise QueryBudgetExceeded(
+                f'{stats.view} exceeded its budget of {stats.budget} '
+                f'queries: {sql}')
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            stats.query_time += time.perf_counter() - started
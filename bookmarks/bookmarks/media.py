@@ -0,0 +1,152 @@
+"""
+Раздача медиафайлов (изображений, миниатюр и фотоснимков профилей).
+Представление serve_media отвечает на условные запросы (ETag,
+Last-Modified) кодом 304, поддерживает запросы части файла (Range) и
+задает заголовки кеширования. Файлы в blobs/ хранятся под хеш-значением
+содержимого (см. images/blobs.py) и никогда не меняются, поэтому
+кешируются навсегда (immutable); остальные - на MEDIA_CACHE_MAX_AGE секунд.
+
+При MEDIA_SENDFILE = 'x-accel-redirect' (nginx) или 'x-sendfile'
+(Apache, lighttpd) приложение только проверяет запрос и возвращает
+заголовок, по которому файл (в том числе его часть) отправляет
+фронтенд-сервер, - рабочие процессы приложения не передают байты файлов.
+"""
+
+import mimetypes
+import os
+import re
+import stat
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, \
+    StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+# Пути, содержимое которых не меняется: файлы Blob и их миниатюры
+IMMUTABLE_PREFIXES = ('blobs/',)
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+FILE_BLOCK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """
+    Разобрать заголовок Range с одним диапазоном байтов. Возвращает пару
+    (начало, конец) включительно, None, если заголовок нужно игнорировать
+    и отдать файл целиком (в том числе для нескольких диапазонов), или
+    False, если диапазон лежит за пределами файла.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start >= size:
+            return False
+        if end < start:
+            return None
+        return start, end
+    suffix = int(last)
+    if suffix == 0:
+        return False
+    return max(size - suffix, 0), size - 1
+
+
+def _read(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(FILE_BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _sendfile(path, name):
+    # Ответ без тела: файл отправит фронтенд-сервер, он же обработает Range
+    response = HttpResponse()
+    if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + name
+    else:
+        response['X-Sendfile'] = path
+    # Content-Type задает фронтенд-сервер по расширению файла
+    del response['Content-Type']
+    return response
+
+
+def _file_response(request, full_path, size, etag, last_modified):
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if 'Range' in request.headers and \
+            if_range in (None, etag, last_modified):
+        byte_range = parse_range(request.headers['Range'], size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None:
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=content_type)
+            response['Content-Length'] = size
+            return response
+        # Файл целиком; сервер WSGI может отправить его через sendfile()
+        return FileResponse(open(full_path, 'rb'),
+                            content_type=content_type)
+    start, end = byte_range
+    # HEAD возвращает те же заголовки, что и GET с этим диапазоном
+    if request.method == 'HEAD':
+        response = HttpResponse(status=206, content_type=content_type)
+    else:
+        response = StreamingHttpResponse(
+            _read(full_path, start, end - start + 1),
+            status=206,
+            content_type=content_type)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = end - start + 1
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        info = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('File not found')
+    if not stat.S_ISREG(info.st_mode):
+        raise Http404('File not found')
+    name = path.replace(os.sep, '/')
+    size = info.st_size
+    last_modified = int(info.st_mtime)
+    etag = quote_etag(f'{info.st_mtime_ns:x}-{size:x}')
+    if name.startswith(IMMUTABLE_PREFIXES):
+        cache_control = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        cache_control = f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+    headers = {'ETag': etag,
+               'Last-Modified': http_date(last_modified),
+               'Cache-Control': cache_control,
+               'Accept-Ranges': 'bytes'}
+
+    # 304 Not Modified или 412 Precondition Failed
+    base = HttpResponse(headers=headers)
+    response = get_conditional_response(request, etag, last_modified, base)
+    if response is not base:
+        return response
+
+    if settings.MEDIA_SENDFILE:
+        response = _sendfile(full_path, name)
+    else:
+        response = _file_response(request, full_path, size, etag,
+                                  headers['Last-Modified'])
+    for header, value in headers.items():
+        response[header] = value
+    return response
@@ -0,0 +1,396 @@
+"""
+Общий клиент Redis проекта. Модули не создают собственных соединений,
+а используют объект r из этого модуля:
+
+    from bookmarks.redis_client import r, pipeline
+
+    r.incr('key')
+    with pipeline() as pipe:
+        pipe.incr('a')
+        pipe.expire('a', 60)
+    pipe.results   # ответы команд после выхода из блока
+
+Клиент и пул соединений создаются при первой команде, а не при импорте,
+и заново - в дочернем процессе после fork. Размер пула, тайм-ауты и число
+повторов при обрыве соединения задаются настройками REDIS_*. При
+REDIS_BACKEND = 'memory' вместо сервера используется хранилище в памяти
+процесса (bookmarks/redis_memory.py), например в тестах.
+
+Время выполнения команд и конвейеров, число ошибок, занятость пула и
+время ожидания свободного соединения накапливаются в metrics и
+возвращаются функцией stats(): по пиковому числу занятых соединений
+подбирается REDIS_MAX_CONNECTIONS для заданного числа потоков обработчика.
+Число и время команд текущего HTTP-запроса передаются в
+bookmarks/instrumentation.py.
+
+Асинхронные представления используют клиент redis.asyncio из объекта ar
+и конвейер async_pipeline() с тем же интерфейсом, но с await:
+
+    total = await ar.incr('key')
+    async with async_pipeline() as pipe:
+        pipe.incr('a')
+    pipe.results
+
+Асинхронные представления подключаются только под ASGI (см.
+bookmarks/async_views.py), где у рабочего процесса один долгоживущий цикл
+событий, поэтому и клиент ar с пулом соединений в процессе один. Под WSGI
+те же запросы обслуживают синхронные представления с клиентом r: там
+async_to_sync создает новый цикл на каждый вызов, и пул asyncio не
+переиспользовался бы. Если ar все же вызван из другого цикла (команда,
+тест), прежний клиент отбрасывается; владелец цикла закрывает пул
+методом ar.aclose(). Показатели пула asyncio накапливаются отдельно, в
+async_metrics: размер REDIS_MAX_CONNECTIONS подбирается по пику занятых
+соединений синхронного пула.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+import redis
+import redis.asyncio
+from redis.asyncio.client import Pipeline as AsyncPipeline
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.client import Pipeline
+from redis.retry import Retry
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from . import instrumentation
+from .redis_memory import AsyncMemoryRedis, MemoryRedis
+
+
+class ClientMetrics:
+    """
+    Показатели клиента в текущем процессе: число команд и конвейеров,
+    распределение времени их выполнения, ошибки и использование пула.
+    """
+    LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.commands = 0
+        self.pipelines = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency = {bucket: 0 for bucket in self.LATENCY_BUCKETS}
+        self.latency['+Inf'] = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+
+    def observe(self, commands, latency, pipeline=False):
+        with self.lock:
+            self.commands += commands
+            self.pipelines += pipeline
+            self.latency_sum += latency
+            self.latency_max = max(self.latency_max, latency)
+            for bucket in self.LATENCY_BUCKETS:
+                if latency <= bucket:
+                    self.latency[bucket] += 1
+                    break
+            else:
+                self.latency['+Inf'] += 1
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+
+    def checkout(self, wait):
+        with self.lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.wait_sum += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def checkin(self):
+        with self.lock:
+            self.in_use = max(self.in_use - 1, 0)
+
+    def as_dict(self):
+        with self.lock:
+            return {'commands': self.commands,
+                    'pipelines': self.pipelines,
+                    'errors': self.errors,
+                    'latency_sum': self.latency_sum,
+                    'latency_max': self.latency_max,
+                    'latency': {str(bucket): count for bucket, count
+                                in self.latency.items()},
+                    'pool': {'in_use': self.in_use,
+                             'peak_in_use': self.peak_in_use,
+                             'checkouts': self.checkouts,
+                             'wait_sum': self.wait_sum,
+                             'wait_max': self.wait_max}}
+
+
+metrics = ClientMetrics()
+# показатели пула и команд клиента redis.asyncio
+async_metrics = ClientMetrics()
+
+
+class InstrumentedPool(redis.BlockingConnectionPool):
+    """
+    Пул с ограниченным числом соединений: когда все заняты, поток ждет
+    освобождения до REDIS_POOL_TIMEOUT секунд, а не открывает новое.
+    """
+
+    def get_connection(self, *args, **kwargs):
+        started = time.perf_counter()
+        connection = super().get_connection(*args, **kwargs)
+        metrics.checkout(time.perf_counter() - started)
+        return connection
+
+    def release(self, connection):
+        super().release(connection)
+        metrics.checkin()
+
+
+class InstrumentedPipeline(Pipeline):
+
+    def execute(self, raise_on_error=True):
+        size = len(self.command_stack)
+        started = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        except redis.RedisError:
+            metrics.error()
+            raise
+        finally:
+            latency = time.perf_counter() - started
+            metrics.observe(size, latency, pipeline=True)
+            instrumentation.observe_redis(size, latency)
+
+
+class InstrumentedRedis(redis.Redis):
+
+    def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        except redis.RedisError:
+            metrics.error()
+            raise
+        finally:
+            latency = time.perf_counter() - started
+            metrics.observe(1, latency)
+            instrumentation.observe_redis(1, latency)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool,
+                                    self.response_callbacks,
+                                    transaction,
+                                    shard_hint)
+
+
+class InstrumentedAsyncPool(redis.asyncio.BlockingConnectionPool):
+
+    async def get_connection(self, *args, **kwargs):
+        started = time.perf_counter()
+        connection = await super().get_connection(*args, **kwargs)
+        async_metrics.checkout(time.perf_counter() - started)
+        return connection
+
+    async def release(self, connection):
+        await super().release(connection)
+        async_metrics.checkin()
+
+
+class InstrumentedAsyncPipeline(AsyncPipeline):
+
+    async def execute(self, raise_on_error=True):
+        size = len(self.command_stack)
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        except redis.RedisError:
+            async_metrics.error()
+            raise
+        finally:
+            latency = time.perf_counter() - started
+            async_metrics.observe(size, latency, pipeline=True)
+            instrumentation.observe_redis(size, latency)
+
+
+class InstrumentedAsyncRedis(redis.asyncio.Redis):
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        except redis.RedisError:
+            async_metrics.error()
+            raise
+        finally:
+            latency = time.perf_counter() - started
+            async_metrics.observe(1, latency)
+            instrumentation.observe_redis(1, latency)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedAsyncPipeline(self.connection_pool,
+                                         self.response_callbacks,
+                                         transaction,
+                                         shard_hint)
+
+
+def _pool_options():
+    return {'host': settings.REDIS_HOST,
+            'port': settings.REDIS_PORT,
+            'db': settings.REDIS_DB,
+            'max_connections': settings.REDIS_MAX_CONNECTIONS,
+            'timeout': settings.REDIS_POOL_TIMEOUT,
+            'socket_timeout': settings.REDIS_SOCKET_TIMEOUT,
+            'socket_connect_timeout': settings.REDIS_CONNECT_TIMEOUT,
+            'health_check_interval': settings.REDIS_HEALTH_CHECK_INTERVAL,
+            'retry_on_error': [redis.ConnectionError, redis.TimeoutError]}
+
+
+def create_client():
+    if settings.REDIS_BACKEND == 'memory':
+        return MemoryRedis()
+    retry = Retry(ExponentialBackoff(cap=1, base=0.05),
+                  settings.REDIS_RETRIES)
+    pool = InstrumentedPool(retry=retry, **_pool_options())
+    return InstrumentedRedis(connection_pool=pool)
+
+
+def create_async_client():
+    if settings.REDIS_BACKEND == 'memory':
+        # общее хранилище с синхронным клиентом r
+        return AsyncMemoryRedis(r.get_client())
+    retry = AsyncRetry(ExponentialBackoff(cap=1, base=0.05),
+                       settings.REDIS_RETRIES)
+    pool = InstrumentedAsyncPool(retry=retry, **_pool_options())
+    return InstrumentedAsyncRedis(connection_pool=pool)
+
+
+class LazyClient:
+    """
+    Заместитель клиента: настоящий клиент создается при первом обращении
+    к любому его методу и пересоздается, если процесс сменился после fork.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.client = None
+        self.pid = None
+
+    def get_client(self):
+        if self.client is None or self.pid != os.getpid():
+            with self.lock:
+                if self.client is None or self.pid != os.getpid():
+                    if self.client is not None:
+                        # показатели родительского процесса не наследуются
+                        metrics.reset()
+                    self.client = create_client()
+                    self.pid = os.getpid()
+        return self.client
+
+    def reset(self):
+        with self.lock:
+            self.client = None
+
+    def __getattr__(self, name):
+        return getattr(self.get_client(), name)
+
+
+r = LazyClient()
+
+
+class LazyAsyncClient:
+    """
+    Заместитель асинхронного клиента: один клиент на процесс, привязанный
+    к циклу событий, в котором выполнена первая команда. В другом цикле
+    создается новый клиент, а прежний отбрасывается.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.loop = None
+        self.pid = None
+
+    def get_client(self):
+        loop = asyncio.get_running_loop()
+        if self.client is None or self.loop is not loop or \
+                self.pid != os.getpid():
+            if self.client is not None and self.pid != os.getpid():
+                async_metrics.reset()
+            self.client = create_async_client()
+            self.loop = loop
+            self.pid = os.getpid()
+        return self.client
+
+    async def aclose(self):
+        # Закрыть соединения пула; вызывается до закрытия цикла событий
+        client, self.client = self.client, None
+        if isinstance(client, InstrumentedAsyncRedis):
+            await client.connection_pool.disconnect()
+
+    def reset(self):
+        self.client = None
+
+    def __getattr__(self, name):
+        return getattr(self.get_client(), name)
+
+
+ar = LazyAsyncClient()
+
+
+@receiver(setting_changed)
+def redis_setting_changed(sender, setting, **kwargs):
+    # override_settings(REDIS_...) в тестах подменяет и клиент
+    if setting.startswith('REDIS_'):
+        r.reset()
+        ar.reset()
+
+
+@contextmanager
+def pipeline(transaction=False):
+    """
+    Конвейер, который отправляется одним обменом при выходе из блока with;
+    ответы команд сохраняются в pipe.results. Если в блоке возникло
+    исключение, команды не отправляются. transaction=True оборачивает
+    команды в MULTI/EXEC.
+    """
+    pipe = r.pipeline(transaction=transaction)
+    try:
+        yield pipe
+        pipe.results = pipe.execute()
+    finally:
+        pipe.reset()
+
+
+@asynccontextmanager
+async def async_pipeline(transaction=False):
+    # Асинхронный вариант pipeline() для клиента ar
+    pipe = ar.pipeline(transaction=transaction)
+    try:
+        yield pipe
+        pipe.results = await pipe.execute()
+    finally:
+        await pipe.reset()
+
+
+def transaction(func, *watches, **kwargs):
+    """
+    Оптимистичная транзакция: func(pipe) читает ключи watches, затем
+    вызывает pipe.multi() и ставит команды в очередь. Если ключи изменились
+    до EXEC, func вызывается снова.
+    """
+    return r.transaction(func, *watches, **kwargs)
+
+
+def stats():
+    data = metrics.as_dict()
+    data['backend'] = settings.REDIS_BACKEND
+    data['max_connections'] = settings.REDIS_MAX_CONNECTIONS
+    data['async'] = async_metrics.as_dict()
+    return data
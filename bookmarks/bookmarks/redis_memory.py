@@ -0,0 +1,454 @@
+"""
+Хранилище Redis в памяти процесса для тестов и локальной разработки
+(REDIS_BACKEND = 'memory', см. bookmarks/redis_client.py). Реализованы
+только команды, которые используются в проекте, а ответы имеют тот же вид,
+что и у redis-py: значения и элементы множеств - bytes, баллы - float.
+Данные не разделяются между процессами.
+"""
+
+import fnmatch
+import threading
+import time
+
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, float):
+        return repr(value).encode()
+    return str(value).encode()
+
+
+def _bound(value):
+    # Граница диапазона баллов: число, '-inf'/'+inf' или '(число' - строгая
+    if isinstance(value, bytes):
+        value = value.decode()
+    if isinstance(value, str) and value.startswith('('):
+        return float(value[1:]), True
+    return float(value), False
+
+
+def _in_range(score, low, high):
+    (low, low_strict), (high, high_strict) = low, high
+    above = score > low if low_strict else score >= low
+    below = score < high if high_strict else score <= high
+    return above and below
+
+
+def _slice(items, start, end):
+    # Индексы как в Redis: конец включается, отрицательные - с конца
+    size = len(items)
+    if start < 0:
+        start = max(size + start, 0)
+    if end < 0:
+        end = size + end
+    if start > end:
+        return []
+    return items[start:end + 1]
+
+
+class MemoryPipeline:
+    """
+    Конвейер хранилища в памяти: команды копятся в command_stack и
+    выполняются под общей блокировкой, то есть атомарно, как MULTI/EXEC.
+    После watch() и до multi() команды выполняются сразу, как в redis-py.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.command_stack = []
+        self.immediate = False
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def command(*args, **kwargs):
+            if self.immediate:
+                return method(*args, **kwargs)
+            self.command_stack.append((method, args, kwargs))
+            return self
+        return command
+
+    def __len__(self):
+        return len(self.command_stack)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.reset()
+
+    def watch(self, *keys):
+        self.immediate = True
+
+    def multi(self):
+        self.immediate = False
+
+    def reset(self):
+        self.command_stack = []
+        self.immediate = False
+
+    def execute(self, raise_on_error=True):
+        results = []
+        with self.client.lock:
+            for method, args, kwargs in self.command_stack:
+                try:
+                    results.append(method(*args, **kwargs))
+                except Exception as error:
+                    if raise_on_error:
+                        self.reset()
+                        raise
+                    results.append(error)
+        self.reset()
+        return results
+
+
+class MemoryRedis:
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data = {}
+        self.expires = {}
+
+    def _alive(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _read(self, key, default=None):
+        key = _encode(key)
+        return self.data[key] if self._alive(key) else default
+
+    def _container(self, key, factory):
+        key = _encode(key)
+        if not self._alive(key):
+            self.data[key] = factory()
+        return self.data[key]
+
+    def _drop_empty(self, key):
+        key = _encode(key)
+        if key in self.data and not self.data[key]:
+            self.delete(key)
+
+    # общие команды
+
+    def ping(self):
+        return True
+
+    def flushdb(self):
+        with self.lock:
+            self.data.clear()
+            self.expires.clear()
+        return True
+
+    def delete(self, *keys):
+        with self.lock:
+            deleted = 0
+            for key in map(_encode, keys):
+                if self._alive(key):
+                    deleted += 1
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return deleted
+
+    def exists(self, *keys):
+        with self.lock:
+            return sum(1 for key in keys if self._alive(_encode(key)))
+
+    def expire(self, key, seconds):
+        with self.lock:
+            key = _encode(key)
+            if not self._alive(key):
+                return False
+            self.expires[key] = time.monotonic() + int(seconds)
+            return True
+
+    def ttl(self, key):
+        with self.lock:
+            key = _encode(key)
+            if not self._alive(key):
+                return -2
+            if key not in self.expires:
+                return -1
+            return max(int(round(self.expires[key] - time.monotonic())), 0)
+
+    def keys(self, pattern='*'):
+        with self.lock:
+            pattern = _encode(pattern).decode()
+            return [key for key in list(self.data)
+                    if self._alive(key)
+                    and fnmatch.fnmatchcase(key.decode(), pattern)]
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return MemoryPipeline(self)
+
+    def transaction(self, func, *watches, value_from_callable=False,
+                    **kwargs):
+        with self.lock:
+            pipe = self.pipeline()
+            pipe.watch(*watches)
+            value = func(pipe)
+            results = pipe.execute()
+        return value if value_from_callable else results
+
+    # строки
+
+    def get(self, key):
+        with self.lock:
+            return self._read(key)
+
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False):
+        with self.lock:
+            key = _encode(key)
+            alive = self._alive(key)
+            if (nx and alive) or (xx and not alive):
+                return None
+            self.data[key] = _encode(value)
+            self.expires.pop(key, None)
+            if ex is not None:
+                self.expires[key] = time.monotonic() + int(ex)
+            elif px is not None:
+                self.expires[key] = time.monotonic() + int(px) / 1000
+            return True
+
+    def incrby(self, key, amount=1):
+        with self.lock:
+            value = int(self._read(key, b'0')) + int(amount)
+            key = _encode(key)
+            self.data[key] = _encode(value)
+            return value
+
+    def incr(self, key, amount=1):
+        return self.incrby(key, amount)
+
+    def decr(self, key, amount=1):
+        return self.incrby(key, -amount)
+
+    # хеши
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self.lock:
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            hash_ = self._container(name, dict)
+            added = 0
+            for field, field_value in items.items():
+                field = _encode(field)
+                added += field not in hash_
+                hash_[field] = _encode(field_value)
+            return added
+
+    def hget(self, name, key):
+        with self.lock:
+            return self._read(name, {}).get(_encode(key))
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self._read(name, {}))
+
+    def hincrby(self, name, key, amount=1):
+        with self.lock:
+            hash_ = self._container(name, dict)
+            value = int(hash_.get(_encode(key), b'0')) + int(amount)
+            hash_[_encode(key)] = _encode(value)
+            return value
+
+    def hdel(self, name, *keys):
+        with self.lock:
+            hash_ = self._read(name, {})
+            deleted = sum(1 for key in keys
+                          if hash_.pop(_encode(key), None) is not None)
+            self._drop_empty(name)
+            return deleted
+
+    # множества
+
+    def sadd(self, name, *values):
+        with self.lock:
+            members = self._container(name, set)
+            before = len(members)
+            members.update(map(_encode, values))
+            return len(members) - before
+
+    def srem(self, name, *values):
+        with self.lock:
+            members = self._read(name, set())
+            before = len(members)
+            members.difference_update(map(_encode, values))
+            removed = before - len(members)
+            self._drop_empty(name)
+            return removed
+
+    def smembers(self, name):
+        with self.lock:
+            return set(self._read(name, set()))
+
+    def sismember(self, name, value):
+        with self.lock:
+            return _encode(value) in self._read(name, set())
+
+    def scard(self, name):
+        with self.lock:
+            return len(self._read(name, set()))
+
+    # сортированные множества
+
+    def _sorted(self, name, desc=False):
+        items = sorted(self._read(name, {}).items(),
+                       key=lambda item: (item[1], item[0]))
+        return items[::-1] if desc else items
+
+    def zadd(self, name, mapping, nx=False, xx=False):
+        with self.lock:
+            scores = self._container(name, dict)
+            added = 0
+            for member, score in mapping.items():
+                member = _encode(member)
+                exists = member in scores
+                if (nx and exists) or (xx and not exists):
+                    continue
+                added += not exists
+                scores[member] = float(score)
+            self._drop_empty(name)
+            return added
+
+    def zincrby(self, name, amount, value):
+        with self.lock:
+            scores = self._container(name, dict)
+            member = _encode(value)
+            scores[member] = scores.get(member, 0.0) + float(amount)
+            return scores[member]
+
+    def zrem(self, name, *values):
+        with self.lock:
+            scores = self._read(name, {})
+            removed = sum(1 for value in values
+                          if scores.pop(_encode(value), None) is not None)
+            self._drop_empty(name)
+            return removed
+
+    def zscore(self, name, value):
+        with self.lock:
+            return self._read(name, {}).get(_encode(value))
+
+    def zcard(self, name):
+        with self.lock:
+            return len(self._read(name, {}))
+
+    def zcount(self, name, min, max):
+        with self.lock:
+            low, high = _bound(min), _bound(max)
+            return sum(1 for score in self._read(name, {}).values()
+                       if _in_range(score, low, high))
+
+    def zrange(self, name, start, end, desc=False, withscores=False,
+               score_cast_func=float):
+        with self.lock:
+            items = _slice(self._sorted(name, desc), start, end)
+            if withscores:
+                return [(member, score_cast_func(score))
+                        for member, score in items]
+            return [member for member, score in items]
+
+    def zrevrange(self, name, start, end, withscores=False,
+                  score_cast_func=float):
+        return self.zrange(name, start, end, desc=True,
+                           withscores=withscores,
+                           score_cast_func=score_cast_func)
+
+    def zrangebyscore(self, name, min, max, withscores=False):
+        with self.lock:
+            low, high = _bound(min), _bound(max)
+            items = [(member, score) for member, score in self._sorted(name)
+                     if _in_range(score, low, high)]
+            if withscores:
+                return items
+            return [member for member, score in items]
+
+    def zremrangebyrank(self, name, min, max):
+        with self.lock:
+            items = _slice(self._sorted(name), min, max)
+            scores = self._read(name, {})
+            for member, score in items:
+                del scores[member]
+            self._drop_empty(name)
+            return len(items)
+
+    def zremrangebyscore(self, name, min, max):
+        with self.lock:
+            members = self.zrangebyscore(name, min, max)
+            return self.zrem(name, *members) if members else 0
+
+    def zunionstore(self, dest, keys, aggregate=None):
+        with self.lock:
+            weights = keys if isinstance(keys, dict) \
+                else {key: 1 for key in keys}
+            combine = {None: sum, 'SUM': sum,
+                       'MIN': min, 'MAX': max}[aggregate and aggregate.upper()]
+            collected = {}
+            for key, weight in weights.items():
+                for member, score in self._read(key, {}).items():
+                    collected.setdefault(member, []).append(score * weight)
+            self.delete(dest)
+            if collected:
+                self.data[_encode(dest)] = {
+                    member: float(combine(scores))
+                    for member, scores in collected.items()}
+            return len(collected)
+
+
+class AsyncMemoryPipeline:
+    """
+    Асинхронный интерфейс конвейера хранилища в памяти, как у
+    redis.asyncio: команды ставятся в очередь обычными вызовами,
+    execute() - сопрограмма.
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def __getattr__(self, name):
+        command = getattr(self.pipeline, name)
+
+        def queue(*args, **kwargs):
+            command(*args, **kwargs)
+            return self
+        return queue
+
+    def __len__(self):
+        return len(self.pipeline)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.reset()
+
+    async def execute(self, raise_on_error=True):
+        return self.pipeline.execute(raise_on_error)
+
+    async def reset(self):
+        self.pipeline.reset()
+
+
+class AsyncMemoryRedis:
+    """
+    Асинхронный интерфейс хранилища в памяти (команды - сопрограммы), как
+    у redis.asyncio.Redis. Данные общие с синхронным клиентом client.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        async def command(*args, **kwargs):
+            return method(*args, **kwargs)
+        return command
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return AsyncMemoryPipeline(self.client.pipeline(transaction))
@@ -0,0 +1,131 @@
+"""
+Распределение запросов к базе данных между основной базой и репликами.
+
+Все записи и чтения вне запросов (команды, обработчики очередей) идут
+в основную базу 'default'. Чтения направляются на реплику только
+в запросах GET и HEAD к представлениям из DATABASE_REPLICA_VIEWS
+(списки, страницы изображений, рейтинг, лента): промежуточный слой
+ReplicaRoutingMiddleware выбирает для такого запроса одну из реплик
+DATABASE_REPLICAS и сохраняет ее в объекте ReadState запроса, откуда
+ее берет маршрутизатор PrimaryReplicaRouter. Внутри транзакции основной
+базы и после первой записи в запросе чтения тоже идут в основную базу:
+реплика не видит ни незафиксированных, ни только что сделанных изменений.
+
+Объект ReadState создается на запрос и хранится в переменной контекста
+read_state, а выбор реплики и отметка о записи изменяют его на месте.
+Под ASGI синхронный код (process_view, обращения к ORM из асинхронных
+представлений) выполняется sync_to_async в копии контекста, а задачи
+asyncio получают собственные копии. Новое значение переменной, заданное
+в такой копии, не всегда возвращается в контекст запроса, а изменения
+общего объекта видны во всех копиях.
+
+Реплика отстает от основной базы, поэтому после изменяющего запроса
+(POST и т. п.) клиент получает cookie DATABASE_REPLICA_PIN_COOKIE на
+DATABASE_REPLICA_PIN_SECONDS секунд, и, пока она есть, все его запросы
+читают основную базу: пользователь сразу видит свой лайк или подписку.
+"""
+
+import asyncio
+import contextvars
+import random
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from .instrumentation import markcoroutinefunction
+
+SAFE_METHODS = ('GET', 'HEAD')
+# Сессии только что вошедшего пользователя еще нет на реплике
+PRIMARY_APPS = ('sessions',)
+
+
+class ReadState:
+    # База данных для чтений текущего запроса; None - основная база
+    __slots__ = ('alias',)
+
+    def __init__(self):
+        self.alias = None
+
+
+read_state = contextvars.ContextVar('database_read_state', default=None)
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS:
+            return DEFAULT_DB_ALIAS
+        state = read_state.get()
+        if state is None or state.alias is None or \
+                connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        # После записи запрос до конца читает основную базу
+        state = read_state.get()
+        if state is not None:
+            state.alias = None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплик копируется вместе с данными (см. sync_replicas)
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Выбирает базу данных для чтения в запросе и закрепляет клиента за
+    основной базой после изменяющих запросов.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = read_state.set(ReadState())
+        try:
+            response = self.get_response(request)
+        finally:
+            read_state.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = read_state.set(ReadState())
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_state.reset(token)
+        return self.pin(request, response)
+
+    @staticmethod
+    def pin(request, response):
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(settings.DATABASE_REPLICA_PIN_COOKIE, '1',
+                                max_age=settings.DATABASE_REPLICA_PIN_SECONDS,
+                                httponly=True,
+                                samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if settings.DATABASE_REPLICAS and \
+                request.method in SAFE_METHODS and \
+                settings.DATABASE_REPLICA_PIN_COOKIE not in request.COOKIES \
+                and request.resolver_match and \
+                request.resolver_match.view_name in \
+                settings.DATABASE_REPLICA_VIEWS:
+            read_state.get().alias = random.choice(
+                settings.DATABASE_REPLICAS)
@@ -45,11 +45,15 @@ INSTALLED_APPS = [
     'images.apps.ImagesConfig',
     'easy_thumbnails',
     'actions.apps.ActionsConfig',
+    'benchmark.apps.BenchmarkConfig',
     'debug_toolbar',
 ]
 
 MIDDLEWARE = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'bookmarks.instrumentation.InstrumentationMiddleware',
+    'bookmarks.routers.ReplicaRoutingMiddleware',
+    'bookmarks.async_views.AsyncViewsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,6 +64,10 @@ MIDDLEWARE = [
 ]
 
 ROOT_URLCONF = 'bookmarks.urls'
+# Конфигурация URL запросов, обслуживаемых ASGI: горячие представления
+# (страница изображения, просмотры, лайк, подписка) в ней асинхронные.
+# Под WSGI используется ROOT_URLCONF с синхронными вариантами
+ASYNC_ROOT_URLCONF = 'bookmarks.urls_async'
 
 TEMPLATES = [
     {
@@ -82,13 +90,62 @@ WSGI_APPLICATION = 'bookmarks.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# Драйвер bookmarks.sqlite выполняет для каждого соединения команды
+# PRAGMAS (см. bookmarks/sqlite/base.py): журнал WAL, чтобы лайки и
+# подписки не блокировали чтение, и ожидание блокировки вместо ошибки.
+# Соединения сохраняются между запросами CONN_MAX_AGE секунд
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'bookmarks.sqlite',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'PRAGMAS': SQLITE_PRAGMAS,
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Реплики только для чтения: имена файлов через запятую в переменной
+# окружения DATABASE_REPLICAS. Локальные файлы заменяют настоящие
+# реплики; их содержимое копирует из основной базы команда
+# sync_replicas. Чтения представлений DATABASE_REPLICA_VIEWS идут на
+# реплики, после изменяющего запроса клиент читает основную базу
+# DATABASE_REPLICA_PIN_SECONDS секунд (см. bookmarks/routers.py)
+DATABASE_REPLICAS = []
+for number, name in enumerate(
+        filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), 1):
+    alias = f'replica{number}'
+    DATABASES[alias] = {
+        'ENGINE': 'bookmarks.sqlite',
+        'NAME': BASE_DIR / name.strip(),
+        'PRAGMAS': SQLITE_PRAGMAS,
+        'TRANSACTION_MODE': 'DEFERRED',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['bookmarks.routers.PrimaryReplicaRouter']
+DATABASE_REPLICA_VIEWS = [
+    'dashboard',
+    'user_list',
+    'user_detail',
+    'images:list',
+    'images:detail',
+    'images:likers',
+    'images:ranking',
+    # images:search читает основную базу: индекс FTS5 (images/search.py)
+    # ведется и опрашивается только в ней, и изображения по найденным id,
+    # прочитанные с отстающей реплики, терялись бы из результатов
+]
+DATABASE_REPLICA_PIN_COOKIE = 'db_pin'
+DATABASE_REPLICA_PIN_SECONDS = 10
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -153,12 +210,26 @@ MEDIA_URL = 'media/'
 # URL-адреса медиафайлов в качестве префикса с целью переносимости.
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Медиафайлы раздаются представлением bookmarks.media.serve_media.
+# MEDIA_SENDFILE = 'x-accel-redirect' (nginx) или 'x-sendfile' (Apache,
+# lighttpd) передает отправку файла фронтенд-серверу; для nginx
+# MEDIA_ACCEL_PREFIX - внутренний (internal) location, указывающий на
+# MEDIA_ROOT. Пустое значение - файл отправляет само приложение.
+# MEDIA_SERVE = False отключает маршрут, если /media/ целиком раздает
+# фронтенд-сервер
+MEDIA_SERVE = True
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Время кеширования файлов, которые могут измениться (фото профилей)
+MEDIA_CACHE_MAX_AGE = 60 * 60
+
 # В данном настроечном параметре мы оставляем стандартный ModelBackend,
 # который используется для аутентификации с помощью пользовательского имени
 # и пароля, и вставляем наш собственный бэкенд аутентификации
-# с применением электронной почты EmailAuthBackend
+# с применением электронной почты EmailAuthBackend. ModelBackend заменен
+# подклассом CachedModelBackend с кешем пользователей EmailAuthBackend
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',
+    'account.authentication.CachedModelBackend',
     'account.authentication.EmailAuthBackend',
     'social_core.backends.google.GoogleOAuth2',
 ]
@@ -195,6 +266,152 @@ INTERNAL_IPS = [
     '127.0.0.1',
 ]
 
-REDIS_HOST = os.environ.get('REDIS_HOST')
-REDIS_PORT = os.environ.get('REDIS_PORT')
-REDIS_DB = os.environ.get('REDIS_DB')
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
+REDIS_DB = int(os.environ.get('REDIS_DB', 0))
+
+# Общий клиент Redis (см. bookmarks/redis_client.py). REDIS_BACKEND = 'memory'
+# заменяет сервер хранилищем в памяти процесса для тестов.
+# Пул одного процесса ограничен REDIS_MAX_CONNECTIONS соединениями; если все
+# заняты, поток ждет до REDIS_POOL_TIMEOUT секунд. Команда, прерванная
+# обрывом соединения или тайм-аутом, повторяется до REDIS_RETRIES раз
+REDIS_BACKEND = os.environ.get('REDIS_BACKEND', 'redis')
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 20))
+REDIS_POOL_TIMEOUT = 5
+REDIS_SOCKET_TIMEOUT = 2
+REDIS_CONNECT_TIMEOUT = 2
+REDIS_RETRIES = 3
+REDIS_HEALTH_CHECK_INTERVAL = 30
+
+# Общий для всех процессов кеш в Redis: кешированные страницы и номера
+# версий для их инвалидации должны быть видны всем рабочим процессам
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}',
+    }
+}
+
+# Время жизни (в секундах) кеша пользователей в get_user() бэкендов
+# аутентификации (см. account/authentication.py); запись удаляется и
+# раньше, при сохранении и удалении пользователя или профиля
+AUTH_USER_CACHE_TIMEOUT = 60
+
+# Число записей файла импорта закладок, вставляемых одной пачкой
+# (см. images/bulk_import.py)
+IMPORT_BATCH_SIZE = 500
+
+# Реализация полнотекстового поиска по изображениям (см. images/search.py):
+# индекс SQLite FTS5 или images.search.SimpleBackend для других СУБД
+SEARCH_BACKEND = 'images.search.SQLiteFTSBackend'
+
+# Лента активности: максимальная длина ленты пользователя в Redis,
+# число действий на странице панели управления и порог подписчиков,
+# после которого действия пользователя не рассылаются по лентам,
+# а подмешиваются при чтении. Отметка о построении ленты живет
+# FEED_BUILT_TIMEOUT секунд: пока она есть, пустая лента не
+# перестраивается при каждом открытии панели управления
+FEED_TIMELINE_SIZE = 500
+FEED_PAGE_SIZE = 10
+FEED_FANOUT_MAX_FOLLOWERS = 5000
+FEED_BUILT_TIMEOUT = 60 * 60 * 24
+
+# Фоновое скачивание изображений: число потоков-обработчиков, лимит
+# одновременных скачиваний с одного сайта, число попыток, базовая задержка
+# между попытками (с), время, после которого задание зависшего обработчика
+# возвращается в очередь (с), общий срок скачивания одного файла (с),
+# наибольшее ожидание данных сокета (с), максимальный размер файла и размер
+# части при потоковом скачивании (байт), наибольшее число перенаправлений
+# и число сайтов, для которых держатся сеансы с keep-alive соединениями
+INGEST_WORKERS = 4
+INGEST_PER_HOST_LIMIT = 2
+INGEST_MAX_ATTEMPTS = 5
+INGEST_RETRY_DELAY = 30
+INGEST_LOCK_TIMEOUT = 300
+INGEST_DOWNLOAD_TIMEOUT = 10
+INGEST_READ_TIMEOUT = 2
+INGEST_MAX_BYTES = 10 * 1024 * 1024
+INGEST_CHUNK_SIZE = 64 * 1024
+INGEST_MAX_REDIRECTS = 5
+INGEST_MAX_SESSIONS = 64
+
+# Именованные размеры миниатюр для каждого поля-источника. Миниатюры всех
+# алиасов создаются заранее при сохранении файла (images/thumbnails.py),
+# а шаблоны получают их URL-адреса фильтром alias_url
+THUMBNAIL_ALIASES = {
+    'images.Image.image': {
+        'list': {'size': (300, 300), 'crop': 'smart'},
+        'feed': {'size': (80, 80), 'crop': '100%'},
+        'detail': {'size': (300, 0)},
+    },
+    'account.Profile.photo': {
+        'feed': {'size': (80, 80), 'crop': '100%'},
+        'people': {'size': (180, 180)},
+    },
+}
+# PNG-миниатюры сохраняются в PNG, поэтому имя миниатюры можно вычислить,
+# не открывая исходный файл
+THUMBNAIL_PRESERVE_EXTENSIONS = ('png',)
+# Число процессов для генерации миниатюр командой generate_thumbnails;
+# новые файлы обрабатываются обработчиками очереди скачивания
+THUMBNAIL_PROCESSES = 2
+
+# Счетчик просмотров изображений: 'exact' - каждый просмотр записывается
+# в Redis одним конвейером; 'batched' - просмотры накапливаются в процессе
+# и сбрасываются пачками по VIEW_COUNTER_BATCH_SIZE просмотров или раз в
+# VIEW_COUNTER_FLUSH_INTERVAL секунд. При сбое процесса в пакетном режиме
+# теряется не более VIEW_COUNTER_BATCH_SIZE - 1 просмотров; пока Redis
+# недоступен, процесс хранит не более VIEW_COUNTER_MAX_PENDING просмотров,
+# а остальные отбрасывает (см. images/counters.py)
+VIEW_COUNTER_MODE = 'exact'
+VIEW_COUNTER_BATCH_SIZE = 100
+VIEW_COUNTER_FLUSH_INTERVAL = 5
+VIEW_COUNTER_MAX_PENDING = 1000
+
+# Рейтинги изображений: число последних часов, учитываемых в trending,
+# период полураспада веса просмотров и лайков (ч) и вес одного лайка
+# относительно одного просмотра
+RANKING_TRENDING_HOURS = 72
+RANKING_HALF_LIFE_HOURS = 24
+RANKING_LIKE_WEIGHT = 10
+
+# Инструментирование запросов (см. bookmarks/instrumentation.py):
+# токен, с которым сборщик Prometheus читает /metrics/ (заголовок
+# Authorization: Bearer <токен>; без токена показатели доступны только
+# сотрудникам), и наибольшее число запросов к базе данных для
+# представлений (по view_name). QUERY_BUDGET_ACTION = 'log' пишет
+# предупреждение при превышении, 'raise' - вызывает исключение
+# QueryBudgetExceeded
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+QUERY_BUDGETS = {
+    'dashboard': 15,
+    'user_detail': 15,
+    'user_list': 10,
+    'images:list': 10,
+    'images:detail': 10,
+}
+QUERY_BUDGET_ACTION = 'log'
+
+# Журнал bookmarks.requests: предупреждения о превышении QUERY_BUDGETS.
+# Журнал bookmarks.access - по одной строке JSON с показателями на каждый
+# запрос; по умолчанию выключен, включается переменной окружения
+# REQUEST_LOG=1
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'bookmarks.requests': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'bookmarks.access': {
+            'handlers': ['console'],
+            'level': 'INFO' if os.environ.get('REQUEST_LOG') else 'WARNING',
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,34 @@
+"""
+Драйвер SQLite с настройками для одновременной работы нескольких
+процессов (ENGINE = 'bookmarks.sqlite').
+
+Для каждого нового соединения выполняются команды PRAGMA из ключа PRAGMAS
+описания базы данных в DATABASES, например:
+  • journal_mode = wal - журнал упреждающей записи: читатели не
+    блокируются пишущей транзакцией, а она - читателями;
+  • synchronous = normal - в режиме WAL данные не теряются при сбое
+    процесса, а fsync выполняется только при контрольных точках;
+  • busy_timeout - сколько миллисекунд ждать освобождения блокировки
+    вместо немедленной ошибки "database is locked".
+
+Транзакции atomic() начинаются командой BEGIN <TRANSACTION_MODE>
+(по умолчанию IMMEDIATE): блокировка записи берется сразу, и две
+транзакции, прочитавшие данные, не пытаются одновременно перейти к
+записи - такой конфликт SQLite не разрешает ожиданием busy_timeout,
+а сразу завершает одну из них с ошибкой.
+"""
+
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict.get('PRAGMAS', {}).items():
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict.get('TRANSACTION_MODE', 'IMMEDIATE')
+        self.cursor().execute(f'BEGIN {mode}' if mode else 'BEGIN')
@@ -0,0 +1,151 @@
+"""
+Общие средства тестов числа запросов (account/tests.py, images/tests.py).
+
+QueryCountTestCase.assertConstantQueries() выполняет запрос к
+представлению на данных нескольких размеров (перед каждым измерением
+вызывается grow(), которая добавляет данные) и проверяет, что набор
+SQL-запросов не меняется. Значения в запросах заменяются на '?', а
+списки значений IN (...) и VALUES (...) - на '(...)', а имена точек
+сохранения SAVEPOINT - на '?', поэтому сравнивается
+форма запросов, а не параметры. При расхождении тест падает с
+unified diff запросов, по которому видно, какой запрос повторяется
+для каждой строки (N+1).
+
+Перед каждым измерением кеш Django и хранилище Redis очищаются, чтобы
+измерения не зависели от того, что закешировало предыдущее. Тесты
+используют хранилище Redis в памяти процесса и LocMemCache.
+"""
+
+import difflib
+import random
+import re
+from contextlib import ExitStack
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.text import slugify
+from account.models import Contact, Profile
+from benchmark import seed
+from images.likes import reconcile
+from images.models import Image
+from .redis_client import r
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SAVEPOINTS = re.compile(r'SAVEPOINT "[^"]+"')
+VALUE_LISTS = re.compile(r'\((?:\?, )*\?\)(?:, \((?:\?, )*\?\))*')
+# Размеры данных: сколько пользователей, изображений и подписок
+# добавляется к данным субъекта перед каждым измерением. Первое
+# измерение выполняется на непустых данных, чтобы ветви для пустых
+# списков не отличались от остальных
+GROWTH = (2, 10, 30)
+
+TEST_SETTINGS = {
+    'REDIS_BACKEND': 'memory',
+    'CACHES': {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    },
+    'PASSWORD_HASHERS': ['django.contrib.auth.hashers.MD5PasswordHasher'],
+    'QUERY_BUDGET_ACTION': 'log',
+}
+
+
+def normalize(sql):
+    sql = SAVEPOINTS.sub('SAVEPOINT ?', sql)
+    return VALUE_LISTS.sub('(...)', LITERALS.sub('?', sql))
+
+
+def grow(subject, count, random_seed=0):
+    """
+    Добавить count пользователей, связанных с subject: они подписаны на
+    subject и он на них, у каждого и у subject по изображению на
+    нового пользователя, каждый лайкает изображения subject, а
+    их действия попадают в ленту subject.
+    """
+    rng = random.Random(random_seed)
+    user_ids = seed.create_users(rng, count)
+    follows = [(subject.id, user_id) for user_id in user_ids] + \
+        [(user_id, subject.id) for user_id in user_ids]
+    Contact.objects.bulk_create([Contact(user_form_id=user_from,
+                                         user_to_id=user_to)
+                                 for user_from, user_to in follows])
+    owners = user_ids + [subject.id] * count
+    last_id = Image.objects.order_by('-id').values_list('id', flat=True)\
+        .first() or 0
+    Image.objects.bulk_create([
+        Image(user_id=user_id,
+              title=f'Image {last_id + n}',
+              slug=slugify(f'Image {last_id + n}'),
+              url=f'https://example.com/{last_id + n}.png',
+              image=seed.PLACEHOLDER,
+              status=Image.Status.READY)
+        for n, user_id in enumerate(owners)])
+    images = list(Image.objects.filter(id__gt=last_id)
+                  .values_list('id', 'user_id'))
+    subject_images = [image_id for image_id, user_id in images
+                      if user_id == subject.id]
+    likes = [(image_id, user_id) for image_id in subject_images
+             for user_id in user_ids]
+    through = Image.users_like.through
+    through.objects.bulk_create([through(image_id=image_id, user_id=user_id)
+                                 for image_id, user_id in likes])
+    reconcile()
+    seed.create_actions(follows, images, likes)
+    return user_ids
+
+
+@override_settings(**TEST_SETTINGS)
+class QueryCountTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.reset_stores()
+
+    def reset_stores(self):
+        cache.clear()
+        r.flushdb()
+
+    def capture(self, func):
+        # Запросы ко всем базам данных, выполненные func()
+        self.reset_stores()
+        with ExitStack() as stack:
+            contexts = [stack.enter_context(CaptureQueriesContext(
+                connections[alias])) for alias in connections]
+            # обработчики on_commit (рассылка действий в ленты и т.п.)
+            # выполняются при выходе из этого контекста, до завершения
+            # подсчета запросов
+            stack.enter_context(self.captureOnCommitCallbacks(execute=True))
+            func()
+        return [normalize(query['sql']) for context in contexts
+                for query in context.captured_queries]
+
+    def assertConstantQueries(self, func, subject, growth=GROWTH):
+        """
+        Проверить, что func() выполняет одни и те же запросы при любом
+        объеме данных subject (см. grow()).
+        """
+        grow(subject, growth[0])
+        baseline = self.capture(func)
+        for step, count in enumerate(growth[1:], 1):
+            grow(subject, count, random_seed=step)
+            queries = self.capture(func)
+            if queries != baseline:
+                diff = '\n'.join(difflib.unified_diff(
+                    baseline, queries,
+                    fromfile=f'{len(baseline)} queries',
+                    tofile=f'{len(queries)} queries after adding '
+                           f'{sum(growth[1:step + 1])} related users',
+                    lineterm=''))
+                self.fail(f'query count depends on data size:\n{diff}')
+        return len(baseline)
+
+    def create_user(self, username, **kwargs):
+        user = User.objects.create_user(username, password='password',
+                                        first_name=username.title(),
+                                        **kwargs)
+        # Профиль создается представлением register
+        Profile.objects.create(user=user)
+        return user
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import os
+import tempfile
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import PermissionDenied
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.utils import ConnectionHandler
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import resolve
+from images.models import Image
+from . import media, views
+from .routers import PrimaryReplicaRouter, ReplicaRoutingMiddleware
+from .settings import SQLITE_PRAGMAS
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'],
+                   DATABASE_REPLICA_VIEWS=['images:list'])
+class ReplicaRoutingTest(SimpleTestCase):
+    # Тест не оборачивается в транзакцию, чтобы проверить чтения вне
+    # и внутри atomic(); запросы к реплике не выполняются, проверяется
+    # только выбор базы маршрутизатором
+    databases = {DEFAULT_DB_ALIAS}
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def route(self, method, path, view=None, cookies=None):
+        # Выполнить запрос через ReplicaRoutingMiddleware; view вызывается
+        # вместо представления и возвращает базу, выбранную для чтения
+        request = getattr(RequestFactory(), method)(path)
+        request.COOKIES.update(cookies or {})
+        request.resolver_match = resolve(path)
+
+        def get_response(request):
+            middleware.process_view(request, None, (), {})
+            return HttpResponse((view or self.read)())
+        middleware = ReplicaRoutingMiddleware(get_response)
+        response = middleware(request)
+        return response.content.decode(), response
+
+    def read(self):
+        return self.router.db_for_read(Image)
+
+    def test_read_only_view_reads_replica(self):
+        alias, response = self.route('get', '/images/')
+        self.assertEqual(alias, 'replica1')
+        self.assertNotIn('db_pin', response.cookies)
+        # вне запроса чтения идут в основную базу
+        self.assertEqual(self.read(), DEFAULT_DB_ALIAS)
+
+    def test_other_views_read_primary(self):
+        self.assertEqual(self.route('get', '/account/edit/')[0],
+                         DEFAULT_DB_ALIAS)
+
+    def test_writes_go_to_primary_and_pin_client(self):
+        alias, response = self.route('post', '/images/')
+        self.assertEqual(alias, DEFAULT_DB_ALIAS)
+        self.assertIn('db_pin', response.cookies)
+        self.assertEqual(self.router.db_for_write(Image), DEFAULT_DB_ALIAS)
+        # закрепленный клиент читает основную базу и в запросах GET
+        alias, response = self.route('get', '/images/',
+                                     cookies={'db_pin': '1'})
+        self.assertEqual(alias, DEFAULT_DB_ALIAS)
+
+    def test_read_in_transaction_goes_to_primary(self):
+        def view():
+            with transaction.atomic():
+                return self.read()
+        self.assertEqual(self.route('get', '/images/', view)[0],
+                         DEFAULT_DB_ALIAS)
+
+    def test_read_after_write_goes_to_primary(self):
+        def view():
+            before = self.read()
+            self.router.db_for_write(Image)
+            return f'{before} {self.read()}'
+        self.assertEqual(self.route('get', '/images/', view)[0],
+                         f'replica1 {DEFAULT_DB_ALIAS}')
+
+    async def test_state_shared_with_copied_contexts(self):
+        # Под ASGI синхронный код выполняется sync_to_async в копии
+        # контекста, а задачи asyncio (в т.ч. asyncio.gather) получают
+        # свою копию, изменения в которой не возвращаются в запрос
+        request = RequestFactory().get('/images/')
+        request.resolver_match = resolve('/images/')
+
+        def in_task(func, *args):
+            return asyncio.create_task(sync_to_async(func)(*args))
+
+        async def get_response(request):
+            await in_task(middleware.process_view, request, None, (), {})
+            before = await sync_to_async(self.read)()
+            await in_task(self.router.db_for_write, Image)
+            after = await sync_to_async(self.read)()
+            return HttpResponse(f'{before} {after}')
+        middleware = ReplicaRoutingMiddleware(get_response)
+        response = await middleware(request)
+        self.assertEqual(response.content.decode(),
+                         f'replica1 {DEFAULT_DB_ALIAS}')
+
+
+class SQLiteBackendTest(SimpleTestCase):
+    # Соединение открывается с псевдонимом default, но к тестовой базе
+    # данных не относится
+    databases = {DEFAULT_DB_ALIAS}
+
+    def test_pragmas_set_on_connect(self):
+        # Отдельный набор соединений с базой данных во временном файле
+        directory = tempfile.mkdtemp()
+        connections = ConnectionHandler({
+            DEFAULT_DB_ALIAS: {'ENGINE': 'bookmarks.sqlite',
+                               'NAME': os.path.join(directory, 'db.sqlite3'),
+                               'PRAGMAS': SQLITE_PRAGMAS},
+        })
+        connection = connections[DEFAULT_DB_ALIAS]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], 'wal')
+                cursor.execute('PRAGMA synchronous')
+                # 1 - NORMAL
+                self.assertEqual(cursor.fetchone()[0], 1)
+                cursor.execute('PRAGMA busy_timeout')
+                self.assertEqual(cursor.fetchone()[0],
+                                 SQLITE_PRAGMAS['busy_timeout'])
+        finally:
+            connection.close()
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsAccessTest(SimpleTestCase):
+
+    def get(self, user=None, **headers):
+        request = RequestFactory().get('/metrics/', REMOTE_ADDR='127.0.0.1',
+                                       **headers)
+        request.user = user or AnonymousUser()
+        return views.metrics(request)
+
+    def test_token_or_staff_required(self):
+        # адрес клиента не дает доступа: за прокси он один для всех
+        with self.assertRaises(PermissionDenied):
+            self.get()
+        with self.assertRaises(PermissionDenied):
+            self.get(HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer secret')
+                         .status_code, 200)
+        self.assertEqual(self.get(User(is_staff=True)).status_code, 200)
+        with override_settings(METRICS_TOKEN=None):
+            with self.assertRaises(PermissionDenied):
+                self.get(HTTP_AUTHORIZATION='Bearer ')
+
+    def test_request_log_off_by_default(self):
+        self.assertFalse(logging.getLogger('bookmarks.access')
+                         .isEnabledFor(logging.INFO))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), MEDIA_SENDFILE=False)
+class MediaRangeTest(SimpleTestCase):
+
+    def setUp(self):
+        with open(os.path.join(settings.MEDIA_ROOT, 'file.bin'), 'wb') as f:
+            f.write(bytes(range(100)))
+
+    def serve(self, method, **headers):
+        request = getattr(RequestFactory(), method)('/media/file.bin',
+                                                    **headers)
+        return media.serve_media(request, 'file.bin')
+
+    def test_head_with_range_matches_get(self):
+        get = self.serve('get', HTTP_RANGE='bytes=10-19')
+        head = self.serve('head', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(get.status_code, 206)
+        self.assertEqual(b''.join(get.streaming_content), bytes(range(10, 20)))
+        self.assertEqual(head.status_code, 206)
+        self.assertEqual(head.content, b'')
+        for header in ('Content-Range', 'Content-Length', 'ETag'):
+            self.assertEqual(head[header], get[header])
+        self.assertEqual(head['Content-Length'], '10')
+
+    def test_head_without_range(self):
+        response = self.serve('head')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], '100')
@@ -14,9 +14,10 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
+import re
+from . import media, views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -25,11 +26,19 @@ urlpatterns = [
          include('social_django.urls', namespace='social')),
     path('images/', include('images.urls', namespace='images')),
     path('__debug__', include('debug_toolbar.urls')),
+    path('redis/stats/', views.redis_stats, name='redis_stats'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
 
-# Была добавлена вспомогательная функция static(), чтобы раздавать медиафайлы
-# с помощью сервера разработки во время разработки (то есть когда
-# настроечный параметр DEBUG задан равным True).
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL,
-                          document_root=settings.MEDIA_ROOT)
+# Медиафайлы раздаются представлением serve_media (см. bookmarks/media.py):
+# с условными запросами, запросами Range и долгим кешированием, а в
+# рабочем окружении - через X-Accel-Redirect/X-Sendfile фронтенд-сервера.
+# Вспомогательная функция static() больше не нужна: она работает только
+# при DEBUG = True.
+if settings.MEDIA_SERVE:
+    media_prefix = re.escape(settings.MEDIA_URL.lstrip('/'))
+    urlpatterns += [
+        re_path(rf'^{media_prefix}(?P<path>.+)$',
+                media.serve_media,
+                name='media'),
+    ]
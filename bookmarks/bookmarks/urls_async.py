@@ -0,0 +1,14 @@
+"""
+Корневая конфигурация URL для запросов, обслуживаемых ASGI (см.
+AsyncViewsMiddleware в bookmarks/async_views.py): приложения account и
+images подключаются с асинхронными вариантами горячих представлений,
+остальные маршруты берутся из bookmarks/urls.py.
+"""
+
+from django.urls import include, path
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('account/', include('account.urls_async')),
+    path('images/', include('images.urls_async', namespace='images')),
+] + sync_urlpatterns
@@ -0,0 +1,35 @@
+import hmac
+from django.contrib.auth.decorators import user_passes_test
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse, JsonResponse
+from . import instrumentation, redis_client
+
+
+@user_passes_test(lambda user: user.is_staff)
+def redis_stats(request):
+    # Время выполнения команд и занятость пула соединений Redis
+    # в этом процессе, для подбора REDIS_MAX_CONNECTIONS
+    return JsonResponse(redis_client.stats())
+
+
+def _has_metrics_token(request):
+    # Сборщик показателей не входит в систему и передает METRICS_TOKEN
+    # в заголовке Authorization. Адрес клиента не проверяется: за
+    # обратным прокси REMOTE_ADDR - адрес прокси
+    if not settings.METRICS_TOKEN:
+        return False
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '')\
+        .partition(' ')
+    return scheme.lower() == 'bearer' and \
+        hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode())
+
+
+def metrics(request):
+    # Показатели представлений в формате Prometheus: для сотрудников
+    # и для сборщика с токеном METRICS_TOKEN
+    if not request.user.is_staff and not _has_metrics_token(request):
+        raise PermissionDenied
+    return HttpResponse(instrumentation.metrics.render(),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
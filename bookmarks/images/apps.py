@@ -1,4 +1,6 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class ImagesConfig(AppConfig):
@@ -8,3 +10,8 @@ class ImagesConfig(AppConfig):
     def ready(self):
         # импортировать обработчики сигналов
         import images.signal
+        # поисковый индекс создается при открытии соединения с базой
+        # данных и сразу после миграций
+        from images.search import prepare_connection, prepare_index
+        connection_created.connect(prepare_connection)
+        post_migrate.connect(prepare_index, sender=self)
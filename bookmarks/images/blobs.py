@@ -0,0 +1,111 @@
+import hashlib
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from easy_thumbnails.files import get_thumbnailer
+from .models import Blob
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_digest(f):
+    # Вычислить SHA-256 файла, читая его частями
+    f.seek(0)
+    sha = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+        sha.update(chunk)
+        size += len(chunk)
+    f.seek(0)
+    return sha.hexdigest(), size
+
+
+def blob_name(digest, extension):
+    # Файлы раскладываются по подкаталогам по первым символам хеш-значения,
+    # чтобы в одном каталоге не оказалось слишком много файлов
+    return f'blobs/{digest[:2]}/{digest[2:4]}/{digest}.{extension}'
+
+
+def _write(name, f):
+    if default_storage.exists(name):
+        return False
+    f.seek(0)
+    saved = default_storage.save(name, File(f))
+    if saved != name:
+        # Файл с тем же содержимым успели записать параллельно
+        default_storage.delete(saved)
+    return True
+
+
+def acquire(f, extension, hashed=None):
+    """
+    Вернуть Blob для содержимого файла f, увеличив счетчик ссылок.
+    Если такого содержимого еще нет, файл записывается в хранилище под
+    своим хеш-значением. Строка Blob блокируется на время операции, чтобы
+    параллельное освобождение не удалило файл, на который появилась ссылка.
+    Если файл уже хеширован, результат file_digest() передается в hashed,
+    чтобы не читать файл еще раз.
+    """
+    digest, size = hashed or file_digest(f)
+    name = blob_name(digest, extension)
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                blob = Blob.objects.select_for_update()\
+                    .filter(digest=digest).first()
+                if blob is None:
+                    blob = Blob.objects.create(digest=digest,
+                                               file=name,
+                                               size=size,
+                                               ref_count=1)
+                else:
+                    Blob.objects.filter(pk=blob.pk)\
+                        .update(ref_count=F('ref_count') + 1)
+                _write(blob.file.name, f)
+                return blob
+        except IntegrityError:
+            # Blob с тем же хеш-значением создан параллельно - повторить
+            if attempt:
+                raise
+
+
+def delete_files(name):
+    # Удалить файл вместе со всеми его миниатюрами; миниатюры находятся
+    # по записям кеша источника easy_thumbnails
+    thumbnailer = get_thumbnailer(default_storage, relative_name=name)
+    source = thumbnailer.get_source_cache()
+    if source is not None:
+        for thumbnail in source.thumbnails.all():
+            thumbnailer.thumbnail_storage.delete(thumbnail.name)
+        source.delete()
+    default_storage.delete(name)
+
+
+def _delete_unreferenced(name):
+    # Файл удаляется после фиксации транзакции, если за это время на то же
+    # содержимое не появилась новая строка Blob
+    if not Blob.objects.filter(file=name).exists() and \
+            default_storage.exists(name):
+        delete_files(name)
+
+
+def release(blob_id):
+    """
+    Уменьшить счетчик ссылок Blob. Когда ссылок не остается, удаляется
+    строка, а файл и миниатюры - после фиксации транзакции вызывающего
+    кода: при ее откате строка вернется, и файл должен остаться.
+    Возвращает True, если файл будет удален.
+    """
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=blob_id).first()
+        if blob is None:
+            return False
+        if blob.ref_count > 1:
+            Blob.objects.filter(pk=blob.pk)\
+                .update(ref_count=F('ref_count') - 1)
+            return False
+        name = blob.file.name
+        blob.delete()
+        transaction.on_commit(lambda: _delete_unreferenced(name))
+        return True
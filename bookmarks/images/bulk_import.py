@@ -0,0 +1,355 @@
+"""
+Массовый импорт закладок из файла: CSV (столбцы url, title, description),
+JSONL (по объекту с теми же ключами в строке) или экспорт закладок
+браузера в формате Netscape HTML.
+
+Записи проверяются формой ImageCreateForm, как и при добавлении через
+букмарклет, и вставляются пачками через bulk_create вместе с заданиями
+скачивания, записями поискового индекса и прогрессом импорта. Сами файлы
+скачивает пул обработчиков очереди (images/ingest.py) с ограничением числа
+одновременных скачиваний с одного сайта. Действия для ленты создаются
+одним вызовом create_actions() на пачку.
+
+Файлы, загруженные через сайт, не импортируются в веб-запросе:
+представление сохраняет файл в ImportBatch.file и ставит импорт в очередь
+(queue_import()), а выполняют его те же обработчики очереди
+(run_next_import()) или команда import_bookmarks --resume.
+"""
+
+import csv
+import datetime
+import io
+import itertools
+import json
+import time
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.text import slugify
+from actions.utils import create_actions
+from .forms import ImageCreateForm
+from .ingest import enqueue_many
+from .models import Image, ImportBatch, ImportItemError, IngestJob
+from .search import search_backend
+
+FORMATS = ('csv', 'jsonl', 'html')
+# Сколько ошибок выводится в отчете об импорте
+REPORT_ERRORS = 100
+
+
+def detect_format(name, head=''):
+    # Формат определяется по расширению файла, а если оно неизвестно -
+    # по первому непробельному символу содержимого
+    extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    if extension == 'csv':
+        return 'csv'
+    if extension in ('jsonl', 'ndjson', 'json'):
+        return 'jsonl'
+    if extension in ('html', 'htm'):
+        return 'html'
+    head = head.lstrip()
+    if head.startswith('<'):
+        return 'html'
+    if head.startswith('{'):
+        return 'jsonl'
+    return 'csv'
+
+
+def _title_from_url(url):
+    name = urlsplit(url).path.rsplit('/', 1)[-1]
+    return name.rsplit('.', 1)[0] or url
+
+
+def _entry(data):
+    # Привести запись файла к данным формы ImageCreateForm
+    url = str(data.get('url') or data.get('href') or '').strip()
+    return {'url': url,
+            'title': str(data.get('title') or '').strip()
+            or _title_from_url(url),
+            'description': str(data.get('description') or '').strip()}
+
+
+def read_csv(f):
+    reader = csv.DictReader(f)
+    for row in reader:
+        yield reader.line_num, _entry(row)
+
+
+def read_jsonl(f):
+    for line, text in enumerate(f, 1):
+        text = text.strip()
+        if not text:
+            continue
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            yield line, {'error': f'invalid JSON: {e}'}
+            continue
+        if not isinstance(data, dict):
+            yield line, {'error': 'expected a JSON object'}
+            continue
+        yield line, _entry(data)
+
+
+class NetscapeParser(HTMLParser):
+    """
+    Разбор экспорта закладок браузера: <DT><A HREF="...">заголовок</A>,
+    за которым может следовать <DD>описание.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.entries = []
+        self.current = None
+        self.field = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self.current = {'href': dict(attrs).get('href') or '',
+                            'title': '',
+                            'description': '',
+                            'line': self.getpos()[0]}
+            self.entries.append(self.current)
+            self.field = 'title'
+        elif tag == 'dd' and self.current is not None:
+            self.field = 'description'
+        else:
+            self.field = None
+
+    def handle_endtag(self, tag):
+        if tag == 'a':
+            self.field = None
+
+    def handle_data(self, data):
+        if self.field is not None:
+            self.current[self.field] += data
+
+
+def read_netscape(f):
+    parser = NetscapeParser()
+    for text in f:
+        parser.feed(text)
+        # Последняя закладка еще может получить описание из следующих строк
+        done, parser.entries = parser.entries[:-1], parser.entries[-1:]
+        for data in done:
+            yield data['line'], _entry(data)
+    parser.close()
+    for data in parser.entries:
+        yield data['line'], _entry(data)
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl, 'html': read_netscape}
+
+
+def read_entries(f, format):
+    return READERS[format](f)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _import_chunk(batch, chunk, seen):
+    images = []
+    errors = []
+    skipped = 0
+    for line, data in chunk:
+        if 'error' in data:
+            errors.append(ImportItemError(batch=batch, line=line,
+                                          error=data['error']))
+            continue
+        form = ImageCreateForm(data=data)
+        if not form.is_valid():
+            messages = '; '.join(f'{field}: {" ".join(field_errors)}'
+                                 for field, field_errors
+                                 in form.errors.items())
+            errors.append(ImportItemError(batch=batch, line=line,
+                                          url=data['url'][:2000],
+                                          error=messages))
+            continue
+        url = form.cleaned_data['url']
+        if url in seen:
+            # Изображение уже добавлено этим пользователем
+            skipped += 1
+            continue
+        seen.add(url)
+        image = form.save(commit=False)
+        image.user = batch.user
+        # bulk_create() не вызывает Image.save(), где создается слаг
+        image.slug = slugify(image.title)
+        images.append(image)
+    with transaction.atomic():
+        images = Image.objects.bulk_create(images)
+        enqueue_many(images, batch=batch)
+        ImportItemError.objects.bulk_create(errors)
+        search_backend.index([(image.id, image.title, image.description)
+                              for image in images])
+        batch.processed += len(chunk)
+        batch.created_count += len(images)
+        batch.skipped += skipped
+        batch.failed += len(errors)
+        batch.save(update_fields=['processed', 'created_count',
+                                  'skipped', 'failed'])
+    create_actions((batch.user, 'bookmarked image', image)
+                   for image in images)
+
+
+def run_import(batch, entries, batch_size=None, progress=None):
+    """
+    Импортировать записи entries (пары номер строки - данные) в batch,
+    пропустив batch.processed уже обработанных записей. Закладки
+    с адресами, которые у пользователя уже есть, пропускаются, поэтому
+    повторный запуск с тем же файлом не создает дубликатов.
+    progress(batch) вызывается после каждой пачки. Возвращает
+    число обработанных за этот запуск записей в секунду.
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    started = time.perf_counter()
+    start = batch.processed
+    seen = set(Image.objects.filter(user=batch.user)
+               .values_list('url', flat=True))
+    entries = itertools.islice(entries, batch.processed, None)
+    for chunk in _chunks(entries, batch_size):
+        _import_chunk(batch, chunk, seen)
+        if progress is not None:
+            progress(batch)
+    batch.state = ImportBatch.State.DONE
+    batch.finished = timezone.now()
+    batch.save(update_fields=['state', 'finished'])
+    elapsed = time.perf_counter() - started
+    return (batch.processed - start) / elapsed if elapsed else 0.0
+
+
+def queue_import(user, upload):
+    """
+    Сохранить загруженный файл и поставить его импорт в очередь.
+    """
+    head = upload.read(512).decode('utf-8', errors='replace')
+    upload.seek(0)
+    return ImportBatch.objects.create(user=user,
+                                      source=upload.name[-255:],
+                                      format=detect_format(upload.name, head),
+                                      file=upload,
+                                      state=ImportBatch.State.QUEUED)
+
+
+def open_entries(batch):
+    # Записи сохраненного файла импорта; файл закрывает вызывающий код
+    raw = batch.file.open('rb')
+    f = io.TextIOWrapper(raw, encoding='utf-8', errors='replace',
+                         newline='')
+    return f, read_entries(f, batch.format)
+
+
+def _heartbeat(batch):
+    # Отметка живого обработчика после каждой пачки
+    ImportBatch.objects.filter(id=batch.id)\
+        .update(locked_at=timezone.now())
+
+
+def requeue_stale_imports(deadline):
+    # Вернуть в очередь импорты обработчиков, которые завершились аварийно
+    return ImportBatch.objects.filter(state=ImportBatch.State.RUNNING,
+                                      locked_at__lt=deadline)\
+        .exclude(file='')\
+        .update(state=ImportBatch.State.QUEUED, locked_at=None)
+
+
+def requeue_import(batch, upload=None):
+    """
+    Продолжить прерванный импорт: поставить его в очередь снова, при
+    необходимости заменив сохраненный файл загруженным. Импорт, который
+    выполняет живой обработчик, не меняется. Возвращает False, если
+    продолжать нечего.
+    """
+    if batch.state == ImportBatch.State.DONE:
+        return False
+    deadline = timezone.now() - datetime.timedelta(
+        seconds=settings.INGEST_LOCK_TIMEOUT)
+    if batch.state == ImportBatch.State.RUNNING and batch.locked_at \
+            and batch.locked_at >= deadline:
+        return True
+    if upload is not None:
+        batch.file.delete(save=False)
+        batch.file = upload
+    if not batch.file:
+        return False
+    batch.state = ImportBatch.State.QUEUED
+    batch.locked_at = None
+    batch.save(update_fields=['file', 'state', 'locked_at'])
+    return True
+
+
+def run_queued_import(batch, batch_size=None, progress=None):
+    """
+    Выполнить импорт из сохраненного файла batch.file с первой
+    необработанной записи. После завершения файл удаляется.
+    """
+    def on_chunk(batch):
+        _heartbeat(batch)
+        if progress is not None:
+            progress(batch)
+    f, entries = open_entries(batch)
+    with f:
+        rate = run_import(batch, entries, batch_size=batch_size,
+                          progress=on_chunk)
+    batch.file.delete(save=False)
+    batch.locked_at = None
+    batch.save(update_fields=['file', 'locked_at'])
+    return rate
+
+
+def run_next_import():
+    """
+    Забрать и выполнить самый старый импорт из очереди. Захват выполняется
+    условным UPDATE, как у заданий скачивания (см. images/ingest.py).
+    Возвращает False, если очередь пуста.
+    """
+    candidates = ImportBatch.objects.filter(state=ImportBatch.State.QUEUED)\
+        .exclude(file='')\
+        .order_by('created')\
+        .values_list('id', flat=True)[:10]
+    for batch_id in candidates:
+        claimed = ImportBatch.objects.filter(id=batch_id,
+                                             state=ImportBatch.State.QUEUED)\
+            .update(state=ImportBatch.State.RUNNING,
+                    locked_at=timezone.now())
+        if claimed:
+            run_queued_import(ImportBatch.objects.select_related('user')
+                              .get(id=batch_id))
+            return True
+    return False
+
+
+def import_report(batch):
+    """
+    Отчет об импорте: счетчики записей, состояние заданий скачивания
+    и первые REPORT_ERRORS ошибок разбора и скачивания.
+    """
+    downloads = {state: 0 for state in IngestJob.State.values}
+    for row in batch.jobs.values('state').annotate(total=Count('id')):
+        downloads[row['state']] = row['total']
+    errors = [{'line': error.line, 'url': error.url, 'error': error.error}
+              for error in batch.errors.all()[:REPORT_ERRORS]]
+    failed = batch.jobs.filter(state=IngestJob.State.FAILED)\
+        .values_list('image__url', 'last_error')[:REPORT_ERRORS]
+    return {'id': batch.id,
+            'source': batch.source,
+            'format': batch.format,
+            'state': batch.state,
+            'processed': batch.processed,
+            'created': batch.created_count,
+            'skipped': batch.skipped,
+            'failed': batch.failed,
+            'downloads': downloads,
+            'errors': errors,
+            'download_errors': [{'url': url, 'error': error}
+                                for url, error in failed]}
@@ -0,0 +1,248 @@
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from bookmarks.redis_client import ar, r
+from .ranking import add_views
+
+logger = logging.getLogger(__name__)
+
+# Ограничение на число запомненных итогов просмотров в процессе
+MAX_CACHED_TOTALS = 10000
+
+
+def views_key(image_id):
+    return f'image:{image_id}:views'
+
+
+class CounterMetrics:
+    """
+    Показатели сброса счетчиков: число сбросов, распределение размеров
+    пачек и суммарное/максимальное время выполнения конвейера Redis.
+    """
+    BATCH_BUCKETS = (1, 10, 50, 100, 500, 1000)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flushes = 0
+        self.errors = 0
+        self.dropped = 0
+        self.increments = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.batch_sizes = {bucket: 0 for bucket in self.BATCH_BUCKETS}
+        self.batch_sizes['+Inf'] = 0
+
+    def observe(self, size, latency):
+        with self.lock:
+            self.flushes += 1
+            self.increments += size
+            self.latency_sum += latency
+            self.latency_max = max(self.latency_max, latency)
+            for bucket in self.BATCH_BUCKETS:
+                if size <= bucket:
+                    self.batch_sizes[bucket] += 1
+                    break
+            else:
+                self.batch_sizes['+Inf'] += 1
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+
+    def drop(self, count):
+        with self.lock:
+            self.dropped += count
+
+    def as_dict(self):
+        with self.lock:
+            return {'flushes': self.flushes,
+                    'errors': self.errors,
+                    'dropped': self.dropped,
+                    'increments': self.increments,
+                    'flush_latency_sum': self.latency_sum,
+                    'flush_latency_max': self.latency_max,
+                    'batch_sizes': {str(bucket): count for bucket, count
+                                    in self.batch_sizes.items()}}
+
+
+class ExactViewCounter:
+    """
+    Точный режим: увеличения счетчика просмотров и рейтингов
+    отправляются одним конвейером, то есть за один обмен с Redis на запрос.
+    """
+
+    def __init__(self, client, async_client):
+        self.client = client
+        self.async_client = async_client
+        self.metrics = CounterMetrics()
+
+    def record(self, image_id):
+        started = time.perf_counter()
+        pipe = self.client.pipeline(transaction=False)
+        pipe.incr(views_key(image_id))
+        add_views(pipe, image_id)
+        total_views = pipe.execute()[0]
+        self.metrics.observe(1, time.perf_counter() - started)
+        return total_views
+
+    async def arecord(self, image_id):
+        # Вариант record() для асинхронных представлений: тот же конвейер
+        # через клиент redis.asyncio
+        started = time.perf_counter()
+        pipe = self.async_client.pipeline(transaction=False)
+        pipe.incr(views_key(image_id))
+        add_views(pipe, image_id)
+        total_views = (await pipe.execute())[0]
+        self.metrics.observe(1, time.perf_counter() - started)
+        return total_views
+
+    def flush(self):
+        pass
+
+
+class BatchedViewCounter:
+    """
+    Пакетный режим: просмотры накапливаются в памяти процесса и сбрасываются
+    в Redis одним конвейером, когда накоплено batch_size просмотров или
+    прошло flush_interval секунд с последнего сброса.
+    Пока Redis доступен, при аварийном завершении процесса теряется не
+    более batch_size - 1 просмотров и не более чем за flush_interval
+    секунд. Сброс выполняется транзакцией MULTI/EXEC: неудачный сброс не
+    применяет ничего, и его просмотры возвращаются в буфер. Пока Redis
+    недоступен, сброс повторяется не чаще раза в flush_interval секунд, а
+    буфер ограничен max_pending просмотрами: лишние отбрасываются и
+    учитываются в metrics.dropped. Поэтому при сбое Redis теряется не
+    более max_pending просмотров на процесс и все просмотры сверх них.
+    Показанное число просмотров - последнее известное значение из Redis
+    плюс несброшенные просмотры этого процесса, поэтому оно может немного
+    отставать.
+    """
+
+    def __init__(self, client, async_client, batch_size, flush_interval,
+                 max_pending=None):
+        self.client = client
+        self.async_client = async_client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending or batch_size * 10
+        self.metrics = CounterMetrics()
+        self.lock = threading.Lock()
+        self.pending = defaultdict(int)
+        self.pending_total = 0
+        self.totals = {}
+        self.last_flush = time.monotonic()
+        # После неудачного сброса следующий - не раньше retry_at
+        self.retry_at = 0.0
+        self.timer = None
+
+    def _start_timer(self):
+        # Фоновый поток сбрасывает буфер и в отсутствие новых просмотров
+        if self.timer is None:
+            self.timer = threading.Thread(target=self._run_timer,
+                                          daemon=True)
+            self.timer.start()
+            atexit.register(self.flush)
+
+    def _run_timer(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def _add(self, image_id):
+        # Учесть просмотр в буфере; возвращает True, если пора сбросить
+        with self.lock:
+            self._start_timer()
+            if self.pending_total >= self.max_pending:
+                self.metrics.drop(1)
+            else:
+                self.pending[image_id] += 1
+                self.pending_total += 1
+            now = time.monotonic()
+            return now >= self.retry_at and \
+                (self.pending_total >= self.batch_size or
+                 now - self.last_flush >= self.flush_interval)
+
+    def record(self, image_id):
+        if self._add(image_id):
+            self.flush()
+        total = self.totals.get(image_id)
+        if total is None:
+            # Первый просмотр изображения в этом процессе: прочитать итог
+            total = int(self.client.get(views_key(image_id)) or 0)
+            self.totals[image_id] = total
+        return total + self.pending.get(image_id, 0)
+
+    async def arecord(self, image_id):
+        # Вариант record() для асинхронных представлений: сброс буфера
+        # выполняется в потоке, чтобы не задерживать цикл событий
+        if self._add(image_id):
+            await sync_to_async(self.flush, thread_sensitive=False)()
+        total = self.totals.get(image_id)
+        if total is None:
+            total = int(await self.async_client.get(views_key(image_id))
+                        or 0)
+            self.totals[image_id] = total
+        return total + self.pending.get(image_id, 0)
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, defaultdict(int)
+            self.pending_total = 0
+            self.last_flush = time.monotonic()
+        if not batch:
+            return
+        started = time.perf_counter()
+        pipe = self.client.pipeline(transaction=True)
+        for image_id, count in batch.items():
+            pipe.incrby(views_key(image_id), count)
+        for image_id, count in batch.items():
+            add_views(pipe, image_id, count)
+        try:
+            results = pipe.execute()
+        except redis.RedisError:
+            logger.exception('view counter flush failed')
+            self.metrics.error()
+            self._requeue(batch)
+            return
+        latency = time.perf_counter() - started
+        self.metrics.observe(sum(batch.values()), latency)
+        if len(self.totals) > MAX_CACHED_TOTALS:
+            self.totals.clear()
+        for image_id, total in zip(batch, results):
+            self.totals[image_id] = total
+        logger.debug('flushed %s views of %s images in %.4fs',
+                     sum(batch.values()), len(batch), latency)
+
+
+    def _requeue(self, batch):
+        # Транзакция не применилась: вернуть просмотры в буфер, чтобы
+        # отправить их при следующем сбросе, но не больше max_pending
+        with self.lock:
+            self.retry_at = time.monotonic() + self.flush_interval
+            dropped = 0
+            for image_id, count in batch.items():
+                kept = min(count, self.max_pending - self.pending_total)
+                if kept > 0:
+                    self.pending[image_id] += kept
+                    self.pending_total += kept
+                dropped += count - max(kept, 0)
+        if dropped:
+            self.metrics.drop(dropped)
+
+
+def get_view_counter():
+    if settings.VIEW_COUNTER_MODE == 'batched':
+        return BatchedViewCounter(r, ar,
+                                  settings.VIEW_COUNTER_BATCH_SIZE,
+                                  settings.VIEW_COUNTER_FLUSH_INTERVAL,
+                                  settings.VIEW_COUNTER_MAX_PENDING)
+    return ExactViewCounter(r, ar)
+
+
+view_counter = get_view_counter()
@@ -0,0 +1,164 @@
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+# Сигнатуры (magic bytes) допустимых форматов и расширения файлов для них
+SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+]
+HEAD_SIZE = max(len(signature) for signature, extension in SIGNATURES)
+
+
+class DownloadError(Exception):
+    # Базовая ошибка скачивания; повторная попытка может помочь
+    pass
+
+
+class PermanentDownloadError(DownloadError):
+    # Повторять скачивание бессмысленно
+    pass
+
+
+class TooLarge(PermanentDownloadError):
+    pass
+
+
+class NotAnImage(PermanentDownloadError):
+    pass
+
+
+class DeadlineExceeded(DownloadError):
+    pass
+
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+def get_session(host):
+    """
+    Вернуть общий для процесса сеанс requests для данного сайта. Сеанс
+    держит пул keep-alive соединений, поэтому повторные скачивания с того же
+    сайта не тратят время на установку TCP- и TLS-соединения. Хранится
+    не больше INGEST_MAX_SESSIONS сеансов последних сайтов: сеанс сайта,
+    к которому дольше всех не обращались, закрывается вместе с его
+    соединениями.
+    """
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is not None:
+            _sessions.move_to_end(host)
+            return session
+        session = requests.Session()
+        session.max_redirects = settings.INGEST_MAX_REDIRECTS
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=settings.INGEST_PER_HOST_LIMIT)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _sessions[host] = session
+        while len(_sessions) > settings.INGEST_MAX_SESSIONS:
+            host, evicted = _sessions.popitem(last=False)
+            # Соединения, занятые текущими скачиваниями, закрываются
+            # при их возврате в пул
+            evicted.close()
+        return session
+
+
+def close_sessions():
+    # Закрыть все сеансы, например при остановке обработчика очереди
+    with _sessions_lock:
+        while _sessions:
+            host, session = _sessions.popitem()
+            session.close()
+
+
+def sniff(chunk):
+    # Определить расширение файла по первым байтам либо вернуть None
+    for signature, extension in SIGNATURES:
+        if chunk.startswith(signature):
+            return extension
+    return None
+
+
+def download(url, max_bytes=None, deadline=None, chunk_size=None):
+    """
+    Скачать файл по URL-адресу во временный файл частями по chunk_size байт.
+    Скачивание прерывается, если файл больше max_bytes, если общее время
+    превысило deadline секунд или если первые байты не совпадают с сигнатурой
+    JPEG или PNG. Объем памяти не зависит от размера файла.
+    Тайм-аут requests ограничивает только одно ожидание сокета, поэтому
+    ожидание данных ограничено коротким INGEST_READ_TIMEOUT, а общее время
+    проверяется перед каждым чтением: скачивание длится не больше
+    deadline + INGEST_READ_TIMEOUT секунд даже при медленной отдаче.
+    Возвращает пару (временный файл, расширение); временный файл
+    удаляется при закрытии.
+    """
+    max_bytes = max_bytes or settings.INGEST_MAX_BYTES
+    deadline = deadline or settings.INGEST_DOWNLOAD_TIMEOUT
+    chunk_size = chunk_size or settings.INGEST_CHUNK_SIZE
+    started = time.monotonic()
+    session = get_session(urlsplit(url).netloc)
+    try:
+        response = session.get(url, stream=True,
+                               timeout=(deadline,
+                                        min(settings.INGEST_READ_TIMEOUT,
+                                            deadline)))
+    except requests.Timeout as e:
+        raise DeadlineExceeded(str(e))
+    except requests.TooManyRedirects as e:
+        raise PermanentDownloadError(str(e))
+    except requests.RequestException as e:
+        raise DownloadError(str(e))
+    with response:
+        if 400 <= response.status_code < 500:
+            raise PermanentDownloadError(f'HTTP {response.status_code}')
+        if response.status_code >= 500:
+            raise DownloadError(f'HTTP {response.status_code}')
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise TooLarge(f'{length} bytes')
+        tmp = tempfile.TemporaryFile()
+        head = b''
+        extension = None
+        size = 0
+        try:
+            chunks = response.iter_content(chunk_size=chunk_size)
+            while True:
+                if time.monotonic() - started > deadline:
+                    raise DeadlineExceeded(f'more than {deadline} s')
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                if extension is None:
+                    # Сигнатура проверяется, как только накоплено достаточно
+                    # байт, чтобы не скачивать целиком файлы другого типа
+                    head += chunk
+                    if len(head) >= HEAD_SIZE:
+                        extension = sniff(head)
+                        if extension is None:
+                            raise NotAnImage('unknown file signature')
+                size += len(chunk)
+                if size > max_bytes:
+                    raise TooLarge(f'more than {max_bytes} bytes')
+                tmp.write(chunk)
+            if extension is None:
+                extension = sniff(head)
+                if extension is None:
+                    raise NotAnImage('unknown file signature')
+        except requests.Timeout as e:
+            tmp.close()
+            raise DeadlineExceeded(str(e))
+        except requests.RequestException as e:
+            tmp.close()
+            raise DownloadError(str(e))
+        except DownloadError:
+            tmp.close()
+            raise
+    tmp.seek(0)
+    return tmp, extension
@@ -0,0 +1,120 @@
+"""
+Потоковая выгрузка закладок пользователя. Изображения читаются из базы
+данных порциями через iterator(chunk_size=...), а ответ формируется
+генератором, поэтому расход памяти не зависит от размера библиотеки.
+Форматы:
+  • jsonl - по одному JSON-объекту с метаданными изображения в строке;
+  • zip - архив, в который файлы изображений (media/...) записываются
+    по одному без сжатия по мере чтения из хранилища, а в конце добавляется
+    bookmarks.jsonl с метаданными.
+Одни и те же генераторы используются представлением image_export
+и командой export_bookmarks.
+"""
+
+import json
+import zipfile
+from django.core.files.storage import default_storage
+from .models import Image
+
+FORMATS = ('jsonl', 'zip')
+CONTENT_TYPES = {'jsonl': 'application/x-ndjson',
+                 'zip': 'application/zip'}
+# Число изображений в одной порции чтения из базы данных
+CHUNK_SIZE = 500
+# Размер блока при копировании файла в архив
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+def _images(user, chunk_size):
+    return Image.objects.filter(user=user)\
+        .select_related('blob')\
+        .order_by('id')\
+        .iterator(chunk_size=chunk_size)
+
+
+def archive_name(image):
+    return f'media/{image.id}-{image.image.name.rsplit("/", 1)[-1]}'
+
+
+def image_record(image, file=None):
+    return {'id': image.id,
+            'title': image.title,
+            'slug': image.slug,
+            'url': image.url,
+            'description': image.description,
+            'created': image.created.isoformat(),
+            'status': image.status,
+            'total_likes': image.total_likes,
+            'sha256': image.blob.digest if image.blob else None,
+            'file': file}
+
+
+def _line(record):
+    return (json.dumps(record, ensure_ascii=False) + '\n').encode()
+
+
+def jsonl_stream(user, chunk_size=CHUNK_SIZE):
+    for image in _images(user, chunk_size):
+        yield _line(image_record(image))
+
+
+class _Sink:
+    """
+    Файловый объект только для записи: ZipFile пишет в него архив,
+    а генератор забирает накопленные байты после каждого блока.
+    У объекта нет seek(), поэтому ZipFile записывает размеры файлов
+    после их содержимого и не возвращается назад.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def zip_stream(user, chunk_size=CHUNK_SIZE):
+    sink = _Sink()
+    missing = set()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED,
+                         allowZip64=True) as archive:
+        for image in _images(user, chunk_size):
+            if not image.image:
+                continue
+            try:
+                f = default_storage.open(image.image.name, 'rb')
+            except FileNotFoundError:
+                missing.add(image.id)
+                continue
+            info = zipfile.ZipInfo(archive_name(image),
+                                   image.created.timetuple()[:6])
+            with f, archive.open(info, 'w', force_zip64=True) as entry:
+                for block in iter(lambda: f.read(FILE_CHUNK_SIZE), b''):
+                    entry.write(block)
+                    yield sink.drain()
+            yield sink.drain()
+        # Метаданные записываются последними, когда известно,
+        # файлы каких изображений попали в архив
+        with archive.open('bookmarks.jsonl', 'w',
+                          force_zip64=True) as entry:
+            for image in _images(user, chunk_size):
+                included = image.image and image.id not in missing
+                entry.write(_line(image_record(
+                    image, archive_name(image) if included else None)))
+                yield sink.drain()
+    yield sink.drain()
+
+
+def export_stream(user, format, chunk_size=CHUNK_SIZE):
+    stream = zip_stream if format == 'zip' else jsonl_stream
+    # Пустые блоки (архив еще ничего не записал) не отправляются
+    return (data for data in stream(user, chunk_size) if data)
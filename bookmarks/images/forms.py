@@ -1,8 +1,6 @@
 from django import forms
 from .models import Image
-from django.core.files.base import ContentFile
-from django.utils.text import slugify
-import requests
+from .ingest import enqueue
 
 
 class ImageCreateForm(forms.ModelForm):
@@ -39,7 +37,7 @@ class ImageCreateForm(forms.ModelForm):
         """
         url = self.cleaned_data['url']
         valid_extensions = ['jpg', 'jpeg', 'png']
-        extension = url.rsplit('.', 1)[1].lower()
+        extension = url.rsplit('.', 1)[-1].lower()
         if extension not in valid_extensions:
             raise forms.ValidationError('Данный URL-адрес не соответствует'
                                         ' действительным расширениям изображений')
@@ -49,34 +47,16 @@ class ImageCreateForm(forms.ModelForm):
              force_update=False,
              commit=True):
         """
-        Мы переопределили метод save(), сохранив параметры, требуемые классом ModelForm. Приведенный выше
-         исходный код объясняется следующим
-        образом.
-        1. Новый экземпляр изображения создается путем вызова метода save()
-        формы с commit=False.
-        2. URL-адрес изображения извлекается из словаря clean_data формы.
-        3. Имя изображения генерируется путем комбинирования названия изображения с изначальным расширением файла изображения.
-        4. Библиотека Python requests используется для скачивания изображения путем отправки HTTP-запроса методом GET с
-         использованием URL-адреса изображения. Ответ сохраняется в объекте response.
-        5. Вызывается метод save() поля image, передавая ему объект ContentFile,
-        экземпляр которого заполнен содержимым скачанного файла. Таким
-        путем файл сохраняется в каталог media проекта. Параметр save=False
-        передается для того, чтобы избежать сохранения объекта в базе данных.
-        6. Для того чтобы оставить то же поведение, что и в изначальном методе save()
-         модельной формы, форма сохраняется в базе данных только
-        в том случае, если параметр commit равен True.
+        Мы переопределили метод save(), сохранив параметры, требуемые классом ModelForm.
+        Файл изображения здесь больше не скачивается: изображение сохраняется
+        со статусом PENDING, а скачивание выполняет фоновый обработчик
+        (images/ingest.py), чтобы медленный удаленный сервер не задерживал ответ.
+        Задание в очередь ставится после сохранения объекта в базе данных,
+        поэтому при commit=False его ставит вызывающий код функцией enqueue().
         """
         image = super().save(commit=False)
-        image_url = self.cleaned_data['url']
-        name = slugify(image.title)
-        extension = image_url.rsplit('.', 1)[1].lower()
-        image_name = f"{name}.{extension}"
-
-        # скачать изображения с данного URL-адреса
-        response = requests.get(image_url)
-        image.image.save(image_name,
-                         ContentFile(response.content),
-                         save=False)
+        image.status = Image.Status.PENDING
         if commit:
             image.save()
+            enqueue(image)
         return image
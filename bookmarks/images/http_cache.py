@@ -0,0 +1,262 @@
+"""
+Кеширование страниц изображений на уровне HTTP и кеширование карточек
+изображений в списке.
+
+Метки версий хранятся в общем кеше: общая метка списка изображений и метка
+каждого изображения - время их последнего изменения. Метки обновляются
+функцией touch() из обработчиков сигналов (images/signal.py): при создании
+и сохранении изображения и при изменении лайков; лайки в списке не
+видны, поэтому для них меняется только метка изображения. При удалении
+изображения forget() удаляет его метку. Метки живут STAMP_TIMEOUT секунд;
+недостающую метку изображения создает только представление, которое нашло
+изображение в базе (stamp()), поэтому запросы к несуществующим id не
+заполняют кеш. Значения ETag и
+Last-Modified страниц вычисляются по меткам одним обращением к кешу, поэтому
+на условный запрос с совпавшим ETag ответ 304 возвращается без запросов к
+базе данных и без прорисовки шаблона. Страницы зависят от пользователя,
+поэтому его id входит в ETag, а сами ответы помечаются как private.
+
+Готовый HTML карточек списка (images/image/card.html) хранится в кеше
+под ключом изображения и удаляется той же функцией touch().
+Доли ответов 304 и попаданий в кеш карточек доступны в metrics.
+
+Для асинхронных представлений служат astamps() и декоратор
+aconditional_page(): функции ETag и Last-Modified у них - сопрограммы.
+"""
+
+import datetime
+import hashlib
+import threading
+import time
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, \
+    patch_cache_control, quote_etag
+from django.utils.http import http_date
+from django.utils.safestring import mark_safe
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+LIST_KEY = 'images:stamp'
+CARD_TIMEOUT = 60 * 60 * 24
+STAMP_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def image_key(image_id):
+    return f'image:{image_id}:stamp'
+
+
+def card_key(image_id):
+    return f'image:{image_id}:card'
+
+
+class CacheMetrics:
+    """
+    Попадания в кеш в текущем процессе: ответы 304 по страницам
+    и найденные в кеше карточки изображений.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.card_hits = 0
+        self.card_misses = 0
+
+    def page(self, name, hit):
+        with self.lock:
+            counts = self.pages.setdefault(name, {'hits': 0, 'misses': 0})
+            counts['hits' if hit else 'misses'] += 1
+
+    def cards(self, hits, misses):
+        with self.lock:
+            self.card_hits += hits
+            self.card_misses += misses
+
+    def as_dict(self):
+        def rate(hits, misses):
+            return hits / (hits + misses) if hits + misses else 0.0
+        with self.lock:
+            pages = {name: dict(counts,
+                                hit_rate=rate(counts['hits'],
+                                              counts['misses']))
+                     for name, counts in self.pages.items()}
+            return {'pages': pages,
+                    'cards': {'hits': self.card_hits,
+                              'misses': self.card_misses,
+                              'hit_rate': rate(self.card_hits,
+                                               self.card_misses)}}
+
+
+metrics = CacheMetrics()
+
+
+def touch(image_ids, list_changed=True):
+    # Отметить изменение изображений: обновить их метки, а если изменение
+    # видно в списке (list_changed), то и метку списка, и удалить карточки
+    image_ids = set(image_ids)
+    now = time.time()
+    stamps = {image_key(image_id): now for image_id in image_ids}
+    if list_changed:
+        stamps[LIST_KEY] = now
+        cache.delete_many([card_key(image_id) for image_id in image_ids])
+    cache.set_many(stamps, STAMP_TIMEOUT)
+
+
+def forget(image_ids):
+    # Изображения удалены: удалить их метки и карточки, обновить метку
+    # списка
+    image_ids = set(image_ids)
+    cache.delete_many([image_key(image_id) for image_id in image_ids] +
+                      [card_key(image_id) for image_id in image_ids])
+    cache.set(LIST_KEY, time.time(), STAMP_TIMEOUT)
+
+
+def stamp(image_id):
+    # Создать недостающую метку изображения, найденного в базе данных
+    cache.add(image_key(image_id), time.time(), STAMP_TIMEOUT)
+
+
+async def astamp(image_id):
+    await cache.aadd(image_key(image_id), time.time(), STAMP_TIMEOUT)
+
+
+def _stamp_values(keys, values):
+    # Недостающая метка списка создается с текущим временем, недостающие
+    # метки изображений остаются None: изображения может не быть в базе
+    missing = {}
+    if LIST_KEY not in values:
+        missing[LIST_KEY] = values[LIST_KEY] = time.time()
+    return missing, [values.get(key) for key in keys]
+
+
+def stamps(request, *image_ids):
+    """
+    Метки списка и изображений image_ids одним обращением к кешу.
+    Результат запоминается в запросе: функции ETag и Last-Modified
+    вызываются для одного запроса дважды. Отсутствующая метка списка
+    (например, после очистки кеша) создается с текущим временем, вместо
+    отсутствующих меток изображений возвращается None.
+    """
+    memo = request.__dict__.setdefault('_image_stamps', {})
+    if image_ids not in memo:
+        keys = [LIST_KEY] + [image_key(image_id) for image_id in image_ids]
+        missing, memo[image_ids] = _stamp_values(keys, cache.get_many(keys))
+        if missing:
+            cache.set_many(missing, STAMP_TIMEOUT)
+    return memo[image_ids]
+
+
+async def astamps(request, *image_ids):
+    # Вариант stamps() для асинхронных представлений
+    memo = request.__dict__.setdefault('_image_stamps', {})
+    if image_ids not in memo:
+        keys = [LIST_KEY] + [image_key(image_id) for image_id in image_ids]
+        missing, memo[image_ids] = _stamp_values(
+            keys, await cache.aget_many(keys))
+        if missing:
+            await cache.aset_many(missing, STAMP_TIMEOUT)
+    return memo[image_ids]
+
+
+def make_etag(*parts):
+    return hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def as_datetime(stamp):
+    return datetime.datetime.fromtimestamp(stamp, tz=datetime.timezone.utc)
+
+
+def has_messages(request):
+    # Страница с сообщениями django.contrib.messages должна прорисоваться,
+    # иначе сообщения не будут показаны
+    return len(get_messages(request)) > 0
+
+
+async def ahas_messages(request):
+    # Сообщения хранятся в сессии, которая читается синхронно
+    return await sync_to_async(has_messages)(request)
+
+
+def conditional_page(name, etag_func, last_modified_func=None):
+    """
+    Декоратор представления: условные запросы по etag_func и
+    last_modified_func (как django.views.decorators.http.condition) и
+    учет ответов 304 в metrics. Функции возвращают None, если страницу
+    нельзя кешировать. Ответ помечается как private и no-cache: браузер
+    хранит его, но перед использованием проверяет условным запросом.
+    """
+    def decorator(view):
+        conditional_view = condition(etag_func=etag_func,
+                                     last_modified_func=last_modified_func
+                                     )(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            metrics.page(name, response.status_code == 304)
+            return response
+        return cache_control(private=True, no_cache=True)(wrapper)
+    return decorator
+
+
+def aconditional_page(name, etag_func, last_modified_func=None):
+    """
+    Вариант conditional_page() для асинхронных представлений; etag_func
+    и last_modified_func - сопрограммы. Декоратор condition в Django 4.1
+    поддерживает только синхронные представления, поэтому проверка
+    условий повторяет его через get_conditional_response().
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            etag = last_modified = None
+            if request.method in ('GET', 'HEAD'):
+                value = await etag_func(request, *args, **kwargs)
+                etag = quote_etag(value) if value else None
+                if last_modified_func is not None:
+                    value = await last_modified_func(request, *args,
+                                                     **kwargs)
+                    last_modified = int(value.timestamp()) if value \
+                        else None
+            response = get_conditional_response(request, etag=etag,
+                                                last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                if last_modified and \
+                        not response.has_header('Last-Modified'):
+                    response.headers['Last-Modified'] = \
+                        http_date(last_modified)
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+            metrics.page(name, response.status_code == 304)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def render_cards(images):
+    """
+    HTML карточек изображений для списка: найденные в кеше карточки
+    выбираются одним запросом get_many, недостающие прорисовываются
+    и сохраняются одним set_many.
+    """
+    keys = [card_key(image.id) for image in images]
+    cached = cache.get_many(keys)
+    metrics.cards(len(cached), len(keys) - len(cached))
+    cards = []
+    fresh = {}
+    for key, image in zip(keys, images):
+        html = cached.get(key)
+        if html is None:
+            html = render_to_string('images/image/card.html',
+                                    {'image': image})
+            fresh[key] = html
+        cards.append(mark_safe(html))
+    if fresh:
+        cache.set_many(fresh, CARD_TIMEOUT)
+    return cards
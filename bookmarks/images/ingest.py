@@ -0,0 +1,254 @@
+import datetime
+import logging
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+from PIL import Image as PILImage
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import LessThan
+from django.utils import timezone
+from bookmarks.redis_client import r
+from .blobs import acquire
+from .downloader import close_sessions, download, PermanentDownloadError
+from .http_cache import touch
+from .models import Image, IngestJob
+from .thumbnails import generate_safely, run_next, target_for
+
+logger = logging.getLogger(__name__)
+
+# Сортированное множество живых обработчиков: элемент - id обработчика,
+# балл - время последнего сигнала активности
+WORKERS_KEY = 'ingest:workers'
+
+
+class PermanentError(Exception):
+    """
+    Ошибка, после которой повторять скачивание бессмысленно:
+    файл не является изображением или удаленный сервер ответил 4xx.
+    """
+
+
+def _new_job(image, batch=None):
+    return IngestJob(image=image,
+                     host=urlsplit(image.url).hostname or '',
+                     run_after=timezone.now(),
+                     batch=batch)
+
+
+def enqueue(image):
+    """
+    Поставить скачивание изображения в очередь. Изображение должно быть
+    уже сохранено в базе данных со статусом PENDING.
+    """
+    job = _new_job(image)
+    job.save()
+    return job
+
+
+def enqueue_many(images, batch=None):
+    # Пакетный вариант enqueue(): все задания вставляются одним запросом
+    return IngestJob.objects.bulk_create([_new_job(image, batch)
+                                          for image in images])
+
+
+def _busy_hosts():
+    # Сайты, с которых уже скачивается INGEST_PER_HOST_LIMIT файлов
+    return IngestJob.objects.filter(state=IngestJob.State.RUNNING)\
+        .values('host')\
+        .annotate(running=Count('id'))\
+        .filter(running__gte=settings.INGEST_PER_HOST_LIMIT)\
+        .values_list('host', flat=True)
+
+
+def requeue_stale():
+    # Вернуть в очередь задания обработчиков, которые завершились аварийно
+    # и импорты закладок из загруженных файлов (images/bulk_import.py)
+    from .bulk_import import requeue_stale_imports
+    deadline = timezone.now() - datetime.timedelta(
+        seconds=settings.INGEST_LOCK_TIMEOUT)
+    requeue_stale_imports(deadline)
+    return IngestJob.objects.filter(state=IngestJob.State.RUNNING,
+                                    locked_at__lt=deadline)\
+        .update(state=IngestJob.State.QUEUED, locked_at=None)
+
+
+def _host_has_capacity():
+    # Условие для UPDATE захвата: по сайту задания выполняется меньше
+    # INGEST_PER_HOST_LIMIT заданий. Проверяется в том же UPDATE, что и
+    # состояние задания: SQLite выполняет записи по одной (BEGIN
+    # IMMEDIATE), поэтому два обработчика не превысят лимит, даже если
+    # оба выбрали кандидатов с одного сайта
+    running = IngestJob.objects.filter(state=IngestJob.State.RUNNING,
+                                       host=OuterRef('host'))\
+        .order_by()\
+        .values('host')\
+        .annotate(total=Count('id'))\
+        .values('total')
+    return LessThan(Coalesce(Subquery(running), 0),
+                    settings.INGEST_PER_HOST_LIMIT)
+
+
+def claim_job():
+    """
+    Забрать следующее готовое к выполнению задание. Захват выполняется
+    условным UPDATE: если задание уже забрал другой обработчик или по его
+    сайту уже выполняется INGEST_PER_HOST_LIMIT заданий, число измененных
+    строк будет равно нулю, и берется следующий кандидат.
+    """
+    now = timezone.now()
+    # Занятые сайты исключаются заранее, чтобы не перебирать заведомо
+    # неудачных кандидатов; окончательная проверка - в UPDATE
+    candidates = IngestJob.objects.filter(state=IngestJob.State.QUEUED,
+                                          run_after__lte=now)\
+        .exclude(host__in=list(_busy_hosts()))\
+        .values_list('id', flat=True)[:10]
+    for job_id in candidates:
+        claimed = IngestJob.objects.filter(_host_has_capacity(),
+                                           id=job_id,
+                                           state=IngestJob.State.QUEUED)\
+            .update(state=IngestJob.State.RUNNING,
+                    locked_at=now,
+                    attempts=F('attempts') + 1)
+        if claimed:
+            return IngestJob.objects.select_related('image').get(id=job_id)
+    return None
+
+
+def fetch(image):
+    """
+    Скачать файл изображения, проверить его и сохранить в хранилище.
+    """
+    try:
+        tmp, extension = download(image.url)
+    except PermanentDownloadError as e:
+        raise PermanentError(str(e))
+    with tmp:
+        try:
+            PILImage.open(tmp).verify()
+        except Exception as e:
+            raise PermanentError(f'not an image: {e}')
+        # Одинаковые файлы хранятся один раз под хеш-значением содержимого.
+        # Ссылка на Blob и изображение сохраняются в одной транзакции:
+        # если сохранение не удалось, счетчик ссылок не увеличится, и
+        # повторная попытка не оставит лишнюю ссылку
+        with transaction.atomic():
+            blob = acquire(tmp, extension)
+            image.blob = blob
+            image.image.name = blob.file.name
+            image.status = Image.Status.READY
+            image.save(update_fields=['image', 'blob', 'status'])
+    # Миниатюры создаются здесь, в обработчике очереди, а не в веб-процессе
+    # (см. images/thumbnails.py)
+    generate_safely(image.image.name, target_for(image.image))
+
+
+def _fail(job, error, permanent):
+    job.last_error = str(error)
+    job.locked_at = None
+    if permanent or job.attempts >= settings.INGEST_MAX_ATTEMPTS:
+        job.state = IngestJob.State.FAILED
+        Image.objects.filter(id=job.image_id)\
+            .update(status=Image.Status.FAILED)
+        # update() не отправляет post_save: обновить метку страницы вручную
+        touch([job.image_id])
+    else:
+        # Повторить попытку с экспоненциально растущей задержкой
+        delay = settings.INGEST_RETRY_DELAY * 2 ** (job.attempts - 1)
+        job.state = IngestJob.State.QUEUED
+        job.run_after = timezone.now() + datetime.timedelta(seconds=delay)
+    job.save(update_fields=['state', 'run_after', 'locked_at', 'last_error'])
+
+
+def run_job(job):
+    try:
+        fetch(job.image)
+    except PermanentError as e:
+        logger.info('ingest %s failed: %s', job.image_id, e)
+        _fail(job, e, permanent=True)
+    except Exception as e:
+        logger.warning('ingest %s attempt %s failed: %s',
+                       job.image_id, job.attempts, e)
+        _fail(job, e, permanent=False)
+    else:
+        job.state = IngestJob.State.DONE
+        job.locked_at = None
+        job.save(update_fields=['state', 'locked_at'])
+
+
+def heartbeat(worker_id):
+    r.zadd(WORKERS_KEY, {worker_id: time.time()})
+
+
+def work(stop_event, poll_interval=1.0, once=False):
+    """
+    Цикл обработчика: забирать задания, пока не будет установлен
+    stop_event. При once=True цикл завершается, когда очередь пуста.
+    """
+    # bulk_import импортирует этот модуль для постановки заданий в очередь
+    from .bulk_import import run_next_import
+    worker_id = uuid.uuid4().hex
+    try:
+        while not stop_event.is_set():
+            heartbeat(worker_id)
+            close_old_connections()
+            job = claim_job()
+            if job is not None:
+                run_job(job)
+            elif run_next():
+                # заданий скачивания нет - создать миниатюры из очереди
+                continue
+            elif run_next_import():
+                # импорт из загруженного файла ставит задания скачивания
+                continue
+            elif once:
+                break
+            else:
+                stop_event.wait(poll_interval)
+    finally:
+        r.zrem(WORKERS_KEY, worker_id)
+        close_old_connections()
+
+
+def run_pool(workers, poll_interval=1.0, once=False):
+    # Запустить пул потоков-обработчиков и дождаться их завершения
+    requeue_stale()
+    stop_event = threading.Event()
+    threads = [threading.Thread(target=work,
+                                args=(stop_event, poll_interval, once),
+                                daemon=True)
+               for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=poll_interval)
+    except KeyboardInterrupt:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        close_sessions()
+
+
+def queue_stats():
+    """
+    Показатели очереди для планирования мощностей: число заданий
+    в каждом состоянии, число живых обработчиков и возраст самого
+    старого ожидающего задания в секундах.
+    """
+    stats = {state: 0 for state in IngestJob.State.values}
+    counts = IngestJob.objects.values('state').annotate(total=Count('id'))
+    for row in counts:
+        stats[row['state']] = row['total']
+    alive_since = time.time() - settings.INGEST_LOCK_TIMEOUT
+    stats['workers'] = r.zcount(WORKERS_KEY, alive_since, '+inf')
+    oldest = IngestJob.objects.filter(state=IngestJob.State.QUEUED)\
+        .order_by('created').values_list('created', flat=True).first()
+    stats['oldest_queued_age'] = \
+        (timezone.now() - oldest).total_seconds() if oldest else 0
+    return stats
@@ -0,0 +1,128 @@
+from collections import Counter
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from images.pagination import cursor_paginate
+from .models import Image
+
+# Максимальное число изображений в одном пакетном запросе лайков
+MAX_BULK_LIKES = 100
+# Число последних лайкнувших пользователей на странице изображения
+# и на одной странице полного списка
+LIKERS_PREVIEW = 12
+LIKERS_PER_PAGE = 48
+
+
+def change_likes(image_ids, delta):
+    """
+    Атомарно изменить total_likes изображений на delta для каждого
+    вхождения id в image_ids. Значение вычисляется в базе данных
+    выражением F(), поэтому параллельные лайки не теряются, а остальные
+    поля изображения не перезаписываются.
+    """
+    by_count = Counter(image_ids)
+    # Изображения группируются по величине изменения: один UPDATE на группу
+    groups = {}
+    for image_id, count in by_count.items():
+        groups.setdefault(count * delta, []).append(image_id)
+    for change, ids in groups.items():
+        Image.objects.filter(id__in=ids)\
+            .update(total_likes=Greatest(F('total_likes') + change, 0))
+
+
+def liked_pairs(instance, reverse, pk_set):
+    """
+    Вернуть id изображений для существующих лайков, затрагиваемых
+    удалением pk_set из связи users_like (со стороны изображения
+    или со стороны пользователя при reverse=True).
+    """
+    through = Image.users_like.through.objects
+    if reverse:
+        rows = through.filter(user_id=instance.pk)
+        if pk_set is not None:
+            rows = rows.filter(image_id__in=pk_set)
+        return list(rows.values_list('image_id', flat=True))
+    rows = through.filter(image_id=instance.pk)
+    if pk_set is not None:
+        rows = rows.filter(user_id__in=pk_set)
+    return [instance.pk] * rows.count()
+
+
+def reconcile(batch_size=500):
+    """
+    Пересчитать total_likes по таблице лайков. Расхождения находятся
+    одним агрегирующим запросом, исправления записываются bulk_update.
+    Возвращает число исправленных изображений.
+    """
+    stale = Image.objects.annotate(likes=Count('users_like'))\
+        .exclude(total_likes=F('likes'))\
+        .only('id', 'total_likes')
+    fixed = []
+    for image in stale.iterator(chunk_size=batch_size):
+        image.total_likes = image.likes
+        fixed.append(image)
+    Image.objects.bulk_update(fixed, ['total_likes'], batch_size=batch_size)
+    return len(fixed)
+
+
+def bulk_like(user, like_ids, unlike_ids):
+    """
+    Поставить и снять лайки сразу для нескольких изображений: по одному
+    INSERT и DELETE на весь пакет. Возвращает пару списков id изображений,
+    которым лайк действительно поставлен и с которых он действительно снят.
+    """
+    like_ids = set(Image.objects.filter(id__in=like_ids)
+                   .values_list('id', flat=True))
+    unlike_ids = set(unlike_ids) - like_ids
+    already = set(user.images_liked.filter(id__in=like_ids | unlike_ids)
+                  .values_list('id', flat=True))
+    liked = sorted(like_ids - already)
+    unliked = sorted(unlike_ids & already)
+    if liked:
+        user.images_liked.add(*liked)
+    if unliked:
+        user.images_liked.remove(*unliked)
+    return liked, unliked
+
+
+def _like(image, user):
+    return Image.users_like.through.objects\
+        .filter(image_id=image.id, user_id=user.id)
+
+
+def is_liked(image, user):
+    # Один запрос EXISTS вместо загрузки всех лайкнувших пользователей
+    if not user.is_authenticated:
+        return False
+    return _like(image, user).exists()
+
+
+async def ais_liked(image, user):
+    if not user.is_authenticated:
+        return False
+    return await _like(image, user).aexists()
+
+
+def _likes(image):
+    return Image.users_like.through.objects\
+        .filter(image_id=image.id)\
+        .select_related('user', 'user__profile')
+
+
+def likers_preview(image, count=LIKERS_PREVIEW):
+    # Последние count лайкнувших пользователей вместе с профилями
+    return [like.user for like in _likes(image).order_by('-id')[:count]]
+
+
+async def alikers_preview(image, count=LIKERS_PREVIEW):
+    return [like.user async for like
+            in _likes(image).order_by('-id')[:count]]
+
+
+def likers_page(image, cursor=None, per_page=LIKERS_PER_PAGE):
+    """
+    Страница полного списка лайкнувших пользователей (от последних
+    к первым) с разбивкой по курсору. Возвращает пару
+    (пользователи, курсор следующей страницы).
+    """
+    page = cursor_paginate(_likes(image), cursor, per_page, ordering=('-id',))
+    return [like.user for like in page], page.next_cursor
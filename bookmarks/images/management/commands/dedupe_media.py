@@ -0,0 +1,74 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from images.blobs import acquire, delete_files, file_digest
+from images.http_cache import touch
+from images.models import Image
+from images.thumbnails import schedule
+
+
+class Command(BaseCommand):
+    """
+    Перенести существующие файлы изображений в хранилище по хеш-значению.
+    Для каждого изображения без Blob файл хешируется (один раз), одинаковые
+    файлы объединяются в один Blob, а старые копии и их миниатюры удаляются.
+    Изображения переписываются методом update() без сигнала post_save,
+    поэтому миниатюры нового файла ставятся в очередь, а метки кеша страниц
+    и карточек обновляются здесь же. В конце выводится объем освобожденного
+    места.
+    """
+    help = 'Move image files to content-addressed storage and drop duplicates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how much space would be freed')
+
+    def handle(self, *args, **options):
+        images = Image.objects.filter(blob__isnull=True)\
+            .exclude(image='')\
+            .only('id', 'image')\
+            .order_by('id')
+        seen = {}
+        migrated = 0
+        missing = 0
+        before = 0
+        after = 0
+        rewritten = []
+        for image in images.iterator(chunk_size=options['chunk_size']):
+            name = image.image.name
+            if not default_storage.exists(name):
+                missing += 1
+                continue
+            extension = name.rsplit('.', 1)[-1].lower()
+            with default_storage.open(name, 'rb') as f:
+                hashed = file_digest(f)
+                digest, size = hashed
+                before += size
+                if digest not in seen:
+                    seen[digest] = size
+                    after += size
+                if options['dry_run']:
+                    migrated += 1
+                    continue
+                blob = acquire(f, extension, hashed)
+            Image.objects.filter(pk=image.pk)\
+                .update(blob=blob, image=blob.file.name)
+            if name != blob.file.name:
+                delete_files(name)
+                image.image.name = blob.file.name
+                schedule(image.image)
+            rewritten.append(image.pk)
+            if len(rewritten) >= options['chunk_size']:
+                touch(rewritten)
+                rewritten = []
+            migrated += 1
+        if rewritten:
+            touch(rewritten)
+        verb = 'Would free' if options['dry_run'] else 'Freed'
+        self.stdout.write(f'Images migrated: {migrated}, '
+                          f'missing files: {missing}')
+        self.stdout.write(f'Distinct files: {len(seen)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {filesizeformat(before - after)} '
+            f'({filesizeformat(before)} -> {filesizeformat(after)})'))
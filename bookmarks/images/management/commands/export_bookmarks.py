@@ -0,0 +1,37 @@
+import sys
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from images.export import CHUNK_SIZE, FORMATS, export_stream
+
+
+class Command(BaseCommand):
+    """
+    Выгрузить закладки пользователя в файл или в стандартный вывод.
+    Используются те же генераторы, что и в представлении image_export,
+    поэтому расход памяти не зависит от числа изображений.
+    """
+    help = "Dump a user's bookmarks as JSONL or a ZIP with media files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--format', choices=FORMATS, default='jsonl')
+        parser.add_argument('--output', '-o',
+                            help='File to write (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'User {options["username"]} does not exist')
+        stream = export_stream(user, options['format'],
+                               options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                written = sum(f.write(data) for data in stream)
+            self.stderr.write(f'Wrote {written} bytes to '
+                              f'{options["output"]}')
+        else:
+            for data in stream:
+                sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,45 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from account.models import Profile
+from images.models import Image
+from images.thumbnails import generate_many
+
+
+class Command(BaseCommand):
+    """
+    Создать миниатюры всех алиасов THUMBNAIL_ALIASES для уже загруженных
+    изображений и фотоснимков профилей. Работа распределяется по пулу
+    процессов; существующие миниатюры не пересоздаются.
+    """
+    help = 'Pre-generate thumbnail aliases for existing media'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int,
+                            default=settings.THUMBNAIL_PROCESSES)
+
+    def jobs(self):
+        # Одинаковые файлы (общие Blob) обрабатываются один раз
+        images = Image.objects.exclude(image='')\
+            .values_list('image', flat=True).distinct()
+        for name in images.iterator():
+            yield name, 'images.Image.image'
+        photos = Profile.objects.exclude(photo='')\
+            .values_list('photo', flat=True).distinct()
+        for name in photos.iterator():
+            yield name, 'account.Profile.photo'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        files = thumbnails = errors = 0
+        for name, count, error in generate_many(self.jobs(),
+                                                options['processes']):
+            files += 1
+            thumbnails += count
+            if error:
+                errors += 1
+                self.stderr.write(f'{name}: {error}')
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{files} file(s), {thumbnails} thumbnail(s), '
+            f'{errors} error(s) in {elapsed:.1f}s'))
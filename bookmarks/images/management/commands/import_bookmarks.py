@@ -0,0 +1,99 @@
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from images.bulk_import import FORMATS, detect_format, import_report, \
+    read_entries, run_import, run_queued_import
+from images.ingest import run_pool
+from images.models import ImportBatch
+
+
+class Command(BaseCommand):
+    """
+    Импортировать закладки пользователя из файла CSV, JSONL или экспорта
+    закладок браузера (см. images/bulk_import.py). Прерванный импорт
+    продолжается с того же места: --resume <id> с тем же файлом. Импорт
+    файла, загруженного через сайт, выполняется с --resume <id> без пути
+    к файлу (или обработчиком очереди скачивания).
+    С флагом --download после импорта запускается пул обработчиков очереди,
+    который скачивает файлы и завершается, когда очередь пуста.
+    В конце выводятся скорость импорта и скачивания и отчет об ошибках.
+    """
+    help = 'Bulk import bookmarks from CSV, JSONL or a browser export'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?')
+        parser.add_argument('--user', required=True,
+                            help='Username that will own the images')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.IMPORT_BATCH_SIZE)
+        parser.add_argument('--resume', type=int, metavar='ID',
+                            help='Continue an interrupted import')
+        parser.add_argument('--download', action='store_true',
+                            help='Download the images before exiting')
+        parser.add_argument('--workers', type=int,
+                            default=settings.INGEST_WORKERS)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'User {options["user"]} does not exist')
+        path = options['path']
+        if options['resume']:
+            try:
+                batch = ImportBatch.objects.get(id=options['resume'],
+                                                user=user)
+            except ImportBatch.DoesNotExist:
+                raise CommandError(f'Import {options["resume"]} '
+                                   f'does not exist')
+            self.stdout.write(f'Resuming import {batch.id} '
+                              f'after {batch.processed} record(s)')
+        elif path is None:
+            raise CommandError('A file is required to start an import')
+        if path is None:
+            if not batch.file:
+                raise CommandError(f'Import {batch.id} has no stored file')
+            rate = run_queued_import(batch,
+                                     batch_size=options['batch_size'],
+                                     progress=self.progress)
+        else:
+            with open(path, encoding='utf-8', newline='') as f:
+                format = options['format'] \
+                    or detect_format(path, f.read(512))
+                f.seek(0)
+                if not options['resume']:
+                    batch = ImportBatch.objects.create(user=user,
+                                                       source=path[-255:],
+                                                       format=format)
+                    self.stdout.write(f'Started import {batch.id}')
+                rate = run_import(batch,
+                                  read_entries(f, format),
+                                  batch_size=options['batch_size'],
+                                  progress=self.progress)
+        self.stdout.write(f'Imported at {rate:.0f} records/s')
+
+        if options['download']:
+            started = time.perf_counter()
+            run_pool(options['workers'], once=True)
+            elapsed = time.perf_counter() - started
+            finished = batch.jobs.filter(state__in=['done', 'failed'])\
+                .count()
+            rate = finished / elapsed if elapsed else 0.0
+            self.stdout.write(f'Downloaded {finished} image(s) in '
+                              f'{elapsed:.1f}s ({rate:.1f} images/s)')
+
+        report = import_report(batch)
+        for error in report['errors']:
+            self.stdout.write(f'line {error["line"]}: {error["url"]} '
+                              f'{error["error"]}')
+        for error in report['download_errors']:
+            self.stdout.write(f'download: {error["url"]} {error["error"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Import {batch.id}: {report["created"]} created, '
+            f'{report["skipped"]} skipped, {report["failed"]} failed; '
+            f'downloads: {report["downloads"]}'))
+
+    def progress(self, batch):
+        self.stdout.write(f'  {batch.processed} record(s) processed')
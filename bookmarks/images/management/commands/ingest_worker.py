@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from images.ingest import run_pool, queue_stats
+
+
+class Command(BaseCommand):
+    """
+    Запустить пул обработчиков очереди скачивания изображений.
+    Число потоков по умолчанию задается настроечным параметром INGEST_WORKERS.
+    С флагом --stats команда только выводит состояние очереди.
+    """
+    help = 'Run background workers that download bookmarked images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=settings.INGEST_WORKERS)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when the queue is empty')
+        parser.add_argument('--stats', action='store_true',
+                            help='Print queue depth and worker count')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            for name, value in queue_stats().items():
+                self.stdout.write(f'{name}: {value}')
+            return
+        self.stdout.write(f'Starting {options["workers"]} ingest worker(s)')
+        run_pool(options['workers'],
+                 poll_interval=options['poll_interval'],
+                 once=options['once'])
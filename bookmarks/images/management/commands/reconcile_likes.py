@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from images.likes import reconcile
+
+
+class Command(BaseCommand):
+    """
+    Пересчитать денормализованное поле total_likes по таблице лайков,
+    например после ручных правок базы данных.
+    """
+    help = 'Recompute Image.total_likes from the likes table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        fixed = reconcile(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Fixed total_likes for {fixed} image(s)'))
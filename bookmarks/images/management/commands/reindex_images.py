@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from images.models import Image
+from images.search import search_backend
+
+
+class Command(BaseCommand):
+    """
+    Перестроить поисковый индекс изображений. Таблица читается порциями
+    по --chunk-size строк (только id, заголовок и описание), поэтому память
+    не зависит от числа изображений. Индекс заменяется в одной транзакции:
+    пока команда работает, поиск видит прежний индекс.
+    """
+    help = 'Rebuild the full-text search index of images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        rows = Image.objects.order_by('id')\
+            .values_list('id', 'title', 'description')
+        total = 0
+        with transaction.atomic():
+            search_backend.clear()
+            chunk = []
+            for row in rows.iterator(chunk_size=chunk_size):
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    search_backend.index(chunk)
+                    total += len(chunk)
+                    chunk = []
+            search_backend.index(chunk)
+            total += len(chunk)
+        search_backend.optimize()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} image(s)'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from images.ranking import update_rankings
+
+
+class Command(BaseCommand):
+    """
+    Пересчитать скользящие рейтинги (24h, 7d, 30d) и trending.
+    Команду следует запускать по расписанию, например раз в 5 минут из cron.
+    """
+    help = 'Rebuild rolling and trending image rankings in Redis'
+
+    def handle(self, *args, **options):
+        update_rankings()
+        self.stdout.write(self.style.SUCCESS('Rankings updated'))
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='image',
+            old_name='user_like',
+            new_name='users_like',
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='total_likes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(upload_to='images/%Y/%m/%d/'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['-total_likes'], name='images_imag_total_l_0bcd7e_idx'),
+        ),
+    ]
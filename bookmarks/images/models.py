@@ -4,6 +4,23 @@ from django.utils.text import slugify
 from django.urls import reverse
 
 
+class Blob(models.Model):
+    """
+    Файл изображения, сохраненный один раз под своим хеш-значением SHA-256.
+    Несколько объектов Image с одинаковым содержимым ссылаются на один Blob
+    и, следовательно, на один файл и одни миниатюры. Поле ref_count хранит
+    число ссылок; файл удаляется вместе с последней ссылкой (см. images/blobs.py).
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    file = models.FileField(max_length=255)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.digest
+
+
 class Image(models.Model):
     """
         Это модель, которая будет использоваться для хранения изображений на
@@ -21,10 +38,17 @@ class Image(models.Model):
             • url: изначальный URL-адрес этого изображения. Мы используем max_
             length, чтобы определить максимальную длину, равную 2000 символов;
             • image: файл изображения;
+            • blob: общий для одинаковых изображений файл, сохраненный под хеш-значением содержимого;
             • description: опциональное описание изображения;
             • created: дата и время, когда объект был создан в базе данных. Мы добавили auto_now_add,
-         чтобы устанавливать текущее время/дату автоматически при создании объекта.
+         чтобы устанавливать текущее время/дату автоматически при создании объекта;
+            • status: состояние скачивания файла фоновым обработчиком (см. images/ingest.py).
     """
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        READY = 'ready', 'Ready'
+        FAILED = 'failed', 'Failed'
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              related_name='images_created',
                              on_delete=models.CASCADE)
@@ -32,7 +56,15 @@ class Image(models.Model):
     slug = models.SlugField(max_length=200,
                             blank=True)
     url = models.URLField(max_length=2000)
-    image = models.ImageField(upload_to='images/%Y/%m/%d/')
+    # Пока изображение скачивается фоновым обработчиком, файла еще нет
+    image = models.ImageField(upload_to='images/%Y/%m/%d/',
+                              blank=True)
+    # Общий файл изображения; image указывает на тот же путь, что и blob.file
+    blob = models.ForeignKey(Blob,
+                             related_name='images',
+                             null=True,
+                             blank=True,
+                             on_delete=models.PROTECT)
     description = models.TextField(blank=True)
     created = models.DateTimeField(auto_now_add=True)
     # В данном случае понадобится взаимосвязь многие-ко-многим, поскольку пользователю может
@@ -44,6 +76,9 @@ class Image(models.Model):
                                         related_name='images_liked',
                                         blank=True)
     total_likes = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10,
+                              choices=Status.choices,
+                              default=Status.READY)
 
     class Meta:
         # Индексы базы данных повышают производительность запросов.
@@ -74,3 +109,103 @@ class Image(models.Model):
 
     def __str__(self):
         return self.title
+
+
+class IngestJob(models.Model):
+    """
+    Задание очереди на скачивание изображения по его изначальному URL-адресу.
+    Очередь хранится в базе данных: обработчики забирают задания
+    командой ingest_worker, неудачные попытки повторяются с растущей
+    задержкой, а поле host позволяет ограничивать число одновременных
+    скачиваний с одного сайта.
+    """
+    class State(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    image = models.OneToOneField(Image,
+                                 related_name='ingest_job',
+                                 on_delete=models.CASCADE)
+    host = models.CharField(max_length=255)
+    state = models.CharField(max_length=10,
+                             choices=State.choices,
+                             default=State.QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField()
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    # Импорт закладок, создавший задание (см. images/bulk_import.py)
+    batch = models.ForeignKey('ImportBatch',
+                              related_name='jobs',
+                              null=True,
+                              blank=True,
+                              on_delete=models.SET_NULL)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'run_after']),
+            models.Index(fields=['state', 'host']),
+        ]
+        ordering = ['run_after']
+
+    def __str__(self):
+        return f'{self.image_id} {self.state}'
+
+
+class ImportBatch(models.Model):
+    """
+    Импорт закладок пользователя из файла CSV, JSONL или экспорта закладок
+    браузера (см. images/bulk_import.py). Поле processed хранит число уже
+    обработанных записей файла: прогресс сохраняется в одной транзакции
+    с каждой пачкой изображений, поэтому прерванный импорт продолжается
+    с первой необработанной записи. Файл, загруженный через сайт,
+    хранится в поле file до конца импорта; такой импорт ставится в
+    очередь (QUEUED) и выполняется обработчиком очереди скачивания,
+    который отмечает locked_at после каждой пачки.
+    """
+    class State(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             related_name='image_imports',
+                             on_delete=models.CASCADE)
+    source = models.CharField(max_length=255)
+    format = models.CharField(max_length=10)
+    state = models.CharField(max_length=10,
+                             choices=State.choices,
+                             default=State.RUNNING)
+    processed = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    file = models.FileField(upload_to='imports/%Y/%m/%d/', blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.source} ({self.state})'
+
+
+class ImportItemError(models.Model):
+    """
+    Запись файла импорта, которая не была добавлена: ошибка разбора
+    или недопустимые данные. line - номер строки в файле.
+    """
+    batch = models.ForeignKey(ImportBatch,
+                              related_name='errors',
+                              on_delete=models.CASCADE)
+    line = models.PositiveIntegerField()
+    url = models.CharField(max_length=2000, blank=True)
+    error = models.TextField()
+
+    class Meta:
+        ordering = ['line']
+
+    def __str__(self):
+        return f'{self.line}: {self.error}'
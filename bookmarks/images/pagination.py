@@ -0,0 +1,91 @@
+import base64
+import datetime
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class CursorPage:
+    """
+    Страница результатов постраничной разбивки по ключу (keyset pagination).
+    В отличие от Paginator, здесь не выполняется запрос COUNT(*) и не
+    используется OFFSET: следующая страница выбирается условием
+    WHERE по значениям последней строки, поэтому стоимость любой страницы
+    одинакова. next_cursor - непрозрачный токен для запроса следующей страницы.
+    """
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def encode_cursor(values):
+    # Дата и время сохраняются с микросекундами: DjangoJSONEncoder
+    # округляет их до миллисекунд, и строки на границе страниц терялись бы
+    values = [value.isoformat() if isinstance(value, datetime.datetime)
+              else value for value in values]
+    data = json.dumps(values)
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    # Вернуть список значений курсора либо None, если токен поврежден
+    if not token:
+        return None
+    try:
+        padding = '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(token + padding))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _after(ordering, values):
+    # Условие "строго после курсора" для сортировки ordering:
+    # (a < x) OR (a = x AND b < y) OR ... (для полей по возрастанию - >)
+    fields = [field.lstrip('-') for field in ordering]
+    condition = Q()
+    for i, field in enumerate(ordering):
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        step = Q(**{f'{fields[i]}__{lookup}': values[i]})
+        for prev_field, prev_value in zip(fields[:i], values[:i]):
+            step &= Q(**{prev_field: prev_value})
+        condition |= step
+    return condition
+
+
+def cursor_paginate(queryset, cursor, per_page, ordering=('-created', '-id')):
+    """
+    Вернуть страницу queryset, отсортированного по полям ordering
+    (дефис перед именем поля - по убыванию), начиная с позиции cursor.
+    Последнее поле должно быть уникальным (по умолчанию id), чтобы
+    разрешать совпадения значений предыдущих полей.
+    """
+    ordering = list(ordering)
+    queryset = queryset.order_by(*ordering)
+    values = decode_cursor(cursor)
+    if values and len(values) == len(ordering):
+        try:
+            queryset = queryset.filter(_after(ordering, values))
+        except (ValidationError, ValueError, TypeError):
+            # Поврежденный курсор - вернуть первую страницу
+            pass
+    # Выбрать на одну строку больше, чтобы узнать, есть ли следующая страница
+    object_list = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(object_list) > per_page:
+        object_list = object_list[:per_page]
+        last = object_list[-1]
+        next_cursor = encode_cursor([getattr(last, field.lstrip('-'))
+                                     for field in ordering])
+    return CursorPage(object_list, next_cursor)
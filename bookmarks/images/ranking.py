@@ -0,0 +1,121 @@
+"""
+Рейтинги изображений по просмотрам. Помимо общего рейтинга за все время,
+каждый просмотр попадает в почасовое и посуточное сортированные множества.
+Скользящие рейтинги за 24 часа, 7 и 30 дней собираются из них командой
+ZUNIONSTORE, а рейтинг "trending" складывает просмотры последних часов с
+затухающими весами и лайки изображения. Все рейтинги пересчитываются
+по расписанию командой update_rankings, а не при каждом запросе: запрос
+читает последний собранный снимок. ZUNIONSTORE по пустым корзинам не
+создает ключ, поэтому время пересчета хранится в отдельном ключе
+UPDATED_KEY; по нему пустой рейтинг отличается от еще не собранного.
+"""
+
+import datetime
+import logging
+from django.conf import settings
+from django.utils import timezone
+from bookmarks.redis_client import pipeline, r
+from .models import Image
+
+RANKING_KEY = 'image_ranking'
+UPDATED_KEY = f'{RANKING_KEY}:updated'
+TRENDING = 'trending'
+# Скользящие периоды: (размер корзины, число корзин)
+PERIODS = {
+    '24h': ('hour', 24),
+    '7d': ('day', 7),
+    '30d': ('day', 30),
+}
+# Корзины хранятся чуть дольше самого длинного периода, который из них
+# собирается, после чего удаляются Redis автоматически
+HOUR_TTL = 60 * 60 * (settings.RANKING_TRENDING_HOURS + 2)
+DAY_TTL = 60 * 60 * 24 * 31
+
+logger = logging.getLogger(__name__)
+
+
+def hour_key(moment):
+    return f'{RANKING_KEY}:hour:{moment:%Y%m%d%H}'
+
+
+def day_key(moment):
+    return f'{RANKING_KEY}:day:{moment:%Y%m%d}'
+
+
+def period_key(period):
+    return f'{RANKING_KEY}:{period}'
+
+
+def add_views(pipe, image_id, count=1, now=None):
+    # Добавить просмотры в общий рейтинг и в корзины текущего часа и дня
+    now = now or timezone.now()
+    pipe.zincrby(RANKING_KEY, count, image_id)
+    for key, ttl in ((hour_key(now), HOUR_TTL), (day_key(now), DAY_TTL)):
+        pipe.zincrby(key, count, image_id)
+        pipe.expire(key, ttl)
+
+
+def _bucket_keys(size, count, now):
+    step = datetime.timedelta(hours=1) if size == 'hour' \
+        else datetime.timedelta(days=1)
+    key = hour_key if size == 'hour' else day_key
+    return [key(now - step * i) for i in range(count)]
+
+
+def _trending(pipe, now):
+    """
+    Рейтинг trending: просмотры за последние RANKING_TRENDING_HOURS часов,
+    где вес корзины убывает вдвое каждые RANKING_HALF_LIFE_HOURS часов,
+    плюс лайки изображения с весом RANKING_LIKE_WEIGHT, затухающие
+    с возрастом изображения.
+    """
+    half_life = settings.RANKING_HALF_LIFE_HOURS
+    hours = settings.RANKING_TRENDING_HOURS
+    weights = {}
+    for i in range(hours):
+        weights[hour_key(now - datetime.timedelta(hours=i))] = \
+            0.5 ** (i / half_life)
+    since = now - datetime.timedelta(hours=hours)
+    likes_key = f'{RANKING_KEY}:likes'
+    likes = {}
+    recent = Image.objects.filter(created__gte=since, total_likes__gt=0)\
+        .values_list('id', 'total_likes', 'created')
+    for image_id, total_likes, created in recent.iterator():
+        age = (now - created).total_seconds() / 3600
+        likes[image_id] = total_likes * 0.5 ** (age / half_life)
+    pipe.delete(likes_key)
+    if likes:
+        pipe.zadd(likes_key, likes)
+        weights[likes_key] = settings.RANKING_LIKE_WEIGHT
+    pipe.zunionstore(period_key(TRENDING), weights)
+    pipe.delete(likes_key)
+
+
+def update_rankings(now=None):
+    """
+    Пересчитать скользящие рейтинги и trending одним конвейером.
+    Вызывается по расписанию командой update_rankings.
+    """
+    now = now or timezone.now()
+    with pipeline(transaction=True) as pipe:
+        for period, (size, count) in PERIODS.items():
+            pipe.zunionstore(period_key(period),
+                             _bucket_keys(size, count, now))
+        _trending(pipe, now)
+        # метка пересчета: есть, даже если все рейтинги пусты
+        pipe.set(UPDATED_KEY, now.timestamp())
+
+
+def top_ids(period=None, count=10):
+    """
+    Идентификаторы count изображений с наибольшим баллом. Выборка
+    выполняется на стороне Redis, по сети передаются только count элементов.
+    Скользящий рейтинг, который еще не собирался, пуст до ближайшего
+    запуска update_rankings.
+    """
+    key = RANKING_KEY if period is None else period_key(period)
+    ids = r.zrange(key, 0, count - 1, desc=True)
+    if not ids and period is not None and not r.exists(UPDATED_KEY):
+        logger.warning('image rankings have not been built yet; '
+                       'schedule the update_rankings command')
+    return [int(image_id) for image_id in ids]
@@ -0,0 +1,207 @@
+"""
+Полнотекстовый поиск по изображениям. Заголовки и описания хранятся
+в инвертированном индексе; реализация выбирается настройкой SEARCH_BACKEND:
+  • images.search.SQLiteFTSBackend - виртуальная таблица SQLite FTS5
+    в базе данных по умолчанию;
+  • images.search.SimpleBackend - поиск LIKE без индекса для других СУБД
+    и сборок SQLite без FTS5.
+Индекс обновляется сигналами сохранения и удаления Image (см. images/signal.py)
+и перестраивается командой reindex_images. Результаты упорядочены по
+релевантности и разбиваются на страницы по курсору (балл, id).
+"""
+
+import re
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+from django.utils.safestring import mark_safe
+from django.utils.text import Truncator
+from .models import Image
+from .pagination import CursorPage, cursor_paginate, decode_cursor, \
+    encode_cursor
+
+TOKEN_RE = re.compile(r'\w+')
+# Не более стольких слов запроса учитывается при поиске
+MAX_TERMS = 8
+SNIPPET_WORDS = 16
+# Маркеры найденных слов в фрагменте: заменяются на <mark> после
+# экранирования текста, чтобы HTML из описаний не попадал на страницу
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+
+def terms(query):
+    return TOKEN_RE.findall(query.lower())[:MAX_TERMS]
+
+
+def highlight(text):
+    text = escape(text)
+    return mark_safe(text.replace(MARK_START, '<mark>')
+                         .replace(MARK_END, '</mark>'))
+
+
+class SQLiteFTSBackend:
+    """
+    Индекс в виртуальной таблице FTS5, rowid которой совпадает с id
+    изображения. Совпадения в заголовке весят TITLE_WEIGHT совпадений в
+    описании (функция bm25 как встроенный столбец rank). Таблица создается
+    при открытии каждого соединения с базой данных (сигнал
+    connection_created, см. images/apps.py) и после migrate, если ее еще
+    нет; запросы поиска и обновления индекса ее больше не проверяют.
+    """
+    table = 'images_image_fts'
+    TITLE_WEIGHT = 5.0
+
+    def __init__(self, using='default'):
+        self.using = using
+
+    def cursor(self):
+        return connections[self.using].cursor()
+
+    def create_table(self, connection):
+        # Соединение открывается до начала транзакции, поэтому созданная
+        # здесь таблица не исчезнет при откате транзакции запроса или
+        # теста. Если таблица уже есть, выполняется один SELECT
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master "
+                           "WHERE type = 'table' AND name = %s", [self.table])
+            if cursor.fetchone():
+                return
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} '
+                f'USING fts5(title, description, '
+                f"tokenize='unicode61 remove_diacritics 2')")
+            cursor.execute(
+                f'INSERT INTO {self.table}({self.table}, rank) '
+                f"VALUES ('rank', 'bm25({self.TITLE_WEIGHT}, 1.0)')")
+
+    def prepare(self, using):
+        if using == self.using:
+            self.create_table(connections[using])
+
+    def connected(self, connection):
+        if connection.alias == self.using:
+            self.create_table(connection)
+
+    def index(self, rows):
+        # rows - последовательность кортежей (id, title, description)
+        rows = list(rows)
+        if not rows:
+            return
+        with self.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s',
+                               [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table}(rowid, title, description) '
+                f'VALUES (%s, %s, %s)', rows)
+
+    def remove(self, image_ids):
+        with self.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s',
+                               [(image_id,) for image_id in image_ids])
+
+    def clear(self):
+        with self.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+    def optimize(self):
+        # Слить сегменты индекса в один после массовой загрузки
+        with self.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) "
+                           f"VALUES ('optimize')")
+
+    def search(self, query, cursor=None, per_page=20):
+        words = terms(query)
+        if not words:
+            return CursorPage([], None)
+        # Каждое слово - отдельная фраза с поиском по префиксу, поэтому
+        # спецсимволы синтаксиса FTS5 из запроса не интерпретируются
+        expression = ' '.join(f'"{word}"*' for word in words)
+        table = self.table
+        sql = (f'SELECT {table}.rowid, {table}.rank, '
+               f"snippet({table}, -1, %s, %s, '…', {SNIPPET_WORDS}) "
+               f'FROM {table} '
+               f'JOIN {Image._meta.db_table} i ON i.id = {table}.rowid '
+               f'WHERE {table} MATCH %s AND i.status = %s')
+        params = [MARK_START, MARK_END, expression, Image.Status.READY]
+        values = decode_cursor(cursor)
+        if values and len(values) == 2:
+            sql += (f' AND ({table}.rank > %s OR '
+                    f'({table}.rank = %s AND {table}.rowid > %s))')
+            params += [values[0], values[0], values[1]]
+        sql += f' ORDER BY {table}.rank, {table}.rowid LIMIT %s'
+        params.append(per_page + 1)
+        with self.cursor() as db_cursor:
+            db_cursor.execute(sql, params)
+            rows = db_cursor.fetchall()
+        next_cursor = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            next_cursor = encode_cursor([rows[-1][1], rows[-1][0]])
+        images = Image.objects.select_related('user')\
+            .in_bulk([row[0] for row in rows])
+        results = []
+        for image_id, rank, snippet in rows:
+            image = images.get(image_id)
+            if image is not None:
+                image.snippet = highlight(snippet)
+                results.append(image)
+        return CursorPage(results, next_cursor)
+
+
+class SimpleBackend:
+    """
+    Поиск без индекса: каждое слово ищется в заголовке или описании
+    условием LIKE, результаты упорядочены по дате добавления.
+    """
+
+    def prepare(self, using):
+        pass
+
+    def connected(self, connection):
+        pass
+
+    def index(self, rows):
+        pass
+
+    def remove(self, image_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def optimize(self):
+        pass
+
+    def search(self, query, cursor=None, per_page=20):
+        words = terms(query)
+        if not words:
+            return CursorPage([], None)
+        condition = Q()
+        for word in words:
+            condition &= Q(title__icontains=word) | \
+                Q(description__icontains=word)
+        images = Image.objects.filter(condition,
+                                      status=Image.Status.READY)\
+            .select_related('user')
+        page = cursor_paginate(images, cursor, per_page)
+        for image in page:
+            image.snippet = escape(Truncator(image.description or
+                                             image.title)
+                                   .words(SNIPPET_WORDS))
+        return page
+
+
+search_backend = import_string(settings.SEARCH_BACKEND)()
+
+
+def prepare_index(using, **kwargs):
+    # Обработчик post_migrate (см. images/apps.py)
+    search_backend.prepare(using)
+
+
+def prepare_connection(connection, **kwargs):
+    # Обработчик connection_created (см. images/apps.py)
+    search_backend.connected(connection)
@@ -1,13 +1,68 @@
-from django.db.models.signals import m2m_changed
+from django.db.models.signals import m2m_changed, post_delete, post_save, \
+    pre_save
 from django.dispatch import receiver
 from .models import Image
+from .blobs import release
+from .thumbnails import file_changed, schedule
+from .likes import change_likes, liked_pairs
+from .search import search_backend
+from .http_cache import forget, touch
 
 
 @receiver(m2m_changed, sender=Image.users_like.through)
-def user_like_changed(sender, instance, **kwargs):
+def user_like_changed(sender, instance, action, reverse, pk_set, **kwargs):
     # Сперва, используя декоратор receiver(), в качестве функции-получателя
     # регистрируется функция users_like_changed. Она привязывается к сигналу
     # m2m_changed. Затем эта функция соединяется с Image.users_like.through, чтобы
     # функция вызывалась только в том случае, если сигнал m2m_changed был запущен этим отправителем.
-    instance.total_likes = instance.users_like.count()
-    instance.save()
+    # Счетчик total_likes изменяется атомарным UPDATE с выражением F()
+    # вместо COUNT и полного сохранения изображения. При добавлении pk_set
+    # содержит только действительно добавленные связи; для удаления
+    # существующие связи запоминаются на этапе pre_.
+    # Кешированные страницы изображений с изменившимися лайками
+    # становятся недействительными (см. images/http_cache.py); в списке
+    # лайки не видны, поэтому метка списка и карточки не меняются.
+    if action == 'post_add':
+        image_ids = pk_set if reverse else [instance.pk] * len(pk_set)
+        change_likes(image_ids, 1)
+        if image_ids:
+            touch(image_ids, list_changed=False)
+    elif action in ('pre_remove', 'pre_clear'):
+        instance._removed_likes = liked_pairs(instance, reverse, pk_set)
+    elif action in ('post_remove', 'post_clear'):
+        image_ids = getattr(instance, '_removed_likes', [])
+        change_likes(image_ids, -1)
+        if image_ids:
+            touch(image_ids, list_changed=False)
+        instance._removed_likes = []
+
+
+@receiver(post_delete, sender=Image)
+def image_deleted(sender, instance, **kwargs):
+    # Освободить общий файл изображения; файл и миниатюры удаляются,
+    # когда на него не остается ссылок
+    if instance.blob_id:
+        release(instance.blob_id)
+    search_backend.remove([instance.pk])
+    forget([instance.pk])
+
+
+@receiver(pre_save, sender=Image)
+def image_saving(sender, instance, **kwargs):
+    # Запомнить, загружен ли новый файл: после сохранения это уже не видно
+    instance._image_changed = file_changed(instance.image)
+
+
+@receiver(post_save, sender=Image)
+def image_saved(sender, instance, update_fields=None, **kwargs):
+    # Поставить в очередь миниатюры загруженного файла; скачанные файлы
+    # обрабатывает сам обработчик очереди скачивания (images/ingest.py)
+    if instance._image_changed:
+        schedule(instance.image)
+    # Обновить поисковый индекс, если изменился заголовок или описание
+    if update_fields is None or \
+            {'title', 'description'} & set(update_fields):
+        search_backend.index([(instance.pk, instance.title,
+                               instance.description)])
+    # Кешированные страницы и карточка изображения устарели
+    touch([instance.pk])
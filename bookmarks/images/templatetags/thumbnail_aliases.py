@@ -0,0 +1,11 @@
+from django import template
+from images import thumbnails
+
+register = template.Library()
+
+
+@register.filter
+def alias_url(field_file, alias):
+    # {{ image.image|alias_url:"list" }} - URL-адрес заранее созданной
+    # миниатюры без обращения к хранилищу (см. images/thumbnails.py)
+    return thumbnails.alias_url(field_file, alias)
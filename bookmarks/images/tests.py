@@ -1,3 +1,686 @@
-from django.test import TestCase
+import datetime
+import tempfile
+import threading
+import time
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import urlencode
+import redis
+from PIL import Image as PILImage
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, \
+    override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.files import get_thumbnailer
+from account.models import Profile
+from bookmarks.redis_client import pipeline, r
+from bookmarks.testing import QueryCountTestCase, TEST_SETTINGS
+from .counters import BatchedViewCounter, views_key
+from . import blobs, bulk_import, downloader, ingest
+from .models import Blob, Image, ImportBatch
+from .search import search_backend
+from . import http_cache, ranking, thumbnails, views
 
-# Create your tests here.
+
+class ImageViewQueriesTest(QueryCountTestCase):
+    """
+    Число запросов представлений images.urls не зависит от числа
+    изображений, лайков и лайкнувших пользователей.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('subject')
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        self.image = self.create_image('Sea')
+
+    def create_image(self, title, **kwargs):
+        return Image.objects.create(user=self.user, title=title,
+                                    url=f'https://example.com/{title}.png',
+                                    image='images/sea.png',
+                                    status=Image.Status.READY, **kwargs)
+
+    def get(self, name, *args, **params):
+        def request():
+            response = self.client.get(reverse(name, args=args), params)
+            self.assertEqual(response.status_code, 200)
+            # потоковые ответы формируются при чтении
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return request
+
+    def test_image_list(self):
+        self.assertConstantQueries(self.get('images:list'), self.user)
+
+    def test_image_list_scroll(self):
+        self.assertConstantQueries(self.get('images:list', images_only=1),
+                                   self.user)
+
+    def test_image_list_pages(self):
+        self.assertConstantQueries(self.get('images:list', page=1),
+                                   self.user)
+
+    def test_image_detail(self):
+        self.assertConstantQueries(
+            self.get('images:detail', self.image.id, self.image.slug),
+            self.user)
+
+    def test_image_likers(self):
+        self.assertConstantQueries(self.get('images:likers', self.image.id),
+                                   self.user)
+
+    def test_image_ranking(self):
+        self.assertConstantQueries(self.get('images:ranking'), self.user)
+
+    def test_image_search(self):
+        self.assertConstantQueries(self.get('images:search', q='image'),
+                                   self.user)
+
+    def test_image_create_form(self):
+        self.assertConstantQueries(
+            self.get('images:create', url='https://example.com/a.png',
+                     title='A'),
+            self.user)
+
+    def test_image_import_form(self):
+        ImportBatch.objects.create(user=self.user, source='a.csv',
+                                   format='csv')
+        self.assertConstantQueries(self.get('images:import'), self.user)
+
+    def test_import_status(self):
+        batch = ImportBatch.objects.create(user=self.user, source='a.csv',
+                                           format='csv')
+        self.assertConstantQueries(self.get('images:import_status',
+                                            batch.id),
+                                   self.user)
+
+    def test_image_export(self):
+        self.assertConstantQueries(self.get('images:export'), self.user)
+
+    def test_image_status(self):
+        self.assertConstantQueries(self.get('images:status', self.image.id),
+                                   self.user)
+
+    def test_stats(self):
+        for name in ('images:ingest_stats', 'images:counter_stats',
+                     'images:cache_stats'):
+            with self.subTest(name):
+                self.assertConstantQueries(self.get(name), self.user)
+
+    def test_image_views(self):
+        def view():
+            response = self.client.post(reverse('images:views',
+                                                args=[self.image.id]))
+            self.assertEqual(response.status_code, 200)
+        self.assertConstantQueries(view, self.user)
+
+    def test_image_like(self):
+        images = iter([self.create_image(f'Like {n}') for n in range(3)])
+
+        def like():
+            response = self.client.post(reverse('images:like'),
+                                        {'id': next(images).id,
+                                         'action': 'like'})
+            self.assertEqual(response.json()['status'], 'ok')
+        self.assertConstantQueries(like, self.user)
+
+    def test_image_like_bulk(self):
+        batches = iter([[self.create_image(f'Bulk {n} {i}').id
+                         for i in range(5)] for n in range(3)])
+
+        def like():
+            response = self.client.post(reverse('images:like_bulk'),
+                                        {'like': next(batches)})
+            self.assertEqual(len(response.json()['liked']), 5)
+        self.assertConstantQueries(like, self.user)
+
+
+@override_settings(**TEST_SETTINGS)
+class ImageSignalsTest(TestCase):
+
+    def setUp(self):
+        r.flushdb()
+        self.user = User.objects.create_user('ann', password='password')
+        Profile.objects.create(user=self.user)
+        self.other = User.objects.create_user('bob')
+        self.image = Image.objects.create(user=self.user, title='Red car',
+                                          url='https://example.com/car.png',
+                                          image='images/car.png',
+                                          status=Image.Status.READY)
+
+    def total_likes(self):
+        return Image.objects.get(id=self.image.id).total_likes
+
+    def test_total_likes_follow_likes(self):
+        self.image.users_like.add(self.user, self.other)
+        self.assertEqual(self.total_likes(), 2)
+        # повторный лайк не учитывается
+        self.image.users_like.add(self.user)
+        self.assertEqual(self.total_likes(), 2)
+        self.image.users_like.remove(self.other)
+        self.assertEqual(self.total_likes(), 1)
+        self.image.users_like.clear()
+        self.assertEqual(self.total_likes(), 0)
+
+    def test_total_likes_reverse_side(self):
+        self.other.images_liked.add(self.image)
+        self.assertEqual(self.total_likes(), 1)
+        self.other.images_liked.clear()
+        self.assertEqual(self.total_likes(), 0)
+
+    def test_search_index_follows_image(self):
+        self.assertEqual([image.id for image
+                          in search_backend.search('car')], [self.image.id])
+        self.image.title = 'Blue bike'
+        self.image.save()
+        self.assertEqual(list(search_backend.search('car')), [])
+        self.image.delete()
+        self.assertEqual(list(search_backend.search('bike')), [])
+
+    def test_search_index_table_checked_on_connect(self):
+        # Таблица индекса проверяется при открытии соединения: соединение
+        # другого потока не изменяет базу данных, а обращения к индексу
+        # в этом потоке не повторяют создание таблицы
+        errors = []
+
+        def other_thread():
+            try:
+                search_backend.cursor().close()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        thread.join()
+        self.assertEqual(errors, [])
+        with CaptureQueriesContext(connection) as queries:
+            search_backend.index([(self.image.id, 'Red car', '')])
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'sqlite_master' in query['sql'] or
+                          'CREATE' in query['sql']])
+
+    def test_page_cache_invalidated(self):
+        self.client.force_login(self.user)
+        url = self.image.get_absolute_url()
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                         .status_code, 304)
+        self.image.users_like.add(self.other)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+    def test_stamps(self):
+        list_stamp = cache.get(http_cache.LIST_KEY)
+        image_stamp = cache.get(http_cache.image_key(self.image.id))
+        cache.set(http_cache.card_key(self.image.id), 'card')
+        # лайки в списке не видны: меняется только метка изображения
+        self.image.users_like.add(self.other)
+        self.assertEqual(cache.get(http_cache.LIST_KEY), list_stamp)
+        self.assertNotEqual(cache.get(http_cache.image_key(self.image.id)),
+                            image_stamp)
+        self.assertEqual(cache.get(http_cache.card_key(self.image.id)),
+                         'card')
+        # запрос несуществующего изображения не создает метку
+        self.assertEqual(self.client.get(reverse('images:detail',
+                                                 args=[0, 'none']))
+                         .status_code, 404)
+        self.assertNotIn(http_cache.image_key(0), cache)
+        self.image.delete()
+        self.assertNotIn(http_cache.image_key(self.image.id), cache)
+        self.assertNotIn(http_cache.card_key(self.image.id), cache)
+
+@override_settings(**TEST_SETTINGS)
+class RankingTest(TestCase):
+
+    def setUp(self):
+        r.flushdb()
+
+    def test_top_ids_reads_snapshot(self):
+        # несобранный рейтинг пуст и не пересчитывается в запросе
+        with self.assertNumQueries(0), self.assertLogs('images.ranking'):
+            self.assertEqual(ranking.top_ids(ranking.TRENDING), [])
+        self.assertFalse(r.exists(ranking.period_key(ranking.TRENDING)))
+        # пустой пересчет оставляет метку времени
+        ranking.update_rankings()
+        self.assertTrue(r.exists(ranking.UPDATED_KEY))
+        with self.assertNoLogs('images.ranking'):
+            self.assertEqual(ranking.top_ids('24h'), [])
+        with pipeline() as pipe:
+            ranking.add_views(pipe, 7)
+        ranking.update_rankings()
+        self.assertEqual(ranking.top_ids('24h'), [7])
+
+@override_settings(**TEST_SETTINGS)
+class BatchedViewCounterTest(SimpleTestCase):
+
+    def test_failed_flush_bounded(self):
+        r.flushdb()
+        counter = BatchedViewCounter(r, None, batch_size=2,
+                                     flush_interval=60, max_pending=3)
+        broken = mock.Mock()
+        broken.execute.side_effect = redis.ConnectionError('down')
+        with mock.patch.object(r, 'pipeline', return_value=broken), \
+                self.assertLogs('images.counters', 'ERROR'):
+            for _ in range(10):
+                counter._add(1) and counter.flush()
+        # одна попытка сброса, затем ожидание flush_interval
+        self.assertEqual(broken.execute.call_count, 1)
+        self.assertEqual(counter.pending_total, 3)
+        self.assertEqual(counter.metrics.dropped, 7)
+        # транзакция не применилась: после восстановления Redis каждый
+        # сохраненный просмотр учитывается один раз
+        counter.flush()
+        self.assertEqual(int(r.get(views_key(1))), 3)
+
+
+@override_settings(INGEST_PER_HOST_LIMIT=2, **TEST_SETTINGS)
+class ClaimJobTest(TestCase):
+
+    def test_per_host_limit_checked_in_claim(self):
+        user = User.objects.create_user('ann')
+        for n in range(3):
+            ingest.enqueue(Image.objects.create(
+                user=user, title=f'{n}', url=f'https://example.com/{n}.png',
+                status=Image.Status.PENDING))
+        # Устаревший снимок занятых сайтов, как у параллельного
+        # обработчика: лимит все равно соблюдается
+        with mock.patch('images.ingest._busy_hosts', return_value=[]):
+            claimed = [ingest.claim_job() for _ in range(3)]
+        self.assertEqual(sum(job is not None for job in claimed), 2)
+        self.assertIsNone(claimed[2])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), **TEST_SETTINGS)
+class ImportQueueTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('ann', password='password')
+        self.client.force_login(self.user)
+
+    def upload(self, **data):
+        lines = [f'{{"url": "https://example.com/{n}.jpg", '
+                 f'"title": "Image {n}"}}' for n in range(3)]
+        upload = SimpleUploadedFile('bookmarks.jsonl',
+                                    '\n'.join(lines).encode())
+        return self.client.post(reverse('images:import'),
+                                {'file': upload, **data})
+
+    def test_upload_is_queued_for_worker(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, 202)
+        batch = ImportBatch.objects.get(user=self.user)
+        status_url = reverse('images:import_status', args=[batch.id])
+        self.assertEqual(response['Location'], status_url)
+        self.assertEqual(response.json()['status_url'], status_url)
+        # в запросе записи не импортируются
+        self.assertEqual(batch.state, ImportBatch.State.QUEUED)
+        self.assertTrue(batch.file)
+        self.assertFalse(Image.objects.exists())
+
+        self.assertTrue(bulk_import.run_next_import())
+        batch.refresh_from_db()
+        self.assertEqual(batch.state, ImportBatch.State.DONE)
+        self.assertEqual(batch.created_count, 3)
+        self.assertFalse(batch.file)
+        self.assertFalse(bulk_import.run_next_import())
+
+    def test_stale_import_requeued_and_resumed(self):
+        self.upload()
+        batch = ImportBatch.objects.get(user=self.user)
+        # обработчик забрал импорт и завершился аварийно
+        ImportBatch.objects.filter(id=batch.id).update(
+            state=ImportBatch.State.RUNNING,
+            locked_at=timezone.now() - datetime.timedelta(days=1))
+        self.assertFalse(bulk_import.run_next_import())
+        ingest.requeue_stale()
+        self.assertTrue(bulk_import.run_next_import())
+        self.assertEqual(Image.objects.count(), 3)
+        # завершенный импорт продолжать нечего
+        self.assertEqual(self.upload(resume=batch.id).status_code, 400)
+
+
+def thumbnail_name(field_file, alias):
+    options = aliases.get(alias, target=thumbnails.target_for(field_file))
+    return get_thumbnailer(field_file).get_thumbnail_name(options)
+
+
+def png_file():
+    f = tempfile.TemporaryFile()
+    PILImage.new('RGB', (4, 4), 'red').save(f, 'PNG')
+    f.seek(0)
+    return f
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), **TEST_SETTINGS)
+class BlobTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('ann')
+        self.image = Image.objects.create(user=self.user, title='Red',
+                                          url='https://example.com/red.png',
+                                          status=Image.Status.PENDING)
+
+    def test_failed_save_keeps_ref_count(self):
+        with mock.patch('images.ingest.download',
+                        side_effect=lambda url: (png_file(), 'png')):
+            with mock.patch.object(Image, 'save',
+                                   side_effect=DatabaseError('locked')):
+                with self.assertRaises(DatabaseError):
+                    ingest.fetch(self.image)
+            self.assertFalse(Blob.objects.exists())
+            # повторная попытка создает ровно одну ссылку
+            ingest.fetch(self.image)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+    def test_release_deletes_file_after_commit(self):
+        blob = blobs.acquire(png_file(), 'png')
+        thumbnailer = get_thumbnailer(default_storage,
+                                      relative_name=blob.file.name)
+        thumbnail = thumbnailer.get_thumbnail({'size': (2, 2)})
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertTrue(blobs.release(blob.id))
+        # до фиксации транзакции файл и миниатюра на месте
+        self.assertTrue(default_storage.exists(blob.file.name))
+        self.assertTrue(default_storage.exists(thumbnail.name))
+        for callback in callbacks:
+            callback()
+        self.assertFalse(default_storage.exists(blob.file.name))
+        self.assertFalse(default_storage.exists(thumbnail.name))
+
+    def test_fetch_generates_thumbnails(self):
+        r.flushdb()
+        with mock.patch('images.ingest.download',
+                        side_effect=lambda url: (png_file(), 'png')):
+            ingest.fetch(self.image)
+        self.image.refresh_from_db()
+        for alias in settings.THUMBNAIL_ALIASES['images.Image.image']:
+            self.assertTrue(default_storage.exists(
+                thumbnail_name(self.image.image, alias)), alias)
+        # скачанный файл не ставится в очередь веб-процессов
+        self.assertFalse(r.exists(thumbnails.QUEUE_KEY))
+
+    def test_uploaded_photo_queued_once(self):
+        r.flushdb()
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = Profile.objects.create(user=self.user)
+            profile.save()
+        self.assertFalse(r.exists(thumbnails.QUEUE_KEY))
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.photo = SimpleUploadedFile('me.png', png_file().read())
+            profile.save()
+            profile.date_of_birth = datetime.date(2000, 1, 1)
+            profile.save()
+        self.assertEqual(r.zcard(thumbnails.QUEUE_KEY), 1)
+        self.assertTrue(thumbnails.run_next())
+        self.assertFalse(thumbnails.run_next())
+        self.assertTrue(default_storage.exists(
+            thumbnail_name(profile.photo, 'people')))
+
+    def test_dedupe_media(self):
+        names = [default_storage.save('images/red.png', png_file())
+                 for _ in range(2)]
+        images = [Image.objects.create(user=self.user, title=name,
+                                       url='https://example.com/red.png',
+                                       image=name)
+                  for name in names]
+        cache.set_many({http_cache.card_key(image.id): 'stale'
+                        for image in images})
+        with mock.patch('images.management.commands.dedupe_media.schedule')\
+                as schedule, \
+                mock.patch('images.blobs.file_digest',
+                           wraps=blobs.file_digest) as file_digest:
+            call_command('dedupe_media', stdout=StringIO())
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        for image in images:
+            image.refresh_from_db()
+            self.assertEqual(image.image.name, blob.file.name)
+        # каждый файл хешируется один раз
+        self.assertEqual(file_digest.call_count, 0)
+        self.assertEqual(schedule.call_count, 2)
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+        # update() не отправляет post_save: карточки удалены командой
+        self.assertEqual(cache.get_many([http_cache.card_key(image.id)
+                                         for image in images]), {})
+
+@override_settings(**TEST_SETTINGS)
+class ImageViewsCounterTest(TestCase):
+    # Учет просмотров: только готовые изображения и только с токеном CSRF
+
+    def setUp(self):
+        r.flushdb()
+        self.user = User.objects.create_user('ann')
+        self.image = Image.objects.create(user=self.user, title='Red car',
+                                          url='https://example.com/car.png',
+                                          image='images/car.png',
+                                          status=Image.Status.READY)
+
+    def post(self, image_id, client=None):
+        return (client or self.client).post(reverse('images:views',
+                                                    args=[image_id]))
+
+    def test_unknown_and_pending_images_rejected(self):
+        pending = Image.objects.create(user=self.user, title='Pending',
+                                       url='https://example.com/p.png',
+                                       status=Image.Status.PENDING)
+        self.assertEqual(self.post(0).status_code, 404)
+        self.assertEqual(self.post(pending.id).status_code, 404)
+        self.assertEqual(self.post(self.image.id).json()['total_views'], 1)
+        self.assertIsNone(r.get(views_key(0)))
+        self.assertIsNone(r.get(views_key(pending.id)))
+
+    def test_csrf_token_required(self):
+        client = Client(enforce_csrf_checks=True)
+        self.assertEqual(self.post(self.image.id, client).status_code, 403)
+        # страница изображения выдает токен для запроса просмотра
+        response = client.get(self.image.get_absolute_url())
+        token = response.context['csrf_token']
+        response = client.post(reverse('images:views',
+                                       args=[self.image.id]),
+                               HTTP_X_CSRFTOKEN=str(token))
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(**TEST_SETTINGS)
+class ImageAsyncViewsTest(TestCase):
+    """
+    Асинхронные представления через обработчик ASGI: те же адреса и
+    ответы JSON, что и у синхронных. Тела POST-запросов передаются
+    в кодировке application/x-www-form-urlencoded: AsyncClient Django 4.1
+    неверно читает тела multipart/form-data.
+    """
+
+    def setUp(self):
+        r.flushdb()
+        self.user = User.objects.create_user('ann', password='password')
+        Profile.objects.create(user=self.user)
+        self.image = Image.objects.create(user=self.user, title='Red car',
+                                          url='https://example.com/car.png',
+                                          image='images/car.png',
+                                          status=Image.Status.READY)
+        self.async_client = AsyncClient()
+        self.client.force_login(self.user)
+        self.async_client.cookies = self.client.cookies
+
+    async def post(self, url, data=None, client=None):
+        return await (client or self.async_client).post(
+            url, urlencode(data or {}),
+            content_type='application/x-www-form-urlencoded')
+
+    def test_urlconf(self):
+        # Под ASGI те же адреса разрешаются в асинхронные варианты
+        for name, args, sync_view, async_view in (
+                ('images:detail', [self.image.id, self.image.slug],
+                 views.image_detail, views.aimage_detail),
+                ('images:views', [self.image.id],
+                 views.image_views, views.aimage_views),
+                ('images:like', [], views.image_like, views.aimage_like)):
+            url = reverse(name, args=args)
+            self.assertIs(resolve(url).func, sync_view)
+            self.assertIs(resolve(url, settings.ASYNC_ROOT_URLCONF).func,
+                          async_view)
+
+    async def test_image_detail(self):
+        response = await self.async_client.get(
+            self.image.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertContains(response, 'Red car')
+
+    async def test_image_views(self):
+        url = reverse('images:views', args=[self.image.id])
+        for total in (1, 2):
+            response = await self.post(url)
+            self.assertEqual(response.json(),
+                             {'id': self.image.id, 'total_views': total})
+
+    async def test_image_like(self):
+        url = reverse('images:like')
+        response = await self.post(url, {'id': self.image.id,
+                                         'action': 'like'})
+        self.assertEqual(response.json(), {'status': 'ok'})
+        image = await Image.objects.aget(id=self.image.id)
+        self.assertEqual(image.total_likes, 1)
+        response = await self.post(url, {'id': self.image.id,
+                                         'action': 'unlike'})
+        self.assertEqual(response.json(), {'status': 'ok'})
+        response = await self.post(url, {'id': 0, 'action': 'like'})
+        self.assertEqual(response.json(), {'status': 'error'})
+
+    async def test_image_like_requires_login_and_post(self):
+        response = await self.post(reverse('images:like'),
+                                   client=AsyncClient())
+        self.assertEqual(response.status_code, 302)
+        response = await self.async_client.get(reverse('images:like'))
+        self.assertEqual(response.status_code, 405)
+
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\0' * 100
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Сайт-заместитель для проверки скачивания
+
+    def do_GET(self):
+        if self.path == '/image.png':
+            self.send_body(PNG)
+        elif self.path == '/page.html':
+            self.send_body(b'<html></html>')
+        elif self.path == '/large.png':
+            # размер не объявлен: ограничение проверяется при скачивании
+            self.send_body(PNG * 100, length=False)
+        elif self.path == '/declared.png':
+            self.send_body(PNG, length=10 ** 9)
+        elif self.path == '/slow.png':
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(PNG[:8])
+            for _ in range(30):
+                time.sleep(0.1)
+                self.wfile.write(b'\0' * 4)
+                self.wfile.flush()
+        elif self.path == '/moved.png':
+            self.redirect('/image.png')
+        elif self.path == '/loop.png':
+            self.redirect('/loop.png')
+
+    def send_body(self, body, length=True):
+        self.send_response(200)
+        if length:
+            self.send_header('Content-Length',
+                             len(body) if length is True else length)
+        self.end_headers()
+        self.wfile.write(body[:len(body) if length is True else None])
+
+    def redirect(self, location):
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', 0)
+        self.end_headers()
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(INGEST_READ_TIMEOUT=1, INGEST_MAX_REDIRECTS=3)
+class DownloaderTest(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever,
+                         daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        downloader.close_sessions()
+        super().tearDownClass()
+
+    def download(self, path, **kwargs):
+        host, port = self.server.server_address
+        tmp, extension = downloader.download(f'http://{host}:{port}{path}',
+                                             **kwargs)
+        with tmp:
+            return tmp.read(), extension
+
+    def test_image(self):
+        self.assertEqual(self.download('/image.png'), (PNG, 'png'))
+
+    def test_signature(self):
+        with self.assertRaises(downloader.NotAnImage):
+            self.download('/page.html')
+
+    def test_size_cap(self):
+        with self.assertRaises(downloader.TooLarge):
+            self.download('/large.png', max_bytes=1000, chunk_size=256)
+        with self.assertRaises(downloader.TooLarge):
+            self.download('/declared.png', max_bytes=1000)
+
+    def test_deadline(self):
+        # данные приходят чаще тайм-аута чтения, но общий срок истекает
+        started = time.monotonic()
+        with self.assertRaises(downloader.DeadlineExceeded):
+            self.download('/slow.png', deadline=0.5, chunk_size=4)
+        self.assertLess(time.monotonic() - started, 1.5)
+
+    def test_redirects(self):
+        self.assertEqual(self.download('/moved.png'), (PNG, 'png'))
+        with self.assertRaises(downloader.PermanentDownloadError):
+            self.download('/loop.png')
+
+    @override_settings(INGEST_MAX_SESSIONS=2)
+    def test_sessions_bounded(self):
+        downloader.close_sessions()
+        first = downloader.get_session('a.example.com')
+        downloader.get_session('b.example.com')
+        downloader.get_session('a.example.com')
+        downloader.get_session('c.example.com')
+        # вытеснен сеанс сайта, к которому дольше всех не обращались
+        self.assertEqual(list(downloader._sessions),
+                         ['a.example.com', 'c.example.com'])
+        self.assertIs(downloader.get_session('a.example.com'), first)
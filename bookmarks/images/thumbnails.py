@@ -0,0 +1,138 @@
+"""
+Заранее генерируемые миниатюры. Реестр именованных размеров (алиасов)
+задается настроечным параметром THUMBNAIL_ALIASES библиотеки easy_thumbnails
+для каждого поля-источника ('images.Image.image', 'account.Profile.photo').
+Миниатюры всех алиасов поля создаются заранее, а шаблоны получают их
+URL-адреса фильтром alias_url без обращения к хранилищу.
+
+Веб-процессы миниатюры не создают. Скачанные изображения обрабатывает
+обработчик очереди скачивания (images/ingest.py) сразу после сохранения
+файла. Для загруженных через формы файлов (фотоснимки профилей)
+schedule() ставит задание в очередь QUEUE_KEY в Redis, и ее разбирают те
+же обработчики, когда заданий скачивания нет. Задание ставится, только
+если в поле загружен новый файл (см. file_changed()), а не при каждом
+сохранении модели.
+"""
+
+import json
+import logging
+import multiprocessing
+import time
+import django
+from django.conf import settings
+from django.db import transaction
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.files import get_thumbnailer
+from bookmarks.redis_client import r
+
+logger = logging.getLogger(__name__)
+
+# Сортированное множество заданий: элемент - JSON [имя файла, цель],
+# балл - время постановки. Одинаковые задания объединяются
+QUEUE_KEY = 'thumbnails:queue'
+
+
+def target_for(field_file):
+    # Цель алиасов для файла поля модели, например 'images.Image.image'
+    return f'{field_file.instance._meta.label}.{field_file.field.name}'
+
+
+def generate(name, target):
+    """
+    Создать все миниатюры, зарегистрированные для target, для файла name.
+    Уже существующие миниатюры повторно не создаются.
+    """
+    thumbnailer = get_thumbnailer(name)
+    options = aliases.all(target, include_global=False)
+    for alias in options.values():
+        thumbnailer.get_thumbnail(alias)
+    return len(options)
+
+
+def _init_process():
+    # Процессы пула запускаются методом spawn и не наследуют
+    # соединения с базой данных родителя, поэтому Django настраивается заново
+    django.setup()
+
+
+def _generate_job(job):
+    name, target = job
+    try:
+        return name, generate(name, target), None
+    except Exception as e:
+        return name, 0, str(e)
+
+
+def _context():
+    return multiprocessing.get_context('spawn')
+
+
+def file_changed(field_file):
+    """
+    Вызывается из обработчика pre_save: True, если в поле загружен новый
+    файл, который сохранится в хранилище вместе с моделью. Сохранение
+    модели без изменения файла миниатюр не требует.
+    """
+    return bool(field_file) and not field_file._committed
+
+
+def schedule(field_file):
+    """
+    Поставить генерацию миниатюр файла поля в очередь обработчиков после
+    фиксации транзакции, чтобы обработчик увидел сохраненные данные.
+    """
+    if not field_file:
+        return
+    job = json.dumps([field_file.name, target_for(field_file)])
+    transaction.on_commit(lambda: r.zadd(QUEUE_KEY, {job: time.time()},
+                                         nx=True))
+
+
+def generate_safely(name, target):
+    # Ошибка создания миниатюр не должна прерывать обработчик очереди
+    name, count, error = _generate_job((name, target))
+    if error:
+        logger.warning('thumbnails for %s failed: %s', name, error)
+    return count
+
+
+def run_next():
+    """
+    Выполнить самое старое задание очереди QUEUE_KEY. Задание забирает
+    тот обработчик, чей ZREM удалил его из очереди. Возвращает False,
+    если очередь пуста.
+    """
+    while True:
+        jobs = r.zrange(QUEUE_KEY, 0, 0)
+        if not jobs:
+            return False
+        if r.zrem(QUEUE_KEY, jobs[0]):
+            generate_safely(*json.loads(jobs[0]))
+            return True
+
+
+def generate_many(jobs, processes=None):
+    """
+    Создать миниатюры для последовательности пар (имя файла, цель)
+    в пуле из processes процессов. Возвращает итератор результатов
+    (имя файла, число алиасов, ошибка или None) по мере готовности.
+    """
+    processes = processes or settings.THUMBNAIL_PROCESSES
+    with _context().Pool(processes, initializer=_init_process) as pool:
+        yield from pool.imap_unordered(_generate_job, jobs, chunksize=16)
+
+
+def alias_url(field_file, alias):
+    """
+    URL-адрес миниатюры алиаса. Имя миниатюры вычисляется из имени
+    исходного файла и параметров алиаса, поэтому хранилище не проверяется;
+    миниатюра должна быть создана заранее функцией generate().
+    """
+    if not field_file:
+        return ''
+    options = aliases.get(alias, target=target_for(field_file))
+    if options is None:
+        return ''
+    thumbnailer = get_thumbnailer(field_file)
+    name = thumbnailer.get_thumbnail_name(options)
+    return thumbnailer.thumbnail_storage.url(name)
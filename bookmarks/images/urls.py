@@ -7,7 +7,18 @@ urlpatterns = [
     path('create/', views.image_create, name='create'),
     path('detail/<int:id>/<slug:slug>/',
          views.image_detail, name='detail'),
+    path('views/<int:id>/', views.image_views, name='views'),
     path('like/', views.image_like, name='like'),
+    path('like/bulk/', views.image_like_bulk, name='like_bulk'),
+    path('likers/<int:id>/', views.image_likers, name='likers'),
     path('', views.image_list, name='list'),
     path('ranking/', views.image_ranking, name='ranking'),
+    path('search/', views.image_search, name='search'),
+    path('import/', views.image_import, name='import'),
+    path('import/<int:id>/', views.import_status, name='import_status'),
+    path('export/', views.image_export, name='export'),
+    path('status/<int:id>/', views.image_status, name='status'),
+    path('ingest/stats/', views.ingest_stats, name='ingest_stats'),
+    path('counters/stats/', views.counter_stats, name='counter_stats'),
+    path('cache/stats/', views.cache_stats, name='cache_stats'),
 ]
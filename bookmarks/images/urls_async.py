@@ -0,0 +1,19 @@
+"""
+Маршруты приложения images под ASGI: страница изображения, учет просмотра
+и лайк обслуживаются асинхронными вариантами представлений, остальные
+маршруты совпадают с images/urls.py. Первый подходящий маршрут выигрывает,
+а имена и адреса у вариантов одинаковые, поэтому reverse() не меняется.
+"""
+
+from django.urls import path
+from . import views
+from .urls import urlpatterns as sync_urlpatterns
+
+app_name = 'images'
+
+urlpatterns = [
+    path('detail/<int:id>/<slug:slug>/',
+         views.aimage_detail, name='detail'),
+    path('views/<int:id>/', views.aimage_views, name='views'),
+    path('like/', views.aimage_like, name='like'),
+] + sync_urlpatterns
@@ -1,22 +1,35 @@
 from django.shortcuts import render, redirect
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, \
+    user_passes_test
 from django.contrib import messages
 from .forms import ImageCreateForm
 from django.shortcuts import get_object_or_404
 from .models import Image
-from django.http import JsonResponse
+from .ingest import enqueue, queue_stats
+from .counters import view_counter
+from . import ranking
+from .likes import ais_liked, alikers_preview, bulk_like, is_liked, \
+    likers_page, likers_preview, MAX_BULK_LIKES
+from django.http import Http404, JsonResponse
+from django.urls import reverse
 from django.views.decorators.http import require_POST
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from bookmarks.async_views import aget_object_or_404, aget_user, \
+    async_login_required, async_require_POST
+from django.http import HttpResponse, StreamingHttpResponse
 from django.core.paginator import Paginator, EmptyPage, \
     PageNotAnInteger
-from actions.utils import create_action
-import redis
-from django.conf import settings
+from actions.utils import acreate_action, create_action, create_actions
+from .pagination import cursor_paginate
+from .search import search_backend
+from .bulk_import import import_report, queue_import, requeue_import
+from .models import ImportBatch
+from . import export
+from . import http_cache
 
-# соединение с redis
-r = redis.Redis(host=settings.REDIS_HOST,
-                port=settings.REDIS_PORT,
-                db=settings.REDIS_DB, )
+IMAGES_PER_PAGE = 8
+SEARCH_RESULTS_PER_PAGE = 20
+RANKING_PERIODS = list(ranking.PERIODS) + [ranking.TRENDING]
 
 
 #  представление image_create был добавлен декоратор login_required, чтобы предотвращать
@@ -38,7 +51,8 @@ def image_create(request):
         3. В новый экземпляр изображения добавляется связь с текущим пользователем,
          который выполняет запрос: new_image.user = request.user. Так
         мы будем знать, кто закачивал каждое изображение.
-        4. Объект Image сохраняется в базе данных.
+        4. Объект Image сохраняется в базе данных со статусом PENDING, и его
+        скачивание ставится в очередь фоновых обработчиков.
         5. Наконец, с помощью встроенного в Django фреймворка сообщений
         создается сообщение об успехе, и пользователь перенаправляется на
         канонический URL-адрес нового изображения. Мы еще не реализовали
@@ -54,7 +68,9 @@ def image_create(request):
             # назначить текущего пользователя элементу
             new_image.user = request.user
             new_image.save()
-            create_action(request, 'bookmarked image', new_image)
+            # скачать файл в фоне, не задерживая ответ
+            enqueue(new_image)
+            create_action(request.user, 'bookmarked image', new_image)
             messages.success(request, 'Image added successfully')
             # перенаправить к представлению детальной
             # информации о только что созданном элементе
@@ -69,24 +85,134 @@ def image_create(request):
                    'form': form})
 
 
+def _detail_etag(request, id, slug):
+    # ETag страницы изображения: метка изображения меняется при его
+    # сохранении и изменении лайков (см. images/http_cache.py). Без метки
+    # (изображения нет или метка истекла) страница прорисовывается
+    if http_cache.has_messages(request):
+        return None
+    list_stamp, image_stamp = http_cache.stamps(request, id)
+    if image_stamp is None:
+        return None
+    return http_cache.make_etag('detail', id, slug, request.user.pk,
+                                image_stamp)
+
+
+def _detail_last_modified(request, id, slug):
+    if http_cache.has_messages(request):
+        return None
+    list_stamp, image_stamp = http_cache.stamps(request, id)
+    if image_stamp is None:
+        return None
+    return http_cache.as_datetime(image_stamp)
+
+
+@http_cache.conditional_page('detail', _detail_etag, _detail_last_modified)
 def image_detail(request, id, slug):
-    # Это представление вывода изображения на страницу
+    # Это представление вывода изображения на страницу.
+    # На условный запрос с совпавшим ETag возвращается ответ 304 без
+    # обращений к базе данных. Число просмотров в HTML не входит:
+    # страница учитывает просмотр и получает итог запросом к image_views,
+    # поэтому просмотры считаются и тогда, когда страница взята из кеша
+    # браузера. Число лайков берется из денормализованного поля
+    # total_likes, состояние лайка текущего пользователя - одним запросом
+    # EXISTS, а на странице выводятся только последние лайкнувшие
+    # пользователи. Метка изображения создается здесь, после того как
+    # изображение найдено, и следующий запрос уже получит ответ 304
     image = get_object_or_404(Image, id=id, slug=slug)
+    http_cache.stamp(image.id)
+    return render(request,
+                  'images/image/detail.html',
+                  {'section': 'images',
+                   'image': image,
+                   'is_liked': is_liked(image, request.user),
+                   'likers': likers_preview(image)})
+
+
+async def _adetail_etag(request, id, slug):
+    if await http_cache.ahas_messages(request):
+        return None
+    list_stamp, image_stamp = await http_cache.astamps(request, id)
+    if image_stamp is None:
+        return None
+    user = await aget_user(request)
+    return http_cache.make_etag('detail', id, slug, user.pk, image_stamp)
+
+
+async def _adetail_last_modified(request, id, slug):
+    if await http_cache.ahas_messages(request):
+        return None
+    list_stamp, image_stamp = await http_cache.astamps(request, id)
+    if image_stamp is None:
+        return None
+    return http_cache.as_datetime(image_stamp)
+
+
+@http_cache.aconditional_page('detail', _adetail_etag, _adetail_last_modified)
+async def aimage_detail(request, id, slug):
+    # Вариант image_detail для ASGI (см. images/urls_async.py): пока идут
+    # запросы к базе данных и Redis, цикл событий обслуживает другие
+    # запросы. Шаблон обращается к базе данных (миниатюры easy_thumbnails,
+    # автор изображения), а синхронные запросы в цикле событий запрещены,
+    # поэтому прорисовка выполняется в потоке
+    image = await aget_object_or_404(Image.objects, id=id, slug=slug)
+    await http_cache.astamp(image.id)
+    user = await aget_user(request)
+    return await sync_to_async(render)(
+        request,
+        'images/image/detail.html',
+        {'section': 'images',
+         'image': image,
+         'is_liked': await ais_liked(image, user),
+         'likers': await alikers_preview(image)})
+
+
+def _viewable(id):
+    # Изображение, просмотры которого учитываются
+    return Image.objects.filter(id=id, status=Image.Status.READY)
+
+
+@require_POST
+def image_views(request, id):
     # увеличить общее число просмотров изображения на 1
-    total_views = r.incr(f'image:{image.id}:views')
-    # Увеличить рейтинг изображения на 1
+    # и рейтинг изображения на 1 (см. images/counters.py): в точном режиме
+    # обе команды уходят одним конвейером, в пакетном - накапливаются
+    # в памяти процесса и сбрасываются в Redis пачками
     # Команда zincrby() используется для сохранения просмотров изображений
     # в сортированном множестве с ключом image:ranking. В нем будут храниться
     # id изображения и соответствующий балл, равный 1, который будет добавлен
     # к общему баллу этого элемента сортированного множества. Такой подход
     # позволит отслеживать все просмотры изображений в глобальном масштабе
     # и иметь сортированное множество, упорядоченное по общему числу просмотров.
-    r.zincrby('image_ranking', 1, image.id)
-    return render(request,
-                  'images/image/detail.html',
-                  {'section': 'images',
-                   'image': image,
-                   'total_views': total_views})
+    # Запрос отправляет страница изображения (detail.html) при каждом
+    # показе вместе с токеном CSRF. Учитываются просмотры только
+    # существующих готовых изображений: запрос EXISTS по первичному ключу
+    # не дает накручивать рейтинг произвольным id
+    if not _viewable(id).exists():
+        raise Http404('No viewable image matches the given query.')
+    total_views = view_counter.record(id)
+    return JsonResponse({'id': id, 'total_views': total_views})
+
+
+@async_require_POST
+async def aimage_views(request, id):
+    # Вариант image_views для ASGI: команды отправляются клиентом
+    # redis.asyncio
+    if not await _viewable(id).aexists():
+        raise Http404('No viewable image matches the given query.')
+    total_views = await view_counter.arecord(id)
+    return JsonResponse({'id': id, 'total_views': total_views})
+
+
+def image_likers(request, id):
+    # Полный список лайкнувших пользователей, по странице на запрос
+    image = get_object_or_404(Image, id=id)
+    likers, next_cursor = likers_page(image, request.GET.get('cursor'))
+    response = render(request,
+                      'images/image/likers.html',
+                      {'likers': likers})
+    response['X-Next-Cursor'] = next_cursor or ''
+    return response
 
 
 # В новом представлении использованы два декоратора. Декоратор login_required
@@ -113,7 +239,71 @@ def image_like(request):
     return JsonResponse({'status': 'error'})
 
 
+@async_login_required
+@async_require_POST
+async def aimage_like(request):
+    # Вариант image_like для ASGI. Связь users_like изменяется в потоке:
+    # обработчики сигнала m2m_changed (счетчик total_likes, метки кеша
+    # страниц) синхронные, а асинхронных методов связанных менеджеров
+    # в Django 4.1 нет. Изображение загружается, а действие записывается
+    # и рассылается в ленты асинхронно
+    image_id = request.POST.get('id')
+    action = request.POST.get('action')
+    if image_id and action:
+        user = await aget_user(request)
+        try:
+            image = await Image.objects.aget(id=image_id)
+            if action == 'like':
+                await sync_to_async(image.users_like.add)(user)
+                await acreate_action(user, 'likes', image)
+            else:
+                await sync_to_async(image.users_like.remove)(user)
+            return JsonResponse({'status': 'ok'})
+        except Image.DoesNotExist:
+            pass
+    return JsonResponse({'status': 'error'})
+
+
+@login_required
+@require_POST
+def image_like_bulk(request):
+    # Пакетные лайки для клиентов, которые копят действия пользователя:
+    # POST-параметры like и unlike содержат списки id изображений
+    try:
+        like_ids = [int(id) for id in request.POST.getlist('like')]
+        unlike_ids = [int(id) for id in request.POST.getlist('unlike')]
+    except ValueError:
+        return JsonResponse({'status': 'error'})
+    if len(like_ids) + len(unlike_ids) > MAX_BULK_LIKES:
+        return JsonResponse({'status': 'error'})
+    liked, unliked = bulk_like(request.user, like_ids, unlike_ids)
+    create_actions((request.user, 'likes', image)
+                   for image in Image.objects.filter(id__in=liked))
+    return JsonResponse({'status': 'ok',
+                         'liked': liked,
+                         'unliked': unliked})
+
+
+def _list_etag(request):
+    # ETag списка: общая метка меняется при создании, изменении и удалении
+    # любого изображения и при изменении лайков; параметры страницы
+    # входят в ETag через полный путь запроса
+    if http_cache.has_messages(request):
+        return None
+    list_stamp, = http_cache.stamps(request)
+    return http_cache.make_etag('list', request.user.pk,
+                                request.get_full_path(), list_stamp)
+
+
+def _list_last_modified(request):
+    if http_cache.has_messages(request):
+        return None
+    list_stamp, = http_cache.stamps(request)
+    return http_cache.as_datetime(list_stamp)
+
+
 @login_required
+@http_cache.conditional_page('list', _list_etag, _list_last_modified)
 def image_list(request):
     """
     В этом представлении создается набор запросов QuerySet, чтобы извлекать
@@ -122,7 +312,9 @@ def image_list(request):
          Извлекается HTTP GET-параметр page, чтобы получить запрошенный
         номер страницы. Извлекается HTTP GET-параметр images_only, чтобы узнать,
         должна ли прорисовываться вся страница целиком или же только новые
-        изображения. Мы будем прорисовывать всю страницу целиком, когда она
+        изображения. Если параметр page не передан, используется разбивка
+        по курсору (GET-параметр cursor, см. images/pagination.py).
+        Мы будем прорисовывать всю страницу целиком, когда она
         запрашивается браузером. Однако мы будем прорисовывать HTML только
         с новыми изображениями в случае запросов Fetch API, поскольку мы будем
     добавлять их в существующую HTML-страницу.
@@ -134,11 +326,36 @@ def image_list(request):
     Этот шаблон будет расширять шаблон base.html, чтобы отображать всю
     страницу целиком, и будет вставлять шаблон list_images.html, который
     будет вставлять список изображений.
+
+    На условный запрос с совпавшим ETag возвращается ответ 304 без
+    обращений к базе данных, а HTML карточек изображений берется из кеша
+    (см. images/http_cache.py).
     """
-    images = Image.objects.all()
-    paginator = Paginator(images, 8)
-    page = request.GET.get('page')
+    images = Image.objects.filter(status=Image.Status.READY)
     images_only = request.GET.get('images_only')
+    page = request.GET.get('page')
+    if page is None:
+        # Режим курсора: следующая страница выбирается по индексу -created
+        # (id разрешает совпадения), без COUNT(*) и OFFSET, поэтому
+        # глубокие страницы стоят столько же, сколько первая.
+        images = cursor_paginate(images,
+                                 request.GET.get('cursor'),
+                                 IMAGES_PER_PAGE)
+        if images_only and not images.object_list:
+            return HttpResponse('')
+        template = 'images/image/list_images.html' if images_only \
+            else 'images/image/list.html'
+        response = render(request,
+                          template,
+                          {'section': 'images',
+                           'images': images,
+                           'cards': http_cache.render_cards(images)})
+        # Токен следующей страницы передается сценарию прокрутки в заголовке
+        response['X-Next-Cursor'] = images.next_cursor or ''
+        return response
+
+    # Нумерованные страницы оставлены для совместимости со старыми ссылками
+    paginator = Paginator(images, IMAGES_PER_PAGE)
     try:
         images = paginator.page(page)
     except PageNotAnInteger:
@@ -151,23 +368,132 @@ def image_list(request):
             # то вернуть пустую страницу
             return HttpResponse('')
         images = paginator.page(paginator.num_pages)
-    if images_only:
-        return render(request,
-                      'images/image/list_images.html',
-                      {'section': 'images',
-                       'images': images})
+    template = 'images/image/list_images.html' if images_only \
+        else 'images/image/list.html'
     return render(request,
-                  'images/image/list.html',
+                  template,
                   {'section': 'images',
-                   'images': images})
+                   'images': images,
+                   'cards': http_cache.render_cards(images)})
+
+
+@login_required
+def image_import(request):
+    # Загрузка файла закладок (CSV, JSONL или экспорт браузера). Файл
+    # сохраняется, а импорт ставится в очередь и выполняется фоновым
+    # обработчиком; ответ 202 содержит адрес страницы прогресса. Параметр
+    # resume продолжает прерванный импорт с сохраненным или новым файлом.
+    if request.method != 'POST':
+        return render(request,
+                      'images/image/import.html',
+                      {'section': 'images',
+                       'imports': request.user.image_imports
+                                         .order_by('-created')[:10]})
+    upload = request.FILES.get('file')
+    resume = request.POST.get('resume')
+    if resume:
+        batch = get_object_or_404(ImportBatch, id=resume, user=request.user)
+        if not requeue_import(batch, upload):
+            return JsonResponse({'status': 'error',
+                                 'error': 'nothing to resume'},
+                                status=400)
+    elif upload is None:
+        return JsonResponse({'status': 'error', 'error': 'no file'},
+                            status=400)
+    else:
+        batch = queue_import(request.user, upload)
+    status_url = reverse('images:import_status', args=[batch.id])
+    response = JsonResponse({'status': 'ok',
+                             'id': batch.id,
+                             'state': batch.state,
+                             'status_url': status_url},
+                            status=202)
+    response['Location'] = status_url
+    return response
+
+
+@login_required
+def import_status(request, id):
+    # Прогресс импорта и скачивания, ошибки записей и скачивания
+    batch = get_object_or_404(ImportBatch, id=id, user=request.user)
+    return JsonResponse(import_report(batch))
+
+
+@login_required
+def image_export(request):
+    # Выгрузка закладок пользователя в JSONL или ZIP вместе с файлами.
+    # Ответ формируется генератором по мере чтения изображений из базы
+    # данных и файлов из хранилища (см. images/export.py)
+    format = request.GET.get('format')
+    if format not in export.FORMATS:
+        format = 'jsonl'
+    response = StreamingHttpResponse(
+        export.export_stream(request.user, format),
+        content_type=export.CONTENT_TYPES[format])
+    response['Content-Disposition'] = \
+        f'attachment; filename="bookmarks-{request.user.username}.{format}"'
+    return response
+
+
+@login_required
+def image_search(request):
+    # Поиск по заголовкам и описаниям изображений (см. images/search.py).
+    # Как и в image_list, следующая страница запрашивается сценарием
+    # прокрутки с параметром results_only и токеном из X-Next-Cursor
+    query = request.GET.get('q', '').strip()
+    results = search_backend.search(query,
+                                    request.GET.get('cursor'),
+                                    SEARCH_RESULTS_PER_PAGE)
+    results_only = request.GET.get('results_only')
+    if results_only and not results.object_list:
+        return HttpResponse('')
+    template = 'images/image/search_results.html' if results_only \
+        else 'images/image/search.html'
+    response = render(request,
+                      template,
+                      {'section': 'images',
+                       'query': query,
+                       'results': results})
+    response['X-Next-Cursor'] = results.next_cursor or ''
+    return response
+
+
+@login_required
+def image_status(request, id):
+    # Состояние скачивания изображения, которое опрашивает букмарклет
+    image = get_object_or_404(Image, id=id, user=request.user)
+    return JsonResponse({'id': image.id,
+                         'status': image.status,
+                         'url': image.get_absolute_url()})
+
+
+@user_passes_test(lambda user: user.is_staff)
+def ingest_stats(request):
+    # Глубина очереди и число обработчиков для планирования мощностей
+    return JsonResponse(queue_stats())
+
+
+@user_passes_test(lambda user: user.is_staff)
+def counter_stats(request):
+    # Размеры пачек и время сброса счетчиков просмотров в этом процессе
+    return JsonResponse(view_counter.metrics.as_dict())
+
+
+@user_passes_test(lambda user: user.is_staff)
+def cache_stats(request):
+    # Доля ответов 304 по страницам и попаданий в кеш карточек
+    # изображений в этом процессе
+    return JsonResponse(http_cache.metrics.as_dict())
 
 
 @login_required
 def image_ranking(request):
-    # Получить словарь рейтинга изображений
-    image_ranking = r.zrange('image_ranking', 0, -1,
-                             desc=True)[:10]
-    image_ranking_ids = [int(id) for id in image_ranking]
+    # Период рейтинга: за все время, скользящие 24h/7d/30d или trending.
+    # Первые 10 элементов выбираются на стороне Redis (см. images/ranking.py)
+    period = request.GET.get('period')
+    if period not in RANKING_PERIODS:
+        period = None
+    image_ranking_ids = ranking.top_ids(period, 10)
     # получить наиболее просматриваемые изображения
     most_viewed = list(Image.objects.filter(
         id__in=image_ranking_ids))
@@ -175,4 +501,6 @@ def image_ranking(request):
     return render(request,
                   'images/image/ranking.html',
                   {'section': 'images',
-                   'most_viewed': most_viewed})
+                   'most_viewed': most_viewed,
+                   'period': period,
+                   'periods': RANKING_PERIODS})